@@ -1,4 +1,5 @@
 import boto3
+import tag_codec
 from boto3.dynamodb.conditions import Key
 
 # DynamoDB boto3 client
@@ -6,19 +7,25 @@ ddb = boto3.resource('dynamodb')
 ddb_table_name = "images"
 table = ddb.Table(ddb_table_name)
 
-def add_ddb(user_id, thumbnail_url, current_tags, image_url):
+def add_ddb(user_id, thumbnail_url, current_tags, image_url, detections = None):
     '''
-    This function is to update the dynamodb table
+    This function is to update the dynamodb table, current_tags maps each tag to its count
     '''
+    item = {
+        'user_id': user_id,
+        'thumbnail_url':thumbnail_url, 
+        'image_url': image_url,
+        # Keeps tools/recompute_tags.py from overwriting the user's edits
+        'tags_edited': True
+    }
+    item.update(tag_codec.record_attributes(current_tags))
+
+    # Keeping the raw detections stored by the detector
+    if detections is not None:
+        item['detections'] = detections
+
     # DynamoDB put_item operation
-    response = table.put_item(
-        Item={
-            'user_id': user_id,
-            'thumbnail_url':thumbnail_url, 
-            'image_url': image_url,
-            'tags': current_tags  
-        }
-    )
+    response = table.put_item(Item=item)
     
     # returning true on postive update
     return (True,f"Records updated successfully for the user with user_id {user_id} and thumbnail_url:{thumbnail_url}")
@@ -51,15 +58,15 @@ def update_tag_by_thumbnail(user_id, request_body):
         if records["Count"] == 0:
             return (False,f"No records found for the user with user_id: {user_id} and thumbnail url: {thumbnail_url}")
         
-        # Fetching the existing tags for the image
-        current_tags = list(records['Items'][0]['tags'])
+        # Fetching the existing tags for the image, as a dict of tag to count
+        current_tags = tag_codec.record_tags(records['Items'][0])
         
         image_url = records['Items'][0]['image_url']
         
-        modified_tags = current_tags.copy()
+        modified_tags = dict(current_tags)
         
-        # Extract only the names from each string
-        object_names = [item.split(', ')[0] for item in current_tags]  # Split on comma and space, and take the first part
+        # Extract only the names of the tags
+        object_names = list(current_tags)
         
         # If the request is deletion and the tag requested does not exist as the current tag list then returning error
         if request_body['type'] == 0 and not set(request_body['tags']).issubset(object_names):
@@ -76,54 +83,16 @@ def update_tag_by_thumbnail(user_id, request_body):
         if request_body['type'] == 1:
             # For all the tags in the request body
             for tag in request_body['tags']:
-                found = False
-                # For all the tags in the database
-                for index, item in enumerate(current_tags):
-                    # Splitting the data across the delimiter
-                    parts = item.split(", ")
-                    stored_tag = parts[0]
-                    value = int(parts[1])
-                    
-                    # If the currrent tag is not same as the stored tag, then skip
-                    if tag.lower() != stored_tag.lower():
-                        continue
-                    
-                    # Else, the tag is found and update the value of the tags
-                    value +=1
-                    modified_tags[index] = f'{tag.lower()}, {value}'
-                    found = True    
-                    break
-                
-                # If the tag is not found at all, then append into the main list
-                if not found:
-                    modified_tags.append(f"{tag.lower()}, 1")
-            
-     
-            # Updating the current_tags set
-            current_tags = set(modified_tags)
+                # Incrementing the count of the tag, a new tag starts at 1
+                modified_tags[tag.lower()] = modified_tags.get(tag.lower(), 0) + 1
         elif request_body['type'] == 0:
-            # Updating the current_tags set
+            # For all the tags in the request body
             for tag in request_body['tags']:
-                # For all the tags in the database
-                for index, item in enumerate(current_tags):
-                    # Splitting the data across the delimiter
-                    parts = item.split(", ")
-                    stored_tag = parts[0]
-                    value = int(parts[1])
-                    
-                    # If the currrent tag is not same as the stored tag, then skip
-                    if tag.lower() != stored_tag.lower():
-                        continue
-                    
-                    # Removing the item under consideration from the modified_tags list
-                    modified_tags.remove(item)
-                    break
-                
-            # Updating the current_tags set      
-            current_tags = set(modified_tags)
+                # Removing the tag under consideration from the modified_tags
+                modified_tags.pop(tag.lower(), None)
 
-        # Updating the dynamodb    
-        add_ddb(user_id, thumbnail_url, current_tags, image_url)
+        # Updating the dynamodb, the tag index follows through the table's stream
+        add_ddb(user_id, thumbnail_url, modified_tags, image_url, records['Items'][0].get('detections'))
         
     return (True, f"Records updated successfully for the user with user_id {user_id}")
 
@@ -133,9 +102,9 @@ def validate_request_for_deletion(request_body, current_tags):
     '''
     # If the user is requesting to delete all tags related to the image, send error message 
     if (request_body['type'] == 0) and len(current_tags) == len(request_body['tags']):
-        return (False,f"The current tags:{current_tags} and requested_tag: {request_body['tags']} for deletion are identical, cannot delete all tags related to the image")
+        return (False,f"The current tags:{tag_codec.format_tags(current_tags)} and requested_tag: {request_body['tags']} for deletion are identical, cannot delete all tags related to the image")
     
-    return (True,f"The current tags:{current_tags} and requested_tag: {request_body['tags']} for deletion are identical")
+    return (True,f"The current tags:{tag_codec.format_tags(current_tags)} and requested_tag: {request_body['tags']} for deletion are identical")
     
 def run(event, _):
     """
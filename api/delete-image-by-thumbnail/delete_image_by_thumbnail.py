@@ -9,6 +9,12 @@ ddb = boto3.resource('dynamodb')
 ddb_table_name = "images"
 table = ddb.Table(ddb_table_name)
 
+# Prefix of the thumbnail renditions of every size and format
+renditions_prefix = "renditions"
+
+# Prefix of the renditions built on request by the resize endpoint
+derived_prefix = "derived"
+
 def get_records(user_id, thumbnail_url):
     '''
     This function is to fetch the records related to the user and thumbnail user provided
@@ -39,6 +45,20 @@ def delete_object_from_s3(bucket_name, key):
     # Deleting the files from the s3 bucket
     s3.delete_object(Bucket=bucket_name, Key=key)
 
+def delete_renditions_from_s3(bucket_name, image_key):
+    '''
+    Function to delete every rendition of an image, thumbnails stored under
+    renditions/<user_id>/<file name>/ and resized images stored under
+    derived/<image key>/
+    '''
+    user_id, file_name = image_key.split("/")[-2:]
+    paginator = s3.get_paginator("list_objects_v2")
+    for prefix in (f"{renditions_prefix}/{user_id}/{file_name}/", f"{derived_prefix}/{image_key}/"):
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            objects = [{"Key": entry["Key"]} for entry in page.get("Contents", [])]
+            if len(objects) != 0:
+                s3.delete_objects(Bucket=bucket_name, Delete={"Objects": objects, "Quiet": True})
+
 def delete_record_from_ddb(user_id, thumbnail_url):
     '''
     Function to delete record from the dynamodb
@@ -81,11 +101,14 @@ def run(event, _):
             
             # Deleting object from S3 thumbnails
             delete_object_from_s3(bucket_name, thumbnail_key)
+
+            # Deleting the other thumbnail sizes and formats and resized images
+            delete_renditions_from_s3(bucket_name, image_key)
             
             # Deleting from S3 images
             delete_object_from_s3(bucket_name, image_key)
              
-            # Delete record from dynamodb
+            # Delete record from dynamodb, the tag index follows through the table's stream
             delete_record_from_ddb(user_id, thumbnail_url)
             
         message =  f"Records deleted successfully for the user with user_id {user_id} and thumbnail_url:{request_body['url']}"
@@ -1,216 +1,49 @@
 import os
-import cv2
-import time
 import boto3
 import base64
 import numpy as np
-from boto3.dynamodb.conditions import Key
+import inference_profiles
+import model_registry
+import result_cache
+import tag_query
+import tag_bitmask_index
+import yolo_configs
+import yolo_detector
 
-# YOLO configs root path
-yolo_path = "/opt/yolo_tiny_configs"
+# Default inference profile, interactive search needs the fast one
+default_profile = inference_profiles.get_profile(fallback = "fast-320")
 
-# Yolov3-tiny configs
-labels_path = "coco.names"
-configs_path = "yolov3-tiny.cfg"
-weights_path = "yolov3-tiny.weights"
+# DynamoDB boto3 client, tags are looked up in the tag index table
+ddb = boto3.client('dynamodb')
 
-# Thresholds
-conf_threshold = 0.3
-nms_threshold = 0.1
+# S3 boto3 client, reads the bitmask index snapshots
+s3 = boto3.client('s3')
 
-# DynamoDB boto3 client
-ddb = boto3.resource('dynamodb')
-ddb_table_name = "images"
-table = ddb.Table(ddb_table_name)
+# Thumbnail URLs per response page, callers may ask for up to max_page_size
+default_page_size = int(os.environ.get("PIXTAG_SEARCH_PAGE_SIZE", "500"))
+max_page_size = int(os.environ.get("PIXTAG_SEARCH_MAX_PAGE_SIZE", "1000"))
 
 # Images S3 prefix
 images_prefix = "images"
 thumbnails_prefix = "thumbnails"
 
-def get_labels(labels_path):
-    """
-    Load the COCO class labels our YOLO model was trained on
-
-    Parameters
-    ----------
-    :param labels_path: path to class labels
-
-    Returns
-    -------
-    :return list of COCO labels
-    """
-
-    label_path = os.path.sep.join([yolo_path, labels_path])
-    labels = open(label_path).read().strip().split("\n")
-
-    return labels
-
-
-def get_weights(weights_path):
-    """
-    Derive the paths to the YOLO weights and model configuration
-
-    Parameters
-    ----------
-    :param weights_path: path to YOLO weights
-
-    Returns
-    -------
-    :return derived weights paths
-    """
-
-    weights_path = os.path.sep.join([yolo_path, weights_path])
-
-    return weights_path
-
-def get_config(config_path):
-    """
-    Derive the paths to the YOLO configs
-
-    Parameters
-    ----------
-    :param config_path: path to YOLO configs
-
-    Returns
-    -------
-    :return derived config paths
-    """
+# Get YOLO configs, PIXTAG_YOLO_PATH sets their root
+lables = yolo_configs.get_labels()
+configs = yolo_configs.get_config()
+weights = yolo_configs.get_weights()
 
-    config_path = os.path.sep.join([yolo_path, config_path])
+# Load the neural net once per container
+model = model_registry.load_model(configs, weights, size = default_profile["input_size"])
 
-    return config_path
-
-def load_model(config_path, weights_path):
-    """
-    Load our YOLO object detector trained on COCO dataset (80 classes)
-
-    Parameters
-    ----------
-    :param config_path: path to YOLO configs
-    :param weights_path: path to YOLO weights
-
-    Returns
-    -------
-    :return object detector model
-    """
-
-    print("Loading YOLO object detector ...")
-    net = cv2.dnn.readNetFromDarknet(config_path, weights_path)
-    return net
-
-def predict(image, net, labels):
-    """
-    Load our YOLO object detector trained on COCO dataset (80 classes)
-
-    Parameters
-    ----------
-    :param config_path: path to YOLO configs
-    :param weights_path: path to YOLO weights
-    """
-
-    (H, W) = image.shape[:2]
-    
-    # Determine only the *output* layer names that we need from YOLO
-    ln = net.getLayerNames()
-    ln = [ln[i - 1] for i in net.getUnconnectedOutLayers()]
-
-    # Construct a blob from the input image and then perform a forward
-    # pass of the YOLO object detector, giving us our bounding boxes and
-    # associated probabilities
-    blob = cv2.dnn.blobFromImage(image, 1 / 255.0, (416, 416),
-                                 swapRB = True, crop = False)
-    net.setInput(blob)
-    start = time.time()
-    layer_outputs = net.forward(ln)
-    end = time.time()
-
-    # Log timing information on YOLO
-    print("YOLO took {:.6f} seconds".format(end - start))
-
-    # Initialize our lists of detected bounding boxes, 
-    # confidences and class IDs respectively
-    boxes = []
-    confidences = []
-    class_ids = []
-
-    # Loop over each of the layer outputs
-    for output in layer_outputs:
-        # Loop over each of the detections
-        for detection in output:
-            # Extract the class ID and confidence (i.e., probability) of
-            # the current object detection
-            scores = detection[5:]
-            classID = np.argmax(scores)
-            confidence = scores[classID]
-
-            # Filter out weak predictions by ensuring the detected
-            # probability is greater than the minimum probability
-            if confidence > conf_threshold:
-                # Scale the bounding box coordinates back relative to the
-                # size of the image, keeping in mind that YOLO actually
-                # returns the center (x, y)-coordinates of the bounding
-                # box followed by the boxes' width and height
-                box = detection[0:4] * np.array([W, H, W, H])
-                (centerX, centerY, width, height) = box.astype("int")
-
-                # Use the center (x, y)-coordinates to derive the top and
-                # and left corner of the bounding box
-                x = int(centerX - (width / 2))
-                y = int(centerY - (height / 2))
-
-                # Update our list of bounding box coordinates, 
-                # confidences and class IDs
-                boxes.append([x, y, int(width), int(height)])
-                confidences.append(float(confidence))
-                class_ids.append(classID)
-
-    # Apply non-maxima suppression to suppress weak, overlapping bounding boxes
-    idxs = cv2.dnn.NMSBoxes(boxes, confidences, conf_threshold, nms_threshold)
-
-    # Reponse object dictionary placeholder
-    tags = list()
-    
-    # Ensure at least one detection exists
-    if len(idxs) > 0:
-        # Loop over the indexes we are keeping
-        # Create object_list placeholder list
-        objects_list = list()
-        for i in idxs.flatten():
-
-            # Retain tags with greater than 0.6 confidence
-            if confidences[i] > 0.6:
-                tags.append(labels[class_ids[i]])
-            
-    return tags
-
-def resolve_tags(tag):
-    """
-    Resolve tag string to tags and count
-
-    Parameters
-    ----------
-    :param tag: tag string to resolve
-
-    Returns
-    -------
-    :return tag, count
-    """
-
-    tags = tag.split(",")
-    if len(tags) == 1:
-        return tags[0].strip(), 1
-    else:
-        return tags[0].strip(), int(tags[1].strip())
-
-# Get YOLO configs
-lables = get_labels(labels_path)
-configs = get_config(configs_path)
-weights = get_weights(weights_path)
+# Detected tags keyed by image content hash
+tag_cache = result_cache.from_environment()
 
 def run(event, _):
     """
     A lambda function to detect objects in a given image
-    and search for images based on tags
+    and search for images sharing its tags, ranked by the number of
+    shared tags. Results are paged like
+    search_by_tags, with "page_size", "cursor" and "next_cursor".
     """
     
     empty_request = False
@@ -236,34 +69,58 @@ def run(event, _):
             response["body"] = response_body.__str__()
             return response
             
-        # Convert base64 image string to OpenCV image
-        print("Converting to OpenCV image")
-        image = np.frombuffer(base64.b64decode(request_body["image"]), np.uint8)
-        image = cv2.imdecode(image, flags = cv2.COLOR_BGR2RGB)
-        
-        # Load the neural net
-        print("Loading model")
-        nets = load_model(configs, weights)
-        
-        # Perform predictions
-        print("Getting predictions")
-        upload_image_tags = list(set(predict(image, nets, lables)))
+        # Resolve the inference profile, callers may ask for a named one
+        profile = default_profile
+        if request_body.get("profile"):
+            if request_body["profile"] not in inference_profiles.profiles:
+                response["statusCode"] = 400
+                response_body["message"] = (f"Unknown inference profile: {request_body['profile']}. "
+                                            f"Available profiles: {', '.join(inference_profiles.profiles)}")
+                response["body"] = response_body.__str__()
+                return response
+            profile = inference_profiles.get_profile(request_body["profile"])
+
+        # Resolve the page to read before running detection, a bad page
+        # size or cursor is the caller's error
+        try:
+            page_size, offset = tag_query.read_page(request_body, default_page_size, max_page_size)
+        except ValueError as e:
+            response["statusCode"] = 400
+            response_body["message"] = str(e)
+            response["body"] = response_body.__str__()
+            return response
+
+        # Look the image up in the tag cache before running detection
+        image_bytes = base64.b64decode(request_body["image"])
+        cache_key = result_cache.content_key(image_bytes, profile["name"])
+        upload_image_tags = tag_cache.get(cache_key)
+
+        if upload_image_tags is None:
+            # Convert image bytes to OpenCV image
+            print("Converting to OpenCV image")
+            image = np.frombuffer(image_bytes, np.uint8)
+            image, tiled = yolo_detector.decode_for_detection(image, profile)
+
+            # Perform predictions
+            print(f"Getting predictions with profile: {profile['name']}")
+            upload_image_tags = list(set(yolo_detector.predict(image, model, lables, profile, tiled = tiled)))
+            print(f"Model timing: {model_registry.get_stats()}")
+            tag_cache.put(cache_key, upload_image_tags)
+
+        print(f"Tag cache stats: {tag_cache.stats}")
         print(f"Unique tags in uploaded image: {upload_image_tags}")
 
-        # Get all images records for the given user
-        records = table.query(
-            KeyConditionExpression = Key('user_id').eq(user_id)
-        )
-    
+        # Rank the images sharing the most tags with the uploaded image
         print("Checking of matching thumbnail image urls")
-        for record in records["Items"]:
-            image_tags = list(record["tags"])
-            for tag in image_tags:
-                image_tag_name, image_tag_count = resolve_tags(tag)
-                for upload_image_tag in upload_image_tags:
-                    if upload_image_tag.strip() != "":
-                        if upload_image_tag == image_tag_name:
-                            image_urls.append(record["thumbnail_url"])
+        ranked = list()
+        if len(upload_image_tags) != 0:
+            query = tag_query.parse_request(upload_image_tags)
+            ranked = tag_bitmask_index.search(s3, ddb, user_id, query)
+
+        page, next_cursor = tag_query.get_page(ranked, page_size, offset)
+        image_urls = [thumbnail_url for thumbnail_url, _ in page]
+        if next_cursor is not None:
+            response_body["next_cursor"] = next_cursor
         
         print(f"Matching image thumbnail urls found: {image_urls}")
         if len(image_urls) != 0: 
@@ -1,34 +1,26 @@
+import os
 import boto3
-from boto3.dynamodb.conditions import Key
+import tag_query
+import tag_bitmask_index
 
 
-# DynamoDB boto3 client
-ddb = boto3.resource('dynamodb')
-ddb_table_name = "images"
-table = ddb.Table(ddb_table_name)
+# DynamoDB boto3 client, tags are looked up in the tag index table
+ddb = boto3.client('dynamodb')
 
-def resolve_tags(tag):
-    """
-    Resolve tag string to tags and count
-
-    Parameters
-    ----------
-    :param tag: tag string to resolve
+# S3 boto3 client, reads the bitmask index snapshots
+s3 = boto3.client('s3')
 
-    Returns
-    -------
-    :return tag, count
-    """
-
-    tags = tag.split(",")
-    if len(tags) == 1:
-        return tags[0].strip(), 1
-    else:
-        return tags[0].strip(), int(tags[1].strip())
+# Thumbnail URLs per response page, callers may ask for up to max_page_size
+default_page_size = int(os.environ.get("PIXTAG_SEARCH_PAGE_SIZE", "500"))
+max_page_size = int(os.environ.get("PIXTAG_SEARCH_MAX_PAGE_SIZE", "1000"))
 
 def run(event, _):
     """
-    This function searches for images based on tags
+    This function searches for images based on tags. Every entry of "tags"
+    is a query such as "person>=2 AND dog" or "cat, 2" and images matching
+    any of them are returned once, ranked by how well they match. Results
+    are paged by "page_size", "next_cursor" is set when more remain and is
+    sent back as "cursor" for the next page.
     """
 
     empty_tags = False
@@ -64,20 +56,23 @@ def run(event, _):
             response["body"] = response_body.__str__()
             return response
             
-        # Get all images records for an user
-        records = table.query(
-            KeyConditionExpression = Key('user_id').eq(user_id)
-        )
-    
-        for record in records["Items"]:
-            image_tags = list(record["tags"])
-            for tag in image_tags:
-                image_tag_name, image_tag_count = resolve_tags(tag)
-                for request_tags in list(request_body["tags"]):
-                    if request_tags.strip() != "":
-                        request_tag_name, request_tag_count = resolve_tags(request_tags)
-                        if (request_tag_name == image_tag_name) & (image_tag_count >= request_tag_count):
-                            image_urls.append(record["thumbnail_url"])
+        # Resolve the page to read, a bad page size or cursor is the caller's error
+        try:
+            page_size, offset = tag_query.read_page(request_body, default_page_size, max_page_size)
+        except ValueError as e:
+            response["statusCode"] = 400
+            response_body["message"] = str(e)
+            response["body"] = response_body.__str__()
+            return response
+
+        # Parse the request once, then rank the unique matching images
+        query = tag_query.parse_request(request_body["tags"])
+        ranked = tag_bitmask_index.search(s3, ddb, user_id, query)
+
+        page, next_cursor = tag_query.get_page(ranked, page_size, offset)
+        image_urls = [thumbnail_url for thumbnail_url, _ in page]
+        if next_cursor is not None:
+            response_body["next_cursor"] = next_cursor
         
         if len(image_urls) != 0: 
             response_body["links"] = image_urls
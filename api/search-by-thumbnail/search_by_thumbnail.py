@@ -7,25 +7,6 @@ ddb = boto3.resource('dynamodb')
 ddb_table_name = "images"
 table = ddb.Table(ddb_table_name)
 
-def resolve_tags(tag):
-    """
-    Resolve tag string to tags and count
-
-    Parameters
-    ----------
-    :param tag: tag string to resolve
-
-    Returns
-    -------
-    :return tag, count
-    """
-
-    tags = tag.split(",")
-    if len(tags) == 1:
-        return tags[0].strip(), 1
-    else:
-        return tags[0].strip(), int(tags[1].strip())
-
 def run(event, _):
     """
     This function searches for images based on tags
@@ -1,6 +1,5 @@
 import json
 import boto3
-from boto3.dynamodb.conditions import Key
 
 # DynamoDB boto3 client
 ddb = boto3.resource('dynamodb')
@@ -16,13 +15,14 @@ def get_records(user_id):
     '''
     This function is to fetch the records related to the user and thumbnail user provided
     '''
-    # Fetching the records for the user
-    records = table.query(
-            KeyConditionExpression = Key('user_id').eq(user_id)
+    # Fetching the subscription of the user, keyed by user_id alone
+    record = table.get_item(
+            Key = {'user_id': user_id},
+            ProjectionExpression = 'subscribed_tags'
         )
     
-    # returning the records fetched  
-    return records
+    # returning the record fetched, or None if the user has none
+    return record.get("Item")
     
     
 def add_ddb(user_id, subscribed_tags):
@@ -87,11 +87,11 @@ def run(event, _):
         request_body = eval(event['body'])
         
          # Fetching the record details from the dynamodb
-        records = get_records(user_id)
+        record = get_records(user_id)
         
         subscribed_tags = []
-        if records["Count"] != 0:
-            subscribed_tags = list(records['Items'][0]['subscribed_tags'])  
+        if record is not None:
+            subscribed_tags = list(record['subscribed_tags'])
             
          # For all the urls in the request body
         for tag in request_body['tags']:
@@ -0,0 +1,172 @@
+"""
+Forward pass latency of every inference engine, thread count and graph
+optimization level, to pick the fastest CPU engine for a Lambda memory size.
+
+Lambda gives a function one vCPU per 1769 MB of memory, up to six. Each
+thread count is reported with the smallest memory size that provides that
+many vCPUs. With --pin, each run is also limited to that many CPUs of this
+machine. Outputs are compared with the first configuration, so an engine
+that disagrees with the reference shows up next to its timing. Without
+--weights, a random-weight model is generated. Without --onnx, the model is
+exported with tools/export_onnx.py for the onnxruntime engine, which needs
+the optional onnx and onnxruntime packages.
+
+Usage: python benchmarks/bench_engines.py [--engines opencv,onnxruntime]
+       [--threads 1,2,4,6] [--optimizations all,disabled] [--size 416]
+       [--weights yolov3-tiny.weights] [--onnx yolov3-tiny.onnx]
+       [--runs 20] [--pin] [--output results.json]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "layers", "pixtag-common", "python"))
+
+import cv2
+import synthetic
+import inference_engines
+
+# Bundled YOLO configs
+configs_root = os.path.join(root, "lambdas", "object-detect-lambda", "yolo_tiny_configs")
+
+# Lambda memory per vCPU and the vCPU limit
+lambda_mb_per_vcpu = 1769
+lambda_max_vcpus = 6
+lambda_max_mb = 10240
+
+def lambda_memory(threads):
+    """
+    Smallest Lambda memory size in MB that provides a number of vCPUs
+    """
+
+    if threads >= lambda_max_vcpus:
+        return lambda_max_mb
+
+    return threads * lambda_mb_per_vcpu
+
+def time_engine(engine, blob, runs):
+    """
+    Time the forward pass of an engine on one blob
+
+    Returns
+    -------
+    :return list of latencies in seconds, outputs of the last run
+    """
+
+    # Warm up before timing
+    outputs = engine.forward(blob)
+
+    latencies = list()
+    for _ in range(runs):
+        start = time.perf_counter()
+        outputs = engine.forward(blob)
+        latencies.append(time.perf_counter() - start)
+
+    return latencies, outputs
+
+def max_difference(outputs, reference):
+    """
+    Largest absolute difference between two sets of layer outputs
+    """
+
+    return float(max(np.max(np.abs(np.asarray(output) - np.asarray(expected)))
+                     for output, expected in zip(outputs, reference)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", default = ",".join(inference_engines.engines))
+    parser.add_argument("--threads", default = "1,2,4,6")
+    parser.add_argument("--optimizations", default = "all,disabled")
+    parser.add_argument("--size", type = int, default = 416, help = "input size of the blob")
+    parser.add_argument("--config", default = os.path.join(configs_root, "yolov3-tiny.cfg"))
+    parser.add_argument("--weights", help = "path to yolov3-tiny.weights, random weights when missing")
+    parser.add_argument("--onnx", help = "ONNX export of the model for the onnxruntime engine")
+    parser.add_argument("--runs", type = int, default = 20)
+    parser.add_argument("--pin", action = "store_true", help = "limit each run to as many CPUs as threads")
+    parser.add_argument("--output", help = "write results as JSON to this path")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix = "pixtag-benchmark-")
+    weights_path = args.weights
+    if weights_path is None:
+        weights_path = os.path.join(workdir, "yolov3-tiny.weights")
+        synthetic.write_random_weights(args.config, weights_path)
+
+    onnx_path = args.onnx
+    if onnx_path is None and "onnxruntime" in args.engines.split(","):
+        try:
+            sys.path.insert(0, os.path.join(root, "tools"))
+            import onnx
+            import export_onnx
+            onnx_path = os.path.join(workdir, "yolov3-tiny.onnx")
+            onnx.save(export_onnx.export(args.config, weights_path), onnx_path)
+        except ImportError as e:
+            print(f"Cannot export the ONNX model: {e}")
+
+    blob = cv2.dnn.blobFromImage(synthetic.make_image(640, 480), 1 / 255.0, (args.size, args.size),
+                                 swapRB = True, crop = False)
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+
+    results = list()
+    reference = None
+    for name in args.engines.split(","):
+        for optimization in args.optimizations.split(","):
+            for threads in (int(value) for value in args.threads.split(",")):
+                if args.pin and cpus is not None:
+                    os.sched_setaffinity(0, cpus[:threads])
+
+                try:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        start = time.perf_counter()
+                        engine = inference_engines.create_engine(name, args.config, weights_path, threads = threads,
+                                                                 optimization = optimization, onnx_path = onnx_path)
+                        load_seconds = time.perf_counter() - start
+                except Exception as e:
+                    print(f"Skipping {name} with {threads} threads and {optimization} optimization: {e}")
+                    continue
+
+                latencies, outputs = time_engine(engine, blob, args.runs)
+                if reference is None:
+                    reference = outputs
+
+                results.append({
+                    "engine": name,
+                    "threads": threads,
+                    "optimization": optimization,
+                    "lambda_memory_mb": lambda_memory(threads),
+                    "load_ms": load_seconds * 1000,
+                    "p50_ms": float(np.percentile(latencies, 50) * 1000),
+                    "p95_ms": float(np.percentile(latencies, 95) * 1000),
+                    "max_difference": max_difference(outputs, reference)
+                })
+
+    if cpus is not None and args.pin:
+        os.sched_setaffinity(0, cpus)
+    shutil.rmtree(workdir)
+
+    print(f"Input {args.size}x{args.size}, {args.runs} runs, differences against the first configuration")
+    print("{:<12} {:>8} {:>12} {:>10} {:>10} {:>10} {:>10}".format(
+        "engine", "threads", "optimization", "lambda MB", "p50 ms", "p95 ms", "max diff"))
+    for result in results:
+        print("{:<12} {:>8} {:>12} {:>10} {:>10.2f} {:>10.2f} {:>10.2e}".format(
+            result["engine"], result["threads"], result["optimization"], result["lambda_memory_mb"],
+            result["p50_ms"], result["p95_ms"], result["max_difference"]))
+
+    # Fastest configuration for every memory size
+    for memory in sorted(set(result["lambda_memory_mb"] for result in results)):
+        fastest = min((result for result in results if result["lambda_memory_mb"] == memory), key = lambda r: r["p50_ms"])
+        print(f"Fastest at {memory} MB: {fastest['engine']} with {fastest['threads']} threads "
+              f"and {fastest['optimization']} optimization, p50 {fastest['p50_ms']:.2f} ms")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent = 2)
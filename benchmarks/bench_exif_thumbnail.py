@@ -0,0 +1,131 @@
+"""
+Check the Exif preview fast path of generate_thumbnail against sample JPEGs.
+
+Each image goes through the fast path, reading only the leading bytes, and
+through the full decode path. The report gives the hit rate, bytes read,
+time taken and mean pixel difference of the thumbnails from both paths.
+Without --images, generated JPEGs with previews of several sizes, aspect
+ratios and orientations are used.
+
+Usage: python benchmarks/bench_exif_thumbnail.py [--images DIR] [--size 150]
+       [--runs 5] [--output results.json]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import numpy as np
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "layers", "pixtag-common", "python"))
+
+import synthetic
+import thumbnails
+import exif_thumbnail
+
+def load_images(images_dir):
+    """
+    Read every JPEG of a directory
+
+    Returns
+    -------
+    :return list of (name, JPEG bytes) tuples
+    """
+
+    images = list()
+    for file_name in sorted(os.listdir(images_dir)):
+        if file_name.lower().endswith((".jpg", ".jpeg")):
+            with open(os.path.join(images_dir, file_name), "rb") as image_file:
+                images.append((file_name, image_file.read()))
+
+    return images
+
+def generate_images():
+    """
+    Generate JPEGs covering the cases the fast path has to tell apart
+
+    Returns
+    -------
+    :return list of (name, JPEG bytes) tuples
+    """
+
+    images = list()
+    for width, height, preview_width, preview_height, orientation in [
+            (4032, 3024, 160, 120, 1), (4032, 3024, 160, 120, 6), (4032, 3024, 320, 240, 3),
+            (4000, 2250, 160, 120, 1), (4000, 2250, 160, 90, 8), (3000, 3000, 120, 120, 1)]:
+        data = synthetic.make_exif_jpeg(width, height, preview_width, preview_height, orientation)
+        images.append((f"{width}x{height}-preview-{preview_width}x{preview_height}-o{orientation}", data))
+    images.append(("4032x3024-no-exif", synthetic.make_jpeg(4032, 3024).tobytes()))
+
+    return images
+
+def time_path(function, runs):
+    """
+    Time a function, returning its last result and the median time in seconds
+    """
+
+    timings = list()
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+
+    return result, float(np.median(timings))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help = "directory of sample JPEGs, generated ones when missing")
+    parser.add_argument("--size", type = int, default = thumbnails.thumbnail_px, help = "largest thumbnail size")
+    parser.add_argument("--runs", type = int, default = 5)
+    parser.add_argument("--output", help = "write results as JSON to this path")
+    args = parser.parse_args()
+
+    images = load_images(args.images) if args.images else generate_images()
+
+    results = list()
+    for name, data in images:
+        head = data[:exif_thumbnail.exif_range_bytes]
+        buffer = np.frombuffer(data, dtype = np.uint8)
+
+        with contextlib.redirect_stdout(io.StringIO()) as log:
+            preview, fast_seconds = time_path(lambda: exif_thumbnail.get_preview(head, args.size), args.runs)
+            image, full_seconds = time_path(lambda: thumbnails.decode_for_thumbnails(buffer, [args.size]), args.runs)
+
+        result = {
+            "image": name,
+            "hit": preview is not None,
+            "reason": log.getvalue().strip().split("\n")[0],
+            "file_bytes": len(data),
+            "fast_bytes": len(head),
+            "fast_ms": fast_seconds * 1000,
+            "full_ms": full_seconds * 1000
+        }
+
+        if preview is not None:
+            fast = thumbnails.make_thumbnail(preview, args.size)
+            full = thumbnails.make_thumbnail(image, args.size)
+            result["difference"] = float(np.abs(fast.astype(int) - full).mean()) if fast.shape == full.shape else None
+
+        results.append(result)
+
+    print("{:<40} {:>5} {:>10} {:>10} {:>9} {:>9} {:>6}".format(
+        "image", "hit", "file KB", "read KB", "fast ms", "full ms", "diff"))
+    for result in results:
+        difference = result.get("difference")
+        print("{:<40} {:>5} {:>10.0f} {:>10.0f} {:>9.2f} {:>9.2f} {:>6}".format(
+            result["image"][:40], "yes" if result["hit"] else "no", result["file_bytes"] / 1024,
+            (result["fast_bytes"] if result["hit"] else result["fast_bytes"] + result["file_bytes"]) / 1024,
+            result["fast_ms"], result["full_ms"], "-" if difference is None else f"{difference:.2f}"))
+        if not result["hit"]:
+            print(f"    {result['reason']}")
+
+    hits = sum(result["hit"] for result in results)
+    print(f"Fast path used for {hits}/{len(results)} images at {args.size}px")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent = 2)
@@ -0,0 +1,293 @@
+"""
+Offline benchmark of the detection pipeline with a random-weight yolov3-tiny
+model and synthetic JPEGs, no real weights or AWS needed.
+
+Decode, blob creation, forward pass, post-processing and NMS are timed
+separately for every image size, followed by the full generate_thumbnail,
+detect_object, ingest_image and search_by_image handlers running against
+in-memory S3/DynamoDB stand-ins.
+Results are written as JSON. With --baseline, the run fails when any p50
+is slower than the baseline by more than --max-regression.
+
+Usage: python benchmarks/bench_pipeline.py [--runs 10] [--profile default-416]
+       [--sizes 640x480,1920x1080,4032x3024] [--output results.json]
+       [--baseline previous.json] [--max-regression 0.2]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import base64
+import argparse
+import tempfile
+import platform
+import contextlib
+import numpy as np
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "layers", "pixtag-common", "python"))
+
+import cv2
+import botocore.exceptions
+import synthetic
+import image_decode
+import model_registry
+import yolo_detector
+import inference_profiles
+
+# Bundled YOLO configs
+configs_root = os.path.join(root, "lambdas", "object-detect-lambda", "yolo_tiny_configs")
+
+class StandInBody:
+    """
+    Minimal S3 streaming body
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+class StandInS3:
+    """
+    In-memory S3 client serving a single image for every key
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def get_object(self, Bucket, Key, **kwargs):
+        return {"Body": StandInBody(self.data), "ContentLength": len(self.data)}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        return {}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, **kwargs):
+        return [{"KeyCount": 0}]
+
+class StandInSnapshots:
+    """
+    In-memory S3 client without any bitmask index snapshot
+    """
+
+    exceptions = botocore.exceptions
+
+    def get_object(self, Bucket, Key, **kwargs):
+        raise botocore.exceptions.ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+
+class StandInDynamoDB:
+    """
+    In-memory DynamoDB client and table
+    """
+
+    def batch_write_item(self, RequestItems):
+        return {"UnprocessedItems": {}}
+
+    def query(self, **kwargs):
+        return {"Items": [], "Count": 0}
+
+def summarize(timings):
+    """
+    Summarize a list of timings in seconds
+
+    Returns
+    -------
+    :return dictionary of p50, p95 and mean in milliseconds
+    """
+
+    return {
+        "p50_ms": float(np.percentile(timings, 50) * 1000),
+        "p95_ms": float(np.percentile(timings, 95) * 1000),
+        "mean_ms": float(np.mean(timings) * 1000)
+    }
+
+def time_stages(buffer, model, labels, profile, runs):
+    """
+    Time every detection stage separately on one encoded image
+
+    Returns
+    -------
+    :return dictionary of stage summaries
+    """
+
+    timings = {stage: list() for stage in ("decode", "blob", "forward", "postprocess", "nms")}
+    size = profile["input_size"]
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        image = image_decode.decode_image(buffer, size, size)
+        timings["decode"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        blob = cv2.dnn.blobFromImage(image, 1 / 255.0, (size, size), swapRB = True, crop = False)
+        timings["blob"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        layer_outputs = model_registry.forward(model, blob)
+        timings["forward"].append(time.perf_counter() - start)
+
+        (H, W) = image.shape[:2]
+        start = time.perf_counter()
+        boxes, confidences, class_ids = yolo_detector.decode_outputs(layer_outputs, W, H, profile["conf_threshold"])
+        timings["postprocess"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        yolo_detector.non_max_suppression(boxes, confidences, class_ids, profile["conf_threshold"],
+                                          profile["nms_threshold"])
+        timings["nms"].append(time.perf_counter() - start)
+
+    return {stage: summarize(values) for stage, values in timings.items()}
+
+def time_handlers(buffer, runs):
+    """
+    Time the full generate_thumbnail, detect_object, ingest_image and
+    search_by_image handlers against in-memory stand-ins for S3 and DynamoDB
+
+    Returns
+    -------
+    :return dictionary of handler summaries
+    """
+
+    import detect_object
+    import ingest_image
+    import result_cache
+    import search_by_image
+    import generate_thumbnail
+
+    data = buffer.tobytes()
+    for handler in (detect_object, ingest_image, generate_thumbnail):
+        handler.s3 = StandInS3(data)
+    detect_object.ddb = StandInDynamoDB()
+    ingest_image.ddb = StandInDynamoDB()
+    search_by_image.ddb = StandInDynamoDB()
+    search_by_image.s3 = StandInSnapshots()
+
+    # Measure inference, not the result cache
+    search_by_image.tag_cache = result_cache.ResultCache([])
+
+    detect_event = {"Records": [{"s3": {"bucket": {"name": "benchmark"}, "object": {"key": "images/user/image.jpg"}}}]}
+    search_event = {
+        "requestContext": {"authorizer": {"claims": {"cognito:username": "user"}}},
+        "body": str({"image": base64.b64encode(data).decode()})
+    }
+
+    timings = {"generate_thumbnail.run": list(), "detect_object.run": list(), "ingest_image.run": list(),
+               "search_by_image.run": list()}
+    for _ in range(runs):
+        start = time.perf_counter()
+        generate_thumbnail.run(detect_event, None)
+        timings["generate_thumbnail.run"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        detect_object.run(detect_event, None)
+        timings["detect_object.run"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        ingest_image.run(detect_event, None)
+        timings["ingest_image.run"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        search_by_image.run(search_event, None)
+        timings["search_by_image.run"].append(time.perf_counter() - start)
+
+    return {handler: summarize(values) for handler, values in timings.items()}
+
+def find_regressions(results, baseline, max_regression):
+    """
+    Compare the p50 of every timing with a baseline run
+
+    Returns
+    -------
+    :return list of regression descriptions
+    """
+
+    regressions = list()
+    for size, stages in results["sizes"].items():
+        for stage, summary in stages.items():
+            previous = baseline.get("sizes", {}).get(size, {}).get(stage)
+            if previous is None:
+                continue
+            if summary["p50_ms"] > previous["p50_ms"] * (1 + max_regression):
+                regressions.append(f"{size} {stage}: {previous['p50_ms']:.2f} ms -> {summary['p50_ms']:.2f} ms")
+
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type = int, default = 10)
+    parser.add_argument("--profile", default = inference_profiles.default_profile)
+    parser.add_argument("--sizes", default = "640x480,1920x1080,4032x3024")
+    parser.add_argument("--output", help = "write results as JSON to this path")
+    parser.add_argument("--baseline", help = "JSON results of a previous run to compare with")
+    parser.add_argument("--max-regression", type = float, default = 0.2,
+                        help = "allowed p50 slowdown against the baseline, 0.2 is 20%%")
+    parser.add_argument("--skip-handlers", action = "store_true", help = "only time the pipeline stages")
+    args = parser.parse_args()
+
+    profile = inference_profiles.get_profile(args.profile)
+    sizes = [tuple(int(value) for value in size.split("x")) for size in args.sizes.split(",")]
+
+    # Lay out a YOLO configs directory with generated weights
+    workdir = tempfile.mkdtemp(prefix = "pixtag-benchmark-")
+    for file_name in ("yolov3-tiny.cfg", "coco.names"):
+        shutil.copy(os.path.join(configs_root, file_name), workdir)
+    weights_path = os.path.join(workdir, "yolov3-tiny.weights")
+    synthetic.write_random_weights(os.path.join(workdir, "yolov3-tiny.cfg"), weights_path)
+
+    labels = open(os.path.join(workdir, "coco.names")).read().strip().split("\n")
+
+    results = {
+        "profile": profile["name"],
+        "runs": args.runs,
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "opencv": cv2.__version__},
+        "sizes": dict()
+    }
+
+    # Keep the per-call logging of the pipeline out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        model = model_registry.load_model(os.path.join(workdir, "yolov3-tiny.cfg"), weights_path,
+                                          warm = True, size = profile["input_size"])
+        results["model_load_ms"] = (time.perf_counter() - start) * 1000
+
+        if not args.skip_handlers:
+            os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+            os.environ["PIXTAG_YOLO_PATH"] = workdir
+            os.environ["PIXTAG_INFERENCE_PROFILE"] = profile["name"]
+            sys.path.insert(0, os.path.join(root, "lambdas", "object-detect-lambda"))
+            sys.path.insert(0, os.path.join(root, "lambdas", "ingest-image-lambda"))
+            sys.path.insert(0, os.path.join(root, "lambdas", "generate-thumbnail-lambda"))
+            sys.path.insert(0, os.path.join(root, "api", "search-by-image"))
+
+        for (width, height) in sizes:
+            buffer = synthetic.make_jpeg(width, height)
+            timings = time_stages(buffer, model, labels, profile, args.runs)
+            if not args.skip_handlers:
+                timings.update(time_handlers(buffer, args.runs))
+            results["sizes"][f"{width}x{height}"] = timings
+
+    shutil.rmtree(workdir)
+
+    print(f"Profile {profile['name']}, {args.runs} runs, model load {results['model_load_ms']:.1f} ms")
+    print("{:<12} {:<22} {:>10} {:>10}".format("size", "stage", "p50 ms", "p95 ms"))
+    for size, stages in results["sizes"].items():
+        for stage, summary in stages.items():
+            print("{:<12} {:<22} {:>10.2f} {:>10.2f}".format(size, stage, summary["p50_ms"], summary["p95_ms"]))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent = 2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.max_regression)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        sys.exit(1 if regressions else 0)
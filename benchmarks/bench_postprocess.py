@@ -0,0 +1,146 @@
+"""
+Micro-benchmark of YOLO post-processing: the original per-row Python loop
+against the vectorized decode in yolo_detector, on synthetic output tensors
+shaped like yolov3-tiny at a 416x416 input (507 and 2028 rows of 85 values).
+
+Usage: python benchmarks/bench_postprocess.py [--runs 200] [--seed 0]
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "layers", "pixtag-common", "python"))
+
+import cv2
+import yolo_detector
+
+# Output rows of yolov3-tiny per output layer at a 416x416 input
+output_rows = [507, 2028]
+num_classes = 80
+
+def make_outputs(rng, rows = output_rows, positive_ratio = 0.03):
+    """
+    Generate YOLO output layers with a realistic share of confident rows
+
+    Parameters
+    ----------
+    :param rng: numpy random generator
+    :param rows: number of rows of each output layer
+    :param positive_ratio: share of rows carrying a confident detection
+
+    Returns
+    -------
+    :return list of float32 output arrays
+    """
+
+    outputs = list()
+    for count in rows:
+        output = np.zeros((count, 5 + num_classes), dtype = np.float32)
+        output[:, 0:2] = rng.random((count, 2))
+        output[:, 2:4] = rng.random((count, 2)) * 0.5
+        output[:, 4] = rng.random(count) * 0.2
+
+        # Scatter confident detections of a few classes over the grid
+        positives = rng.random(count) < positive_ratio
+        classes = rng.integers(0, 8, size = positives.sum())
+        output[positives, 4] = rng.uniform(0.3, 1.0, size = positives.sum())
+        output[positives, 5 + classes] = rng.uniform(0.2, 1.0, size = positives.sum())
+        outputs.append(output)
+
+    return outputs
+
+def legacy_predict(layer_outputs, W, H, labels, conf_threshold, nms_threshold):
+    """
+    The per-row post-processing loop predict() used before vectorization
+    """
+
+    boxes = []
+    confidences = []
+    class_ids = []
+
+    for output in layer_outputs:
+        for detection in output:
+            scores = detection[5:]
+            classID = np.argmax(scores)
+            confidence = scores[classID]
+
+            if confidence > conf_threshold:
+                box = detection[0:4] * np.array([W, H, W, H])
+                (centerX, centerY, width, height) = box.astype("int")
+                x = int(centerX - (width / 2))
+                y = int(centerY - (height / 2))
+                boxes.append([x, y, int(width), int(height)])
+                confidences.append(float(confidence))
+                class_ids.append(classID)
+
+    idxs = cv2.dnn.NMSBoxes(boxes, confidences, conf_threshold, nms_threshold)
+
+    tags = list()
+    if len(idxs) > 0:
+        for i in idxs.flatten():
+            if confidences[i] > yolo_detector.tag_threshold:
+                tags.append(labels[class_ids[i]])
+
+    return tags
+
+def vectorized_predict(layer_outputs, W, H, labels, conf_threshold, nms_threshold):
+    """
+    The vectorized post-processing of yolo_detector.predict()
+    """
+
+    boxes, confidences, class_ids = yolo_detector.decode_outputs(layer_outputs, W, H, conf_threshold)
+    idxs = yolo_detector.non_max_suppression(boxes, confidences, class_ids, conf_threshold, nms_threshold)
+
+    return [labels[class_ids[i]] for i in idxs if confidences[i] > yolo_detector.tag_threshold]
+
+def time_runs(function, samples, runs):
+    """
+    Time a post-processing function over the samples
+
+    Returns
+    -------
+    :return list of per-call timings in seconds
+    """
+
+    timings = list()
+    for i in range(runs):
+        layer_outputs, W, H = samples[i % len(samples)]
+        start = time.perf_counter()
+        function(layer_outputs, W, H, labels, yolo_detector.conf_threshold, yolo_detector.nms_threshold)
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+labels = [f"class_{i}" for i in range(num_classes)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type = int, default = 200)
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    sizes = [(640, 480), (1920, 1080), (4032, 3024)]
+    samples = [(make_outputs(rng), W, H) for _ in range(20) for (W, H) in sizes]
+
+    # Both implementations must produce the same tags
+    mismatches = 0
+    for layer_outputs, W, H in samples:
+        expected = legacy_predict(layer_outputs, W, H, labels, yolo_detector.conf_threshold, yolo_detector.nms_threshold)
+        actual = vectorized_predict(layer_outputs, W, H, labels, yolo_detector.conf_threshold, yolo_detector.nms_threshold)
+        if expected != actual:
+            mismatches += 1
+    print(f"Tag mismatches: {mismatches} / {len(samples)}")
+
+    legacy = time_runs(legacy_predict, samples, args.runs)
+    vectorized = time_runs(vectorized_predict, samples, args.runs)
+
+    for name, timings in [("loop", legacy), ("vectorized", vectorized)]:
+        print("{:<12} median {:.3f} ms  p95 {:.3f} ms".format(
+            name, np.median(timings) * 1000, np.percentile(timings, 95) * 1000))
+    print("Speedup: {:.1f}x".format(np.median(legacy) / np.median(vectorized)))
+
+    sys.exit(1 if mismatches else 0)
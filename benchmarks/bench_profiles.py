@@ -0,0 +1,126 @@
+"""
+Latency and tag agreement of every inference profile on a local image set.
+
+Each image is decoded and tagged with every profile. Latency covers decode
+plus inference. Agreement is the mean Jaccard similarity of each image's tag
+set with the tags of the reference profile.
+
+Usage: python benchmarks/bench_profiles.py --images DIR --weights yolov3-tiny.weights
+       [--config yolov3-tiny.cfg] [--labels coco.names] [--runs 3]
+       [--reference accurate-608] [--output results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "layers", "pixtag-common", "python"))
+
+import image_decode
+import model_registry
+import yolo_detector
+import inference_profiles
+
+# Bundled YOLO configs
+configs_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambdas",
+                            "object-detect-lambda", "yolo_tiny_configs")
+
+# Image file extensions picked up from the image directory
+image_extensions = (".jpg", ".jpeg", ".png", ".webp")
+
+def load_images(images_dir):
+    """
+    Read the encoded bytes of every image in a directory
+
+    Returns
+    -------
+    :return list of (file name, uint8 array) tuples
+    """
+
+    images = list()
+    for file_name in sorted(os.listdir(images_dir)):
+        if file_name.lower().endswith(image_extensions):
+            with open(os.path.join(images_dir, file_name), "rb") as image_file:
+                images.append((file_name, np.frombuffer(image_file.read(), dtype = np.uint8)))
+
+    return images
+
+def run_profile(profile, model, labels, images, runs):
+    """
+    Decode and tag every image with one profile
+
+    Returns
+    -------
+    :return list of latencies in seconds, dictionary of tag sets per image
+    """
+
+    latencies = list()
+    tags = dict()
+    for _ in range(runs):
+        for file_name, buffer in images:
+            start = time.perf_counter()
+            image = image_decode.decode_image(buffer, profile["input_size"], profile["input_size"])
+            tags[file_name] = set(yolo_detector.predict(image, model, labels, profile))
+            latencies.append(time.perf_counter() - start)
+
+    return latencies, tags
+
+def jaccard(first, second):
+    """
+    Jaccard similarity of two tag sets, two empty sets agree fully
+    """
+
+    if len(first | second) == 0:
+        return 1.0
+
+    return len(first & second) / len(first | second)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required = True, help = "directory of sample images")
+    parser.add_argument("--weights", required = True, help = "path to yolov3-tiny.weights")
+    parser.add_argument("--config", default = os.path.join(configs_root, "yolov3-tiny.cfg"))
+    parser.add_argument("--labels", default = os.path.join(configs_root, "coco.names"))
+    parser.add_argument("--runs", type = int, default = 3)
+    parser.add_argument("--reference", default = "accurate-608", help = "profile the others are compared to")
+    parser.add_argument("--output", help = "write results as JSON to this path")
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if len(images) == 0:
+        sys.exit(f"No images found in: {args.images}")
+
+    labels = open(args.labels).read().strip().split("\n")
+    model = model_registry.load_model(args.config, args.weights)
+
+    results = dict()
+    tags_by_profile = dict()
+    for name in inference_profiles.profiles:
+        profile = inference_profiles.get_profile(name)
+
+        # Warm the network up for this input size before timing it
+        model_registry.warmup(model, profile["input_size"])
+
+        latencies, tags_by_profile[name] = run_profile(profile, model, labels, images, args.runs)
+        results[name] = {
+            "input_size": profile["input_size"],
+            "p50_ms": float(np.percentile(latencies, 50) * 1000),
+            "p95_ms": float(np.percentile(latencies, 95) * 1000)
+        }
+
+    reference = tags_by_profile[args.reference]
+    for name, tags in tags_by_profile.items():
+        results[name]["tag_agreement"] = float(np.mean([jaccard(tags[f], reference[f]) for f in reference]))
+
+    print(f"{len(images)} images, {args.runs} runs, agreement against {args.reference}")
+    print("{:<14} {:>6} {:>10} {:>10} {:>10}".format("profile", "size", "p50 ms", "p95 ms", "agreement"))
+    for name, result in results.items():
+        print("{:<14} {:>6} {:>10.2f} {:>10.2f} {:>10.3f}".format(
+            name, result["input_size"], result["p50_ms"], result["p95_ms"], result["tag_agreement"]))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent = 2)
@@ -0,0 +1,69 @@
+"""
+Micro-benchmark of the per-user bitmask index: matching and ranking a
+query over every image of a large synthetic library, against the query
+engine reading tag index postings. Also reports the snapshot size and the
+time to load it.
+
+Usage: python benchmarks/bench_tag_bitmask.py [--images 100000] [--runs 20] [--seed 0]
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "layers", "pixtag-common", "python"))
+
+import tag_codec
+import tag_query
+import tag_bitmask_index
+from bench_tag_query import make_records, build_postings, engine_search
+
+# Queries of the comparison, the postings engine only reads OR-ed tags
+queries = [
+    ["person, 2", "dog", "car"],
+    ["toothbrush", "hair drier"],
+    ["cat AND dog"]
+]
+
+def time_call(function, runs):
+    timings = list()
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+
+    return np.median(timings) * 1000, result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type = int, default = 100000)
+    parser.add_argument("--runs", type = int, default = 20)
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    records = make_records(np.random.default_rng(args.seed), list(tag_codec.coco_labels), args.images)
+    postings = build_postings(records)
+    index = tag_bitmask_index.BitmaskIndex.from_class_counts(
+        {record["thumbnail_url"]: tag_codec.encode_class_counts(tag_codec.parse_tags(record["tags"]))
+         for record in records})
+
+    snapshot = index.to_bytes()
+    load_ms, _ = time_call(lambda: tag_bitmask_index.BitmaskIndex.from_bytes(snapshot), args.runs)
+    print(f"{args.images} images, {args.runs} runs, snapshot {len(snapshot) / 1e6:.2f} MB, load {load_ms:.1f} ms")
+    print(f"{'query':<36} {'match ms':>10} {'ranked ms':>10} {'postings ms':>12} {'results':>10}")
+
+    for tags in queries:
+        query = tag_query.parse_request(tags)
+        match_ms, _ = time_call(lambda: index.evaluate(query), args.runs)
+        ranked_ms, ranked = time_call(lambda: index.search(query), args.runs)
+
+        # The postings engine only supports OR-ed tags
+        postings_ms = float("nan")
+        if all(node[0] == "tag" for node in (query[1] if query[0] == "or" else [query])):
+            postings_ms, results = time_call(lambda: engine_search(postings, tags), args.runs)
+            assert set(thumbnail_url for thumbnail_url, _ in ranked) == set(results)
+
+        print(f"{' OR '.join(tags):<36} {match_ms:>10.3f} {ranked_ms:>10.2f} {postings_ms:>12.2f} {len(ranked):>10}")
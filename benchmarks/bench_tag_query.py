@@ -0,0 +1,141 @@
+"""
+Micro-benchmark of tag search matching: the original loop over records x
+stored tags x request tags against the query engine in tag_query reading
+tag index postings, on a synthetic library of images tagged from the COCO
+vocabulary. Records are "tags" string sets as read from the images table.
+
+Usage: python benchmarks/bench_tag_query.py [--images 10000] [--runs 20] [--seed 0]
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "layers", "pixtag-common", "python"))
+
+import tag_codec
+import tag_query
+
+# Bundled YOLO configs
+configs_root = os.path.join(root, "lambdas", "object-detect-lambda", "yolo_tiny_configs")
+
+# Request of the comparison, the original matcher only supports OR
+request_tags = ["person, 2", "dog", "car"]
+
+def make_records(rng, labels, count):
+    """
+    Generate image records with a few tags each, skewed towards the first
+    classes like real photo libraries
+
+    Returns
+    -------
+    :return list of records with "thumbnail_url" and "tags"
+    """
+
+    weights = 1.0 / np.arange(1, len(labels) + 1)
+    weights /= weights.sum()
+
+    records = list()
+    for index in range(count):
+        names = rng.choice(len(labels), size = rng.integers(1, 6), replace = False, p = weights)
+        tags = {f"{labels[name]}, {rng.integers(1, 5)}" for name in names}
+        records.append({"thumbnail_url": f"thumbnails/user/{index:06d}.jpg", "tags": tags})
+
+    return records
+
+def resolve_tags(tag):
+    """
+    Resolve tag string to tags and count, as search_by_tags did
+    """
+
+    tags = tag.split(",")
+    if len(tags) == 1:
+        return tags[0].strip(), 1
+    else:
+        return tags[0].strip(), int(tags[1].strip())
+
+def legacy_search(records, tags):
+    """
+    The matching loop search_by_tags used before the query engine
+    """
+
+    image_urls = list()
+    for record in records:
+        image_tags = list(record["tags"])
+        for tag in image_tags:
+            image_tag_name, image_tag_count = resolve_tags(tag)
+            for request_tags in list(tags):
+                if request_tags.strip() != "":
+                    request_tag_name, request_tag_count = resolve_tags(request_tags)
+                    if (request_tag_name == image_tag_name) & (image_tag_count >= request_tag_count):
+                        image_urls.append(record["thumbnail_url"])
+
+    return image_urls
+
+def build_postings(records):
+    """
+    Postings of every tag as the tag index holds them, sorted by thumbnail URL
+    """
+
+    postings = dict()
+    for record in records:
+        for tag, count in tag_codec.parse_tags(record["tags"]).items():
+            postings.setdefault(tag, list()).append((record["thumbnail_url"], count))
+
+    return postings
+
+def engine_search(postings, tags):
+    """
+    Parse the request once, gather the postings of its tags as
+    tag_query.get_image_counts does, and evaluate every candidate with
+    dictionary lookups
+    """
+
+    query = tag_query.parse_request(tags)
+    images = dict()
+    for tag in tag_query.get_tags(query):
+        for thumbnail_url, count in postings.get(tag, []):
+            images.setdefault(thumbnail_url, dict())[tag] = count
+
+    ranked = list()
+    for thumbnail_url, counts in images.items():
+        if tag_query.evaluate(query, counts):
+            ranked.append((-tag_query.score(query, counts), thumbnail_url))
+    ranked.sort()
+
+    return [thumbnail_url for _, thumbnail_url in ranked]
+
+def time_search(function, source, runs):
+    timings = list()
+    for _ in range(runs):
+        start = time.perf_counter()
+        results = function(source, request_tags)
+        timings.append(time.perf_counter() - start)
+
+    return np.median(timings) * 1000, results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type = int, default = 10000)
+    parser.add_argument("--runs", type = int, default = 20)
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    labels = open(os.path.join(configs_root, "coco.names")).read().strip().split("\n")
+    records = make_records(np.random.default_rng(args.seed), labels, args.images)
+
+    legacy_ms, legacy_results = time_search(legacy_search, records, args.runs)
+    engine_ms, engine_results = time_search(engine_search, build_postings(records), args.runs)
+
+    # Same images, each once instead of once per matching tag
+    assert set(legacy_results) == set(engine_results)
+    assert len(engine_results) == len(set(engine_results))
+
+    print(f"Request: {request_tags} over {args.images} images, {args.runs} runs")
+    print(f"{'matcher':<12} {'p50 ms':>10} {'results':>10}")
+    print(f"{'legacy':<12} {legacy_ms:>10.2f} {len(legacy_results):>10}")
+    print(f"{'tag_query':<12} {engine_ms:>10.2f} {len(engine_results):>10}")
+    print(f"Speedup: {legacy_ms / engine_ms:.1f}x")
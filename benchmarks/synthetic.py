@@ -0,0 +1,151 @@
+"""
+Synthetic inputs for offline benchmarks: random-weight Darknet models built
+from a .cfg file and generated JPEG images, so the detection pipeline can be
+timed without the real yolov3-tiny.weights or AWS.
+"""
+
+import cv2
+import struct
+import numpy as np
+import darknet_config
+
+def get_conv_shapes(sections):
+    """
+    Derive the weight shapes of every convolutional layer
+
+    Parameters
+    ----------
+    :param sections: parsed config sections
+
+    Returns
+    -------
+    :return list of (filters, input channels, kernel size, batch normalized)
+    """
+
+    channels = int(sections[0].get("channels", 3))
+    layer_channels = list()
+    shapes = list()
+
+    for section in sections[1:]:
+        if section["type"] == "convolutional":
+            filters = int(section["filters"])
+            size = int(section["size"])
+            shapes.append((filters, channels, size, int(section.get("batch_normalize", 0)) == 1))
+            channels = filters
+        elif section["type"] == "route":
+            layers = [int(layer) for layer in section["layers"].split(",")]
+            index = len(layer_channels)
+            channels = sum(layer_channels[layer if layer >= 0 else index + layer] for layer in layers)
+        layer_channels.append(channels)
+
+    return shapes
+
+def write_random_weights(config_path, weights_path, seed = 0):
+    """
+    Write a Darknet weights file with random values for a config
+
+    Parameters
+    ----------
+    :param config_path: path to the Darknet config
+    :param weights_path: path of the weights file to write
+    :param seed: random seed
+
+    Returns
+    -------
+    :return number of weight values written
+    """
+
+    rng = np.random.default_rng(seed)
+    total = 0
+
+    with open(weights_path, "wb") as weights_file:
+        # Header: major, minor, revision and the seen images counter
+        np.array([0, 2, 0], dtype = np.int32).tofile(weights_file)
+        np.array([0], dtype = np.int64).tofile(weights_file)
+
+        for filters, channels, size, batch_normalize in get_conv_shapes(darknet_config.parse_cfg(config_path)):
+            values = [rng.normal(0, 0.01, filters)]
+            if batch_normalize:
+                # Scales, rolling means and strictly positive rolling variances
+                values += [rng.normal(1, 0.1, filters), rng.normal(0, 0.01, filters),
+                           rng.uniform(0.5, 1.5, filters)]
+            fan_in = channels * size * size
+            values.append(rng.normal(0, np.sqrt(2.0 / fan_in), filters * fan_in))
+
+            for value in values:
+                value.astype(np.float32).tofile(weights_file)
+                total += value.size
+
+    return total
+
+def make_image(width, height, seed = 0):
+    """
+    Generate a photo-like image: smooth colour regions with noise
+
+    Parameters
+    ----------
+    :param width: image width
+    :param height: image height
+    :param seed: random seed
+
+    Returns
+    -------
+    :return opencv image
+    """
+
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (max(2, height // 64), max(2, width // 64), 3), dtype = np.uint8)
+    image = cv2.resize(coarse, (width, height), interpolation = cv2.INTER_CUBIC)
+    noise = rng.normal(0, 6, image.shape)
+
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+def make_jpeg(width, height, seed = 0, quality = 90):
+    """
+    Generate an encoded JPEG image
+
+    Returns
+    -------
+    :return uint8 array of JPEG bytes
+    """
+
+    return cv2.imencode(".jpg", make_image(width, height, seed), [cv2.IMWRITE_JPEG_QUALITY, quality])[1]
+
+def make_exif_jpeg(width, height, preview_width = 160, preview_height = 120, orientation = 1, seed = 0):
+    """
+    Generate an encoded JPEG carrying an Exif segment with an orientation,
+    the pixel dimensions and an embedded JPEG preview, laid out the way
+    cameras write them
+
+    Returns
+    -------
+    :return JPEG bytes
+    """
+
+    image = make_image(width, height, seed)
+    main = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+    preview = cv2.resize(image, (preview_width, preview_height), interpolation = cv2.INTER_AREA)
+    preview = cv2.imencode(".jpg", preview, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+
+    def ifd(entries, next_offset):
+        data = struct.pack("<H", len(entries))
+        for tag, field_type, value in entries:
+            packed = struct.pack("<H", value) + b"\x00\x00" if field_type == 3 else struct.pack("<I", value)
+            data += struct.pack("<HHI", tag, field_type, 1) + packed
+        return data + struct.pack("<I", next_offset)
+
+    # Header, IFD0 with 2 entries, Exif IFD with 2 entries, IFD1 with 3 entries
+    ifd0_offset = 8
+    exif_offset = ifd0_offset + 2 + 2 * 12 + 4
+    ifd1_offset = exif_offset + 2 + 2 * 12 + 4
+    preview_offset = ifd1_offset + 2 + 3 * 12 + 4
+
+    tiff = b"II*\x00" + struct.pack("<I", ifd0_offset)
+    tiff += ifd([(0x0112, 3, orientation), (0x8769, 4, exif_offset)], ifd1_offset)
+    tiff += ifd([(0xA002, 4, width), (0xA003, 4, height)], 0)
+    tiff += ifd([(0x0103, 3, 6), (0x0201, 4, preview_offset), (0x0202, 4, len(preview))], 0)
+    tiff += preview
+
+    app1 = b"\xff\xe1" + struct.pack(">H", len(tiff) + 8) + b"Exif\x00\x00" + tiff
+
+    return main[:2] + app1 + main[2:]
@@ -1,5 +1,5 @@
 import boto3
-from boto3.dynamodb.conditions import Key
+import tag_codec
 
 # DynamoDB boto3 client
 ddb = boto3.resource('dynamodb')
@@ -35,25 +35,6 @@ def get_user_email_from_user_id(user_id):
         if attribute['Name'] == 'email':
             return attribute['Value']
 
-def resolve_tags(tag):
-    """
-    Resolve tag string to tags and count
-
-    Parameters
-    ----------
-    :param tag: tag string to resolve
-
-    Returns
-    -------
-    :return tag, count
-    """
-
-    tags = tag.split(",")
-    if len(tags) == 1:
-        return tags[0].strip(), 1
-    else:
-        return tags[0].strip(), int(tags[1].strip())
-
 def run(event, context):
     """
     Lambda function to detect changes in image's tags
@@ -72,16 +53,17 @@ def run(event, context):
         print(f"Get subscribed tags for given user: {user_id}")
         
         # Get subscribed tags for given user_id
-        records = subs_table.query(
-            KeyConditionExpression = Key('user_id').eq(user_id)
-        )
+        record = subs_table.get_item(
+            Key = {'user_id': user_id},
+            ProjectionExpression = 'subscribed_tags'
+        ).get("Item")
         
-        if len(records["Items"]) == 0:
+        if record is None:
             response_body["message"] = f"No tags subscribed for the given user_id: {user_id}"
             response["body"] = response_body.__str__()
             return response
     
-        subscribed_tags = list(records["Items"][0]["subscribed_tags"])
+        subscribed_tags = list(record["subscribed_tags"])
         
         print("Get list of subscriptions for given SNS topic.")
         list_subs = sns.list_subscriptions_by_topic(TopicArn = topic_arn)
@@ -107,10 +89,9 @@ def run(event, context):
             
             tags_list = list()
             new_image = event["Records"][0]["dynamodb"]["NewImage"]
-            new_tags_raw = new_image["tags"]["SS"]
+            new_tags = tag_codec.item_tags(new_image)
             
-            for tag in new_tags_raw:
-                tag_name, _ = resolve_tags(tag)
+            for tag_name in new_tags:
                 if tag_name in subscribed_tags:
                     tags_list.append(tag_name)
             
@@ -137,20 +118,16 @@ def run(event, context):
             old_image = event["Records"][0]["dynamodb"]["OldImage"]
             new_image = event["Records"][0]["dynamodb"]["NewImage"]
             
-            old_tags_raw = old_image["tags"]["SS"]
-            new_tags_raw = new_image["tags"]["SS"]
-        
-            deleted_tags_raw = list(set(old_tags_raw) - set(new_tags_raw))
-            updated_tags_raw = list(set(new_tags_raw) - set(old_tags_raw))
+            old_tags = tag_codec.item_tags(old_image)
+            new_tags = tag_codec.item_tags(new_image)
         
-            for d_tag in deleted_tags_raw:
-                d_tag_name, d_tag_count = resolve_tags(d_tag)
+            # Tags removed from the image, and tags added or with a new count
+            for d_tag_name in old_tags.keys() - new_tags.keys():
                 if d_tag_name in subscribed_tags:
                     deleted_tags.append(d_tag_name)
                     
-            for u_tag in updated_tags_raw:
-                u_tag_name, u_tag_count = resolve_tags(u_tag)
-                if u_tag_name in subscribed_tags:
+            for u_tag_name, u_tag_count in new_tags.items():
+                if old_tags.get(u_tag_name) != u_tag_count and u_tag_name in subscribed_tags:
                     updated_tags.append(u_tag_name)
         
             updated_tags.extend(deleted_tags)
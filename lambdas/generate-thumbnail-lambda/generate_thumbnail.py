@@ -1,71 +1,119 @@
-import cv2
+import os
 import boto3
-import numpy as np
 import urllib.parse
+import concurrent.futures
+import exif_thumbnail
+import image_decode
+import thumbnails
 
 # S3 boto3 client
 s3 = boto3.client('s3')
 
-# Thumbnail prefix in S3
-thumbnail_prefix = "thumbnails"
+# Records processed concurrently, decode and resize release the GIL
+max_workers = int(os.environ.get("PIXTAG_THUMBNAIL_WORKERS", "4"))
 
-def run(event, _):
+# Try the embedded Exif preview with a ranged read before the full image
+exif_thumbnails_enabled = os.environ.get("PIXTAG_EXIF_THUMBNAILS", "0") == "1"
+
+# Longest side of the embedded previews expected, Exif previews follow the
+# 160x120 DCF size unless the camera is known to embed larger ones
+exif_preview_px = int(os.environ.get("PIXTAG_EXIF_PREVIEW_PX", "160"))
+
+# Longest side a preview must cover to stand in for the image
+largest_thumbnail = max(thumbnails.thumbnail_sizes + [thumbnails.thumbnail_px])
+
+# A preview can not cover the largest thumbnail, every ranged read would
+# be wasted before the full download
+if exif_thumbnails_enabled and largest_thumbnail > exif_preview_px:
+    print(f"Exif preview fast path disabled, thumbnails up to {largest_thumbnail}px exceed {exif_preview_px}px previews")
+    exif_thumbnails_enabled = False
+
+def read_exif_preview(bucket, key):
+    """
+    Read only the leading bytes of an image and decode its Exif preview
+    if it covers every thumbnail size
+
+    Returns
+    -------
+    :return opencv image, or None if the full image is needed
     """
-    This function creates a thumbnail from given image
+
+    image_object = s3.get_object(Bucket = bucket, Key = key, Range = f"bytes=0-{exif_thumbnail.exif_range_bytes - 1}")
+
+    return exif_thumbnail.get_preview(image_object['Body'].read(), largest_thumbnail)
+
+def process_record(record):
+    """
+    Create the thumbnails of the image of one S3 event record, unless
+    they were already built from the same image
 
     Parameters
     ----------
-    :param image: opencv image
+    :param record: S3 event record
 
     Returns
     -------
-    :return a resized image
+    :return True if the thumbnails were written, False if skipped
     """
 
     # Resolve S3 image upload event parameters
-    bucket = event["Records"][0]["s3"]["bucket"]["name"]
-    key = urllib.parse.unquote_plus(event["Records"][0]["s3"]["object"]["key"], encoding = "utf-8")
-
-    # Get image S3 object
-    image_object = s3.get_object(Bucket = bucket, Key = key)
-
-    try: 
-        
-        # Resolving user_id
-        user_id = key.split("/")[-2]
-    
-        # Read image
-        print("Reading image to opencv")
-        image = cv2.imdecode(np.asarray(bytearray(image_object['Body'].read())), cv2.IMREAD_COLOR)
-
-        # Defining thumbnail size and dimensions
-        thumbnail_px = 150
-        (height, width) = image.shape[:2]
-
-        # If height is greater than width, resize image
-        # proportionally by height, else by width
-        if height >= width:
-            ratio = thumbnail_px / float(height)
-            image_dimensions = (int(width * ratio), thumbnail_px)
-        else:
-            ratio = thumbnail_px / float(width)
-            image_dimensions = (thumbnail_px, int(height * ratio))
-
-        # Resize the image
-        print("Resizing image")
-        resized_image = cv2.resize(image, image_dimensions, interpolation = cv2.INTER_AREA)
-
-        # Write thumbnail image to S3 bucket
-        print(f"Writing image to bucket: {bucket}")
-        
-        image_string = cv2.imencode('.jpg', resized_image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tostring()
-        s3.put_object(
-            Bucket=bucket,
-            Key=f"{thumbnail_prefix}/{user_id}/{key.split('/')[-1]}",
-            Body=image_string
-        )
-        
-        print(f"Image written to bucket successfully: s3://{bucket}/{thumbnail_prefix}/{key.split('/')[-1]}")
-    
-    except Exception as e:
-        print(f"Image write failed with exception: {e}")
+    bucket = record["s3"]["bucket"]["name"]
+    key = urllib.parse.unquote_plus(record["s3"]["object"]["key"], encoding = "utf-8")
+    etag = record["s3"]["object"].get("eTag")
+
+    # Resolving user_id
+    user_id = key.split("/")[-2]
+
+    # Skip redelivered events for an image whose thumbnails are up to date
+    if etag is not None and thumbnails.get_source_etag(s3, bucket, user_id, key.split('/')[-1]) == etag:
+        print(f"Thumbnails of s3://{bucket}/{key} are up to date with ETag {etag}, skipping")
+        return False
+
+    # Try the Exif preview first, any failure falls back to the full image
+    image = None
+    if exif_thumbnails_enabled:
+        try:
+            image = read_exif_preview(bucket, key)
+        except Exception as e:
+            print(f"Exif preview failed with exception: {e}")
+
+    # Read image, decoding straight from the downloaded bytes at the
+    # smallest JPEG scale that still covers the largest thumbnail
+    if image is None:
+        print(f"Reading image to opencv: s3://{bucket}/{key}")
+        image_object = s3.get_object(Bucket = bucket, Key = key)
+        image = thumbnails.decode_for_thumbnails(image_decode.read_body(image_object['Body']))
+
+    # Resize the image and write every thumbnail size to S3 bucket
+    thumbnail_keys = thumbnails.put_thumbnails(s3, bucket, user_id, key.split('/')[-1], image, etag)
+    print(f"Images written to bucket successfully: {thumbnail_keys}")
+
+    return True
+
+def run(event, _):
+    """
+    This function creates the thumbnails of every image of an S3 event,
+    processing the records concurrently
+    """
+
+    records = event["Records"]
+    print(f"Processing {len(records)} image records with {max_workers} workers")
+
+    written = 0
+    failed = list()
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = {executor.submit(process_record, record): record for record in records}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                written += future.result()
+            except Exception as e:
+                failed.append(futures[future]["s3"]["object"]["key"])
+                print(f"Image write failed with exception: {e}")
+
+    print(f"Thumbnails written for {written} images, {len(records) - written - len(failed)} skipped, {len(failed)} failed")
+    print(f"Peak RSS: {thumbnails.get_peak_rss_mb():.1f} MB")
+
+    # Fail the invocation so the event is retried, finished images are
+    # skipped on the retry
+    if len(failed) != 0:
+        raise RuntimeError(f"Thumbnail generation failed for: {failed}")
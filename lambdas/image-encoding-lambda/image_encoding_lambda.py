@@ -1,38 +1,145 @@
+import os
 import boto3
 import base64
+import ddb_query
+import disk_cache
+import concurrent.futures
+from botocore.config import Config
 
-# S3 boto3 client
-s3 = boto3.client('s3')
+# Concurrent S3 fetches per request
+max_workers = int(os.environ.get("PIXTAG_ENCODE_WORKERS", "16"))
+
+# Default budget of base64 image bytes per response page, keys and
+# errors fit in what is left of the 6 MB synchronous Lambda payload limit
+page_bytes = int(os.environ.get("PIXTAG_ENCODE_PAGE_BYTES", "6000000"))
+
+# Images and thumbnails S3 prefixes
+images_prefix = "images"
+thumbnails_prefix = "thumbnails"
+
+# S3 boto3 client, with a connection per worker
+s3 = boto3.client('s3', config = Config(max_pool_connections = max_workers))
+
+# Objects cached in /tmp across warm invocations, 0 bytes turns it off
+cache_bytes = int(os.environ.get("PIXTAG_DISK_CACHE_BYTES", str(256 * 1024 * 1024)))
+cache = disk_cache.DiskCache(os.environ.get("PIXTAG_DISK_CACHE_DIR", "/tmp/pixtag-objects"), cache_bytes) if cache_bytes > 0 else None
+
+def fetch_image(bucket, key):
+    """
+    Fetch an S3 object and encode it to a base64 string
+
+    Returns
+    -------
+    :return key, base64 bytes or None, error message or None
+    """
+
+    try:
+        # Get S3 object, revalidating a cached copy
+        data = disk_cache.get_object(s3, cache, bucket, key)
+
+        # Encode image to base64 string
+        return key, base64.b64encode(data), None
+
+    except Exception as e:
+        print(f"Failed to fetch s3://{bucket}/{key}: {e}")
+        return key, None, str(e)
+
+def preview_key(key):
+    """
+    Map an image key to the key of its thumbnail, other keys are kept
+    """
+
+    parts = key.split("/")
+    if len(parts) == 3 and parts[0] == images_prefix:
+        return f"{thumbnails_prefix}/{parts[1]}/{parts[2]}"
+
+    return key
+
+def decode_offset(cursor):
+    """
+    Read the offset of a continuation cursor, no cursor starts at 0
+    """
+
+    position = ddb_query.decode_cursor(cursor)
+
+    return int(position["offset"]) if position is not None else 0
 
 def run(event, _):
     """
-    A lambda function to encode images to base64 string
+    A lambda function to encode images to base64 string. Images are fetched
+    concurrently and returned in request order. Keys that fail are left
+    out of "images" and reported in "errors", "keys" lists the key of
+    every returned image.
+
+    Responses are paged: images are added until "page_bytes" of base64
+    data, capped at PIXTAG_ENCODE_PAGE_BYTES, and "next_cursor" is set
+    when keys are left. Sending the same keys with "cursor" set to it
+    returns the next page. With "previews", images/ keys are served from
+    their thumbnails.
     """
-    
+
     images_list = list()
+    keys_list = list()
+    errors_list = list()
     response_body = dict()
     response = dict()
     response["statusCode"] = 200
 
-    try: 
-        
+    try:
+
         request_body = eval(event['body'])
+        if cache is not None:
+            cache.reset_stats()
 
         # Resolve S3 image upload event parameters
         bucket = request_body["bucket_name"]
+        keys = request_body["keys"]
+
+        # Callers can ask for smaller pages, never for more than fits the payload limit
+        budget = min(int(request_body.get("page_bytes", page_bytes)), page_bytes)
+        previews = request_body.get("previews", False)
+        offset = decode_offset(request_body.get("cursor"))
+        if offset < 0 or offset > len(keys):
+            raise ValueError(f"Cursor offset {offset} is out of range for {len(keys)} keys")
+
+        # Fetch the keys concurrently, a window at a time so at most one
+        # window is read past the page budget
+        used = 0
+        full = False
+        with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, min(max_workers, len(keys)))) as executor:
+            while offset < len(keys) and not full:
+                window = keys[offset:offset + max_workers]
+                fetch_keys = [preview_key(key) if previews else key for key in window]
+
+                # Map keeps the request order
+                for key, (_, image_base64_str, error) in zip(window, executor.map(lambda key: fetch_image(bucket, key), fetch_keys)):
+                    if error is not None:
+                        errors_list.append({"key": key, "message": error})
+                        offset += 1
+                        continue
+
+                    # An image larger than a whole page can never be returned
+                    if len(image_base64_str) > budget:
+                        errors_list.append({"key": key, "message": f"Image of {len(image_base64_str)} bytes exceeds the page budget"})
+                        offset += 1
+                        continue
 
-        for key in request_body["keys"]:
-        
-            # Get S3 object
-            image_object = s3.get_object(Bucket = bucket, Key = key)
+                    if used + len(image_base64_str) > budget:
+                        full = True
+                        break
 
-            # Encode image to base64 string
-            image_base64_str = base64.b64encode(image_object['Body'].read())
+                    # Add to dictionary
+                    used += len(image_base64_str)
+                    images_list.append(image_base64_str)
+                    keys_list.append(key)
+                    offset += 1
 
-            # Add to dictionary
-            images_list.append(image_base64_str)
-        
         response_body["images"] = images_list
+        response_body["keys"] = keys_list
+        response_body["errors"] = errors_list
+        response_body["next_cursor"] = ddb_query.encode_cursor({"offset": offset}) if offset < len(keys) else None
+        if cache is not None:
+            print(f"Disk cache stats: {cache.get_stats()}")
         response["body"] = response_body.__str__()
         return response
 
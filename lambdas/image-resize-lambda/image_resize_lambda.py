@@ -0,0 +1,211 @@
+import os
+import cv2
+import boto3
+import base64
+import threading
+import concurrent.futures
+import image_decode
+import exif_thumbnail
+from botocore.config import Config
+
+# Concurrent renditions per request
+max_workers = int(os.environ.get("PIXTAG_RESIZE_WORKERS", "8"))
+
+# S3 boto3 client, with a connection per worker
+s3 = boto3.client('s3', config = Config(max_pool_connections = max_workers))
+
+# Derived renditions S3 prefix, keys are derived/<source key>/<width>q<quality>.<extension>
+derived_prefix = "derived"
+
+# Accepted request values
+min_width = 16
+max_width = int(os.environ.get("PIXTAG_RESIZE_MAX_WIDTH", "2048"))
+default_quality = 85
+
+# Encoding settings of every output format
+formats = {
+    "jpeg": {"extension": "jpg", "content_type": "image/jpeg", "quality_flag": cv2.IMWRITE_JPEG_QUALITY},
+    "webp": {"extension": "webp", "content_type": "image/webp", "quality_flag": cv2.IMWRITE_WEBP_QUALITY}
+}
+
+# Renditions being built in this container, keyed by derived key
+inflight = dict()
+inflight_lock = threading.Lock()
+
+# Rendition counts of this container
+stats = {"hits": 0, "built": 0, "deduplicated": 0}
+
+def derived_key(key, width, quality, output_format):
+    """
+    S3 key of a rendition of an image
+    """
+
+    return f"{derived_prefix}/{key}/{width}q{quality}.{formats[output_format]['extension']}"
+
+def single_flight(name, function):
+    """
+    Run function once for concurrent calls with the same name, the other
+    callers wait for its result
+
+    Returns
+    -------
+    :return result of function, True if this call ran it
+    """
+
+    with inflight_lock:
+        call = inflight.get(name)
+        leader = call is None
+        if leader:
+            call = {"done": threading.Event(), "result": None, "error": None}
+            inflight[name] = call
+        else:
+            stats["deduplicated"] += 1
+
+    if not leader:
+        call["done"].wait()
+        if call["error"] is not None:
+            raise call["error"]
+        return call["result"], False
+
+    try:
+        call["result"] = function()
+    except Exception as e:
+        call["error"] = e
+        raise
+    finally:
+        with inflight_lock:
+            del inflight[name]
+        call["done"].set()
+
+    return call["result"], True
+
+def build_rendition(bucket, key, target_key, width, quality, output_format):
+    """
+    Resize an image to a width, keeping its aspect ratio and never
+    upscaling, then store the rendition under its derived key
+
+    Returns
+    -------
+    :return encoded rendition bytes
+    """
+
+    image_object = s3.get_object(Bucket = bucket, Key = key)
+
+    # Decode at the smallest JPEG scale that still covers the width, which
+    # is the encoded height when EXIF orientation turns the image sideways
+    buffer = image_decode.read_body(image_object['Body'])
+    exif = exif_thumbnail.parse_exif(buffer[:exif_thumbnail.exif_range_bytes].tobytes())
+    if exif is not None and exif["orientation"] in (5, 6, 7, 8):
+        image = image_decode.decode_image(buffer, 0, width)
+    else:
+        image = image_decode.decode_image(buffer, width, 0)
+    (height, source_width) = image.shape[:2]
+    if source_width > width:
+        image = cv2.resize(image, (width, max(1, round(height * width / source_width))), interpolation = cv2.INTER_AREA)
+
+    settings = formats[output_format]
+    data = cv2.imencode(f".{settings['extension']}", image, [settings["quality_flag"], quality])[1].tobytes()
+
+    s3.put_object(
+        Bucket = bucket,
+        Key = target_key,
+        Body = data,
+        ContentType = settings["content_type"],
+        Metadata = {"source-etag": image_object["ETag"].strip('"')}
+    )
+    print(f"Rendition written to bucket: s3://{bucket}/{target_key}")
+
+    return data
+
+def get_rendition(bucket, key, width, quality, output_format):
+    """
+    Read a stored rendition with a single S3 GET, building it on a miss.
+    Renditions of an overwritten or deleted image are removed with it, see
+    thumbnails.delete_derived. Concurrent requests for the same rendition
+    build it once.
+
+    Returns
+    -------
+    :return derived key, base64 rendition bytes
+    """
+
+    target_key = derived_key(key, width, quality, output_format)
+
+    try:
+        data = s3.get_object(Bucket = bucket, Key = target_key)['Body'].read()
+        built = None
+    except s3.exceptions.NoSuchKey:
+        data, built = single_flight(target_key, lambda: build_rendition(bucket, key, target_key, width, quality, output_format))
+
+    with inflight_lock:
+        if built is None:
+            stats["hits"] += 1
+        elif built:
+            stats["built"] += 1
+
+    return target_key, base64.b64encode(data)
+
+def run(event, _):
+    """
+    A lambda function to return base64 renditions of images at a width and
+    quality. The request names one "key" or a list of "keys", renditions
+    are stored under the derived/ prefix so later requests are a single
+    S3 read.
+    """
+
+    response_body = dict()
+    response = dict()
+    response["statusCode"] = 200
+
+    try:
+
+        request_body = eval(event['body'])
+
+        bucket = request_body["bucket_name"]
+        width = int(request_body["width"])
+        quality = int(request_body.get("quality", default_quality))
+        output_format = request_body.get("format", "jpeg")
+
+        if not min_width <= width <= max_width:
+            raise ValueError(f"Width must be between {min_width} and {max_width}: {width}")
+        if not 1 <= quality <= 100:
+            raise ValueError(f"Quality must be between 1 and 100: {quality}")
+        if output_format not in formats:
+            raise ValueError(f"Unknown format: {output_format}. Available formats: {', '.join(formats)}")
+
+        keys = request_body["keys"] if "keys" in request_body else [request_body["key"]]
+
+        images_list = list()
+        keys_list = list()
+        errors_list = list()
+
+        # Build the renditions concurrently, map keeps the request order
+        def render(key):
+            try:
+                return key, get_rendition(bucket, key, width, quality, output_format), None
+            except Exception as e:
+                print(f"Failed to resize s3://{bucket}/{key}: {e}")
+                return key, None, str(e)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, min(max_workers, len(keys)))) as executor:
+            for key, rendition, error in executor.map(render, keys):
+                if error is not None:
+                    errors_list.append({"key": key, "message": error})
+                    continue
+                keys_list.append(rendition[0])
+                images_list.append(rendition[1])
+
+        print(f"Rendition stats: {stats}")
+
+        response_body["images"] = images_list
+        response_body["keys"] = keys_list
+        response_body["errors"] = errors_list
+        response["body"] = response_body.__str__()
+        return response
+
+    except Exception as e:
+        print(f"Exception: {e}")
+        response["statusCode"] = 500
+        response_body["message"] = f"Exception: {e}"
+        response["body"] = response_body.__str__()
+        return response
@@ -0,0 +1,144 @@
+import os
+import boto3
+import urllib.parse
+import model_registry
+import detection_codec
+import image_decode
+import image_records
+import inference_profiles
+import thumbnails
+import yolo_configs
+import yolo_detector
+
+# Inference profile, ingestion can afford the accurate one
+profile = inference_profiles.get_profile(fallback = "accurate-608")
+
+# Maximum number of images per forward pass
+batch_size = int(os.environ.get("PIXTAG_DETECT_BATCH_SIZE", "8"))
+
+# S3 boto3 client
+s3 = boto3.client('s3')
+
+# DynamoDB boto3 client
+ddb = boto3.client('dynamodb')
+ddb_table_name = "images"
+
+# Get YOLO configs, PIXTAG_YOLO_PATH sets their root
+lables = yolo_configs.get_labels()
+configs = yolo_configs.get_config()
+weights = yolo_configs.get_weights()
+
+# Load the neural net once per container
+model = model_registry.load_model(configs, weights, size = profile["input_size"])
+
+def resolve_record(record):
+    """
+    Resolve the bucket, user_id and image key of an S3 upload event record
+
+    Parameters
+    ----------
+    :param record: S3 event record
+
+    Returns
+    -------
+    :return bucket, user_id, key
+    """
+
+    bucket = record["s3"]["bucket"]["name"]
+    key = urllib.parse.unquote_plus(record["s3"]["object"]["key"], encoding = "utf-8")
+
+    # Resolving user_id
+    user_id = key.split('/')[-2]
+
+    return bucket, user_id, key
+
+def read_image(bucket, key):
+    """
+    Read an S3 image once and decode it at the scale that covers both the
+    largest thumbnail and detection
+
+    Parameters
+    ----------
+    :param bucket: S3 bucket name
+    :param key: S3 image key
+
+    Returns
+    -------
+    :return opencv image, True if it should go through tiled inference
+    """
+
+    image_object = s3.get_object(Bucket = bucket, Key = key)
+    buffer = image_decode.read_body(image_object['Body'])
+
+    largest = max(thumbnails.thumbnail_sizes + [thumbnails.thumbnail_px])
+
+    return yolo_detector.decode_for_detection(buffer, profile, largest)
+
+def run(event, _):
+    """
+    A lambda function to create the thumbnail and detect the objects of
+    every image of an S3 event from a single download and decode. It
+    replaces generate_thumbnail and detect_object for deployments that
+    trigger this function instead of both.
+    """
+
+    items = list()
+    records = event["Records"]
+    print(f"Ingesting {len(records)} image records in batches of {batch_size}")
+
+    for start in range(0, len(records), batch_size):
+
+        # Read and decode the images of this batch, then write their
+        # thumbnails from the same in-memory image
+        images = list()
+        tiled = list()
+        resolved = list()
+        for record in records[start:start + batch_size]:
+            try:
+                bucket, user_id, key = resolve_record(record)
+                print(f"Converting to OpenCV image: s3://{bucket}/{key}")
+                image, image_tiled = read_image(bucket, key)
+
+                thumbnail_keys = thumbnails.put_thumbnails(s3, bucket, user_id, key.split('/')[-1], image,
+                                                         record["s3"]["object"].get("eTag"))
+                print(f"Thumbnails written to bucket successfully: {thumbnail_keys}")
+
+                # Detection gets the scale it would have been decoded at
+                images.append(yolo_detector.fit_for_detection(image, profile, image_tiled))
+                tiled.append(image_tiled)
+                resolved.append((bucket, user_id, key))
+            except Exception as e:
+                print(f"Exception: {e}")
+
+        if len(images) == 0:
+            continue
+
+        try:
+
+            # Perform predictions with one forward pass for the batch
+            print(f"Getting predictions for {len(images)} images with profile: {profile['name']}")
+            batch_detections = yolo_detector.detect_batch(images, model, profile, batch_size = batch_size,
+                                                          tiled = tiled)
+            print(f"Model timing: {model_registry.get_stats()}")
+
+            for (bucket, user_id, key), detections in zip(resolved, batch_detections):
+                tags = yolo_detector.tags_from_detections(detections, lables, profile)
+                print(f"Tags detected for s3://{bucket}/{key}: {tags}")
+
+                tag_counts = image_records.count_tags(tags)
+                packed = detection_codec.pack_detections(detections, profile["conf_threshold"])
+                items.append(image_records.build_item(bucket, user_id, key.split('/')[-1], tag_counts, packed))
+
+        except Exception as e:
+            print(f"Exception: {e}")
+
+    # Insert items to DynamoDB table, only images whose thumbnail
+    # was written get an item
+    try:
+        if len(items) != 0:
+            # The tag index follows the table's stream, see update-tag-index
+            print(f"Inserting {len(items)} items to DynamoDB table: {ddb_table_name}")
+            image_records.batch_write_items(ddb, items, ddb_table_name)
+
+    except Exception as e:
+        print(f"Exception: {e}")
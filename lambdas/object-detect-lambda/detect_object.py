@@ -1,22 +1,19 @@
 import os
-import cv2
-import time
 import boto3
-import base64
-import numpy as np
 import urllib.parse
+import model_registry
+import detection_codec
+import image_decode
+import image_records
+import inference_profiles
+import yolo_configs
+import yolo_detector
 
-# YOLO configs root path
-yolo_path = "/opt/yolo_tiny_configs"
+# Inference profile, ingestion can afford the accurate one
+profile = inference_profiles.get_profile(fallback = "accurate-608")
 
-# Yolov3-tiny configs
-labels_path = "coco.names"
-configs_path = "yolov3-tiny.cfg"
-weights_path = "yolov3-tiny.weights"
-
-# Thresholds
-conf_threshold = 0.3
-nms_threshold = 0.1
+# Maximum number of images per forward pass
+batch_size = int(os.environ.get("PIXTAG_DETECT_BATCH_SIZE", "8"))
 
 # S3 boto3 client
 s3 = boto3.client('s3')
@@ -29,222 +26,118 @@ ddb_table_name = "images"
 images_prefix = "images"
 thumbnails_prefix = "thumbnails"
 
-def get_labels(labels_path):
-    """
-    Load the COCO class labels our YOLO model was trained on
+# Get YOLO configs, PIXTAG_YOLO_PATH sets their root
+lables = yolo_configs.get_labels()
+configs = yolo_configs.get_config()
+weights = yolo_configs.get_weights()
 
-    Parameters
-    ----------
-    :param labels_path: path to class labels
+# Load the neural net once per container
+model = model_registry.load_model(configs, weights, size = profile["input_size"])
 
-    Returns
-    -------
-    :return list of COCO labels
+def resolve_record(record):
     """
-
-    label_path = os.path.sep.join([yolo_path, labels_path])
-    labels = open(label_path).read().strip().split("\n")
-
-    return labels
-
-
-def get_weights(weights_path):
-    """
-    Derive the paths to the YOLO weights and model configuration
+    Resolve the bucket, user_id and image key of an S3 upload event record
 
     Parameters
     ----------
-    :param weights_path: path to YOLO weights
+    :param record: S3 event record
 
     Returns
     -------
-    :return derived weights paths
+    :return bucket, user_id, key
     """
 
-    weights_path = os.path.sep.join([yolo_path, weights_path])
-
-    return weights_path
+    bucket = record["s3"]["bucket"]["name"]
+    prefix = urllib.parse.unquote_plus(record["s3"]["object"]["key"], encoding = "utf-8")
 
-def get_config(config_path):
-    """
-    Derive the paths to the YOLO configs
-
-    Parameters
-    ----------
-    :param config_path: path to YOLO configs
-
-    Returns
-    -------
-    :return derived config paths
-    """
+    # Resolving user_id
+    user_id = prefix.split('/')[-2]
 
-    config_path = os.path.sep.join([yolo_path, config_path])
+    # Building key
+    key = f"{images_prefix}/{user_id}/{prefix.split('/')[-1]}"
 
-    return config_path
+    return bucket, user_id, key
 
-def load_model(config_path, weights_path):
+def read_image(bucket, key):
     """
-    Load our YOLO object detector trained on COCO dataset (80 classes)
+    Read an S3 image into an OpenCV image
 
     Parameters
     ----------
-    :param config_path: path to YOLO configs
-    :param weights_path: path to YOLO weights
+    :param bucket: S3 bucket name
+    :param key: S3 image key
 
     Returns
     -------
-    :return object detector model
+    :return opencv image, True if it should go through tiled inference
     """
 
-    print("Loading YOLO object detector ...")
-    net = cv2.dnn.readNetFromDarknet(config_path, weights_path)
-    return net
-
-def predict(image, net, labels):
-    """
-    Load our YOLO object detector trained on COCO dataset (80 classes)
+    # Get image S3 object
+    image_object = s3.get_object(Bucket = bucket, Key = key)
 
-    Parameters
-    ----------
-    :param config_path: path to YOLO configs
-    :param weights_path: path to YOLO weights
-    """
+    # Decode straight from the downloaded bytes, at the smallest
+    # JPEG scale that still covers the network input
+    buffer = image_decode.read_body(image_object['Body'])
 
-    (H, W) = image.shape[:2]
-    
-    # Determine only the *output* layer names that we need from YOLO
-    ln = net.getLayerNames()
-    ln = [ln[i - 1] for i in net.getUnconnectedOutLayers()]
-
-    # Construct a blob from the input image and then perform a forward
-    # pass of the YOLO object detector, giving us our bounding boxes and
-    # associated probabilities
-    blob = cv2.dnn.blobFromImage(image, 1 / 255.0, (416, 416),
-                                 swapRB = True, crop = False)
-    net.setInput(blob)
-    start = time.time()
-    layer_outputs = net.forward(ln)
-    end = time.time()
-
-    # Log timing information on YOLO
-    print("YOLO took {:.6f} seconds".format(end - start))
-
-    # Initialize our lists of detected bounding boxes, 
-    # confidences and class IDs respectively
-    boxes = []
-    confidences = []
-    class_ids = []
-
-    # Loop over each of the layer outputs
-    for output in layer_outputs:
-        # Loop over each of the detections
-        for detection in output:
-            # Extract the class ID and confidence (i.e., probability) of
-            # the current object detection
-            scores = detection[5:]
-            classID = np.argmax(scores)
-            confidence = scores[classID]
-
-            # Filter out weak predictions by ensuring the detected
-            # probability is greater than the minimum probability
-            if confidence > conf_threshold:
-                # Scale the bounding box coordinates back relative to the
-                # size of the image, keeping in mind that YOLO actually
-                # returns the center (x, y)-coordinates of the bounding
-                # box followed by the boxes' width and height
-                box = detection[0:4] * np.array([W, H, W, H])
-                (centerX, centerY, width, height) = box.astype("int")
-
-                # Use the center (x, y)-coordinates to derive the top and
-                # and left corner of the bounding box
-                x = int(centerX - (width / 2))
-                y = int(centerY - (height / 2))
-
-                # Update our list of bounding box coordinates, 
-                # confidences and class IDs
-                boxes.append([x, y, int(width), int(height)])
-                confidences.append(float(confidence))
-                class_ids.append(classID)
-
-    # Apply non-maxima suppression to suppress weak, overlapping bounding boxes
-    idxs = cv2.dnn.NMSBoxes(boxes, confidences, conf_threshold, nms_threshold)
-
-    # Reponse object dictionary placeholder
-    tags = list()
-    
-    # Ensure at least one detection exists
-    if len(idxs) > 0:
-        # Loop over the indexes we are keeping
-        # Create object_list placeholder list
-        objects_list = list()
-        for i in idxs.flatten():
-
-            # Retain tags with greater than 0.6 confidence
-            if confidences[i] > 0.6:
-                tags.append(labels[class_ids[i]])
-            
-    return tags
-
-# Get YOLO configs
-lables = get_labels(labels_path)
-configs = get_config(configs_path)
-weights = get_weights(weights_path)
+    return yolo_detector.decode_for_detection(buffer, profile)
 
 def run(event, _):
     """
-    A lambda function to detect objects in a given image
+    A lambda function to detect objects in every image of an S3 event
     """
-    
-    # Resolve S3 image upload event parameters
-    bucket = event["Records"][0]["s3"]["bucket"]["name"]
-    prefix = urllib.parse.unquote_plus(event["Records"][0]["s3"]["object"]["key"], encoding = "utf-8")
-    
-    # Resolving user_id
-    user_id = prefix.split('/')[-2]
-    
-    # Building key
-    key = f"{images_prefix}/{user_id}/{prefix.split('/')[-1]}"
 
-    # Get image S3 object
-    image_object = s3.get_object(Bucket = bucket, Key = key)
+    items = list()
+    records = event["Records"]
+    print(f"Processing {len(records)} image records in batches of {batch_size}")
+
+    for start in range(0, len(records), batch_size):
+
+        # Read and decode the images of this batch
+        images = list()
+        tiled = list()
+        resolved = list()
+        for record in records[start:start + batch_size]:
+            try:
+                bucket, user_id, key = resolve_record(record)
+                print(f"Converting to OpenCV image: s3://{bucket}/{key}")
+                image, image_tiled = read_image(bucket, key)
+                images.append(image)
+                tiled.append(image_tiled)
+                resolved.append((bucket, user_id, key))
+            except Exception as e:
+                print(f"Exception: {e}")
+
+        if len(images) == 0:
+            continue
+
+        try:
+
+            # Perform predictions with one forward pass for the batch
+            print(f"Getting predictions for {len(images)} images with profile: {profile['name']}")
+            batch_detections = yolo_detector.detect_batch(images, model, profile, batch_size = batch_size,
+                                                          tiled = tiled)
+            print(f"Model timing: {model_registry.get_stats()}")
+
+            for (bucket, user_id, key), detections in zip(resolved, batch_detections):
+                tags = yolo_detector.tags_from_detections(detections, lables, profile)
+                print(f"Tags detected for s3://{bucket}/{key}: {tags}")
+
+                # Keep the raw detections, also of images without tags, so
+                # tags can be recomputed at other thresholds without running
+                # the model again
+                tag_counts = image_records.count_tags(tags)
+                packed = detection_codec.pack_detections(detections, profile["conf_threshold"])
+                items.append(image_records.build_item(bucket, user_id, key.split('/')[-1], tag_counts, packed))
+
+        except Exception as e:
+            print(f"Exception: {e}")
+
+    # Insert items to DynamoDB table
+    try:
+        if len(items) != 0:
+            # The tag index follows the table's stream, see update-tag-index
+            print(f"Inserting {len(items)} items to DynamoDB table: {ddb_table_name}")
+            image_records.batch_write_items(ddb, items, ddb_table_name)
 
-    try: 
-
-        # Encode image to base64 string
-        print("Encoding image to base64")
-        image_base64_str = base64.b64encode(image_object['Body'].read())
-
-        # Convert base64 image string to OpenCV image
-        print("Converting to OpenCV image")
-        image = np.frombuffer(base64.b64decode(image_base64_str), np.uint8)
-        image = cv2.imdecode(image, flags = cv2.COLOR_BGR2RGB)
-        
-        # Load the neural net
-        print("Loading model")
-        nets = load_model(configs, weights)
-        
-        # Perform predictions
-        print("Getting predictions")
-        tags = predict(image, nets, lables)
-        
-        # Get repititions for each tag
-        tags_list = list()
-        for tag in list(set((tags))):
-            tag_count = tags.count(tag)
-            tags_list.append(f"{tag}, {tag_count}")
-        
-        # Insert item to DynamoDB table
-        print(f"Inserting item to DynamoDB table: {ddb_table_name} with tags: {tags}")
-        if len(tags_list) != 0:
-            ddb.put_item(
-                TableName = ddb_table_name, 
-                Item = {
-                    "user_id": { "S": user_id },
-                    "thumbnail_url": { "S": f"https://{bucket}.s3.amazonaws.com/{thumbnails_prefix}/{user_id}/{key.split('/')[-1]}" },
-                    "image_url": { "S": f"https://{bucket}.s3.amazonaws.com/{images_prefix}/{user_id}/{key.split('/')[-1]}" },
-                    "tags": { "SS": tags_list }
-                }
-            )
-    
     except Exception as e:
         print(f"Exception: {e}")
@@ -0,0 +1,80 @@
+import os
+import boto3
+import tag_codec
+import tag_bitmask_index
+
+# S3 boto3 client
+s3 = boto3.client('s3')
+
+# Attempts to apply the changes of a user when the snapshot keeps
+# changing between its read and its write
+write_attempts = int(os.environ.get("PIXTAG_BITMASK_WRITE_ATTEMPTS", "3"))
+
+def get_changes(records):
+    """
+    Collect the latest class counts of every changed image, grouped by user
+
+    Parameters
+    ----------
+    :param records: DynamoDB stream records of the images table
+
+    Returns
+    -------
+    :return dictionary of user_id to a dictionary of thumbnail URL to class
+            counts vector, or None for a removed image
+    """
+
+    changes = dict()
+    for record in records:
+        keys = record["dynamodb"]["Keys"]
+        user_id = keys["user_id"]["S"]
+        thumbnail_url = keys["thumbnail_url"]["S"]
+
+        # Records of a shard arrive in order, the last one wins
+        vector = None
+        if record["eventName"] != "REMOVE":
+            vector = tag_codec.encode_class_counts(tag_codec.item_tags(record["dynamodb"]["NewImage"]))
+        changes.setdefault(user_id, dict())[thumbnail_url] = vector
+
+    return changes
+
+def apply_changes(user_id, user_changes):
+    """
+    Apply the changes of one user to their snapshot, reading it again and
+    reapplying the changes whenever another writer replaced it in between.
+    The changes hold the latest class counts of every image, so applying
+    them again is safe.
+
+    Returns
+    -------
+    :return number of images in the written snapshot
+    """
+
+    for _ in range(write_attempts):
+        index, etag = tag_bitmask_index.read_snapshot(s3, user_id)
+        if index is None:
+            index = tag_bitmask_index.BitmaskIndex.empty()
+
+        index = index.apply(user_changes)
+        if tag_bitmask_index.write_snapshot(s3, user_id, index, etag, check = True):
+            return len(index.thumbnail_urls)
+
+    # Fail the batch so the stream delivers it again
+    raise RuntimeError(f"Snapshot of user {user_id} kept changing, gave up after {write_attempts} attempts")
+
+def run(event, _):
+    """
+    A lambda function to apply the tag changes of the images table stream
+    to the per-user bitmask index snapshots. Snapshots are replaced with a
+    read-modify-write, and a snapshot replaced by another writer since the
+    read is read again instead of overwritten. The check and the write are
+    two requests, so the event source mapping keeps a ParallelizationFactor
+    of 1, and tools/build_tag_bitmask.py runs with this trigger disabled.
+    """
+
+    changes = get_changes(event["Records"])
+    print(f"Applying {len(event['Records'])} stream records to {len(changes)} user snapshots")
+
+    for user_id, user_changes in changes.items():
+        images = apply_changes(user_id, user_changes)
+        print(f"Snapshot of user {user_id} written with {images} images")
@@ -0,0 +1,61 @@
+import boto3
+import tag_codec
+import tag_index
+import image_records
+
+# DynamoDB boto3 client
+ddb = boto3.client('dynamodb')
+
+def get_changes(records):
+    """
+    Collect the tags every changed image had before the batch and has after
+    it, so each image moves between its postings once
+
+    Parameters
+    ----------
+    :param records: DynamoDB stream records of the images table, with old
+                    and new images
+
+    Returns
+    -------
+    :return dictionary of (user_id, thumbnail_url) to a dictionary with the
+            "image_url", the "old_tags" and the "new_tags"
+    """
+
+    changes = dict()
+    for record in records:
+        keys = record["dynamodb"]["Keys"]
+        key = (keys["user_id"]["S"], keys["thumbnail_url"]["S"])
+        old_image = record["dynamodb"].get("OldImage")
+        new_image = record["dynamodb"].get("NewImage") if record["eventName"] != "REMOVE" else None
+
+        # Records of a shard arrive in order, the first one holds the
+        # indexed tags and the last one the current tags
+        if key not in changes:
+            changes[key] = {"old_tags": tag_codec.item_tags(old_image) if old_image is not None else dict()}
+
+        image = new_image if new_image is not None else old_image
+        if image is not None and "image_url" in image:
+            changes[key]["image_url"] = image["image_url"]["S"]
+        changes[key]["new_tags"] = tag_codec.item_tags(new_image) if new_image is not None else dict()
+
+    return changes
+
+def run(event, _):
+    """
+    A lambda function to apply the tag changes of the images table stream
+    to the tag index. Every writer of the images table is covered, and
+    records of an image stay on one shard, processed by one invocation at a
+    time, so concurrent writers cannot leave postings that no longer match
+    the image. The stream needs the NEW_AND_OLD_IMAGES view.
+    """
+
+    changes = get_changes(event["Records"])
+
+    requests = list()
+    for (user_id, thumbnail_url), change in changes.items():
+        requests.extend(tag_index.get_sync_requests(user_id, thumbnail_url, change.get("image_url", ""),
+                                                    change["old_tags"], change["new_tags"]))
+
+    written = image_records.batch_write_requests(ddb, requests, tag_index.index_table_name, tag_index.index_key_names)
+    print(f"Applied {len(event['Records'])} stream records of {len(changes)} images with {written} index writes")
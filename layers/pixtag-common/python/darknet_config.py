@@ -0,0 +1,25 @@
+def parse_cfg(config_path):
+    """
+    Parse a Darknet .cfg file into its sections
+
+    Parameters
+    ----------
+    :param config_path: path to the Darknet config
+
+    Returns
+    -------
+    :return list of section dictionaries with a "type" key
+    """
+
+    sections = list()
+    for line in open(config_path):
+        line = line.split("#")[0].strip()
+        if line == "":
+            continue
+        if line.startswith("["):
+            sections.append({"type": line[1:-1].strip()})
+        else:
+            key, value = line.split("=", 1)
+            sections[-1][key.strip()] = value.strip()
+
+    return sections
@@ -0,0 +1,73 @@
+import json
+import base64
+
+def encode_cursor(key):
+    """
+    Build the opaque continuation cursor of a position, such as a DynamoDB
+    key in client format
+    """
+
+    return base64.urlsafe_b64encode(json.dumps(key, sort_keys = True).encode()).decode()
+
+def decode_cursor(cursor):
+    """
+    Read the position of a continuation cursor, no cursor starts from the
+    beginning
+
+    Returns
+    -------
+    :return position dictionary, or None
+    """
+
+    if not cursor:
+        return None
+
+    key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(key, dict):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+    return key
+
+def paginate_query(source, page_size = None, start_key = None, **query_args):
+    """
+    Run a query page by page, following LastEvaluatedKey until the
+    partition is exhausted. Only one page is held at a time.
+
+    Parameters
+    ----------
+    :param source: DynamoDB boto3 client, or a boto3 Table resource
+    :param page_size: items evaluated per page, None for up to 1 MB pages
+    :param start_key: key to start after, in the format of the source
+    :param query_args: query arguments, e.g. KeyConditionExpression and
+                       ProjectionExpression, and TableName for a client
+
+    Returns
+    -------
+    :return generator of query responses
+    """
+
+    if page_size is not None:
+        query_args["Limit"] = page_size
+
+    while True:
+        if start_key is not None:
+            query_args["ExclusiveStartKey"] = start_key
+
+        page = source.query(**query_args)
+        yield page
+
+        start_key = page.get("LastEvaluatedKey")
+        if start_key is None:
+            return
+
+def query_items(source, page_size = None, start_key = None, **query_args):
+    """
+    Stream every item a query matches, across all of its pages
+
+    Returns
+    -------
+    :return generator of items
+    """
+
+    for page in paginate_query(source, page_size, start_key, **query_args):
+        yield from page["Items"]
@@ -0,0 +1,78 @@
+import struct
+import numpy as np
+
+# Version of the packed detections format
+codec_version = 2
+
+# Header: version, flags, detection count, frame width, frame height and
+# the confidence threshold the candidates were kept at. Version 1 packed
+# the count and frame size as uint16, which tiled images outgrow.
+header_formats = {
+    1: "<BBHHHf",
+    2: "<BBIIIf"
+}
+header_format = header_formats[codec_version]
+
+def pack_detections(detections, conf_threshold):
+    """
+    Pack the candidate detections of one image into a compact blob.
+    Per detection: four int32 box values, a float32 score and a uint8
+    class ID, 21 bytes in total.
+
+    Parameters
+    ----------
+    :param detections: detections dictionary returned by yolo_detector.detect_batch
+    :param conf_threshold: confidence threshold the candidates were kept at
+
+    Returns
+    -------
+    :return packed bytes
+    """
+
+    count = len(detections["confidences"])
+    header = struct.pack(header_format, codec_version, 0, count,
+                         detections["width"], detections["height"], conf_threshold)
+
+    return b"".join([
+        header,
+        np.asarray(detections["boxes"], dtype = "<i4").reshape(count, 4).tobytes(),
+        np.asarray(detections["confidences"], dtype = "<f4").tobytes(),
+        np.asarray(detections["class_ids"], dtype = np.uint8).tobytes()
+    ])
+
+def unpack_detections(data):
+    """
+    Unpack a blob written by pack_detections
+
+    Parameters
+    ----------
+    :param data: packed bytes
+
+    Returns
+    -------
+    :return detections dictionary and the confidence threshold the
+            candidates were kept at
+    """
+
+    version = data[0]
+    if version not in header_formats:
+        raise ValueError(f"Unsupported detections format version: {version}")
+
+    _, _, count, width, height, conf_threshold = struct.unpack_from(header_formats[version], data)
+
+    offset = struct.calcsize(header_formats[version])
+    boxes = np.frombuffer(data, dtype = "<i4", count = count * 4, offset = offset).reshape(count, 4)
+    offset += count * 16
+    confidences = np.frombuffer(data, dtype = "<f4", count = count, offset = offset)
+    offset += count * 4
+    class_ids = np.frombuffer(data, dtype = np.uint8, count = count, offset = offset)
+
+    detections = {
+        "boxes": boxes.astype(int),
+        "confidences": confidences.astype(np.float64),
+        "class_ids": class_ids.astype(int),
+        "width": width,
+        "height": height
+    }
+
+    return detections, conf_threshold
@@ -0,0 +1,188 @@
+import os
+import hashlib
+import threading
+import collections
+
+class DiskCache:
+    """
+    Size-capped LRU cache of S3 object bytes on local disk, kept across
+    warm invocations in /tmp. Every entry keeps the ETag it was fetched
+    with in a sidecar file so callers can revalidate it.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.reset_stats()
+
+        os.makedirs(directory, exist_ok = True)
+
+        # Pick up entries left by an earlier instance, oldest first
+        files = list()
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if "." not in name and os.path.exists(f"{path}.etag"):
+                files.append((os.path.getmtime(path), name, os.path.getsize(path)))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.size += size
+        self.evict()
+
+    def reset_stats(self):
+        """
+        Start counting hits, misses and bytes saved for a new invocation
+        """
+
+        self.stats = {"hits": 0, "misses": 0, "bytes_saved": 0}
+
+    def get_stats(self):
+        """
+        Get the counts since the last reset with the hit ratio
+
+        Returns
+        -------
+        :return dictionary of cache statistics
+        """
+
+        stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups != 0 else 0.0
+        stats["entries"] = len(self.entries)
+        stats["bytes"] = self.size
+
+        return stats
+
+    def count(self, hit, size = 0):
+        """
+        Count a lookup, a hit saves size bytes of transfer
+        """
+
+        with self.lock:
+            if hit:
+                self.stats["hits"] += 1
+                self.stats["bytes_saved"] += size
+            else:
+                self.stats["misses"] += 1
+
+    def entry_name(self, bucket, key):
+        return hashlib.sha256(f"{bucket}/{key}".encode()).hexdigest()
+
+    def get(self, bucket, key):
+        """
+        Read a cached object
+
+        Returns
+        -------
+        :return (bytes, ETag), or None if the object is not cached
+        """
+
+        name = self.entry_name(bucket, key)
+        path = os.path.join(self.directory, name)
+        with self.lock:
+            if name not in self.entries:
+                return None
+            self.entries.move_to_end(name)
+
+        try:
+            with open(f"{path}.etag") as etag_file:
+                etag = etag_file.read()
+            with open(path, "rb") as data_file:
+                data = data_file.read()
+            os.utime(path)
+        except OSError:
+            self.delete(bucket, key)
+            return None
+
+        return data, etag
+
+    def put(self, bucket, key, data, etag):
+        """
+        Cache an object with the ETag it was fetched with, evicting the
+        least recently used entries beyond the size cap
+        """
+
+        if len(data) > self.max_bytes:
+            return
+
+        name = self.entry_name(bucket, key)
+        path = os.path.join(self.directory, name)
+
+        # Write to unique temporary files, then swap them in
+        suffix = f".{threading.get_ident()}.tmp"
+        with open(f"{path}{suffix}", "wb") as data_file:
+            data_file.write(data)
+        with open(f"{path}.etag{suffix}", "w") as etag_file:
+            etag_file.write(etag)
+
+        with self.lock:
+            os.replace(f"{path}.etag{suffix}", f"{path}.etag")
+            os.replace(f"{path}{suffix}", path)
+            self.size += len(data) - self.entries.get(name, 0)
+            self.entries[name] = len(data)
+            self.entries.move_to_end(name)
+            self.evict()
+
+    def delete(self, bucket, key):
+        """
+        Drop a cached object
+        """
+
+        name = self.entry_name(bucket, key)
+        with self.lock:
+            self.remove(name)
+
+    def remove(self, name):
+        # Callers hold the lock
+        self.size -= self.entries.pop(name, 0)
+        for path in (os.path.join(self.directory, name), os.path.join(self.directory, f"{name}.etag")):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def evict(self):
+        # Callers hold the lock, or own the cache during construction
+        while self.size > self.max_bytes and len(self.entries) != 0:
+            self.remove(next(iter(self.entries)))
+
+def get_object(s3, cache, bucket, key):
+    """
+    Read an S3 object through a disk cache. A cached copy is revalidated
+    with a conditional GET on its ETag, so an overwritten object is fetched
+    again and a deleted one is dropped.
+
+    Parameters
+    ----------
+    :param s3: S3 boto3 client
+    :param cache: DiskCache, or None to always fetch
+    :param bucket: S3 bucket name
+    :param key: S3 object key
+
+    Returns
+    -------
+    :return object bytes
+    """
+
+    cached = cache.get(bucket, key) if cache is not None else None
+
+    try:
+        if cached is None:
+            image_object = s3.get_object(Bucket = bucket, Key = key)
+        else:
+            image_object = s3.get_object(Bucket = bucket, Key = key, IfNoneMatch = cached[1])
+    except s3.exceptions.ClientError as e:
+        code = e.response["Error"]["Code"]
+        if cached is not None and code in ("304", "NotModified"):
+            cache.count(True, len(cached[0]))
+            return cached[0]
+        if cached is not None and code in ("404", "NoSuchKey"):
+            cache.delete(bucket, key)
+        raise
+
+    data = image_object['Body'].read()
+    if cache is not None:
+        cache.count(False)
+        cache.put(bucket, key, data, image_object["ETag"])
+
+    return data
@@ -0,0 +1,224 @@
+import cv2
+import struct
+import numpy as np
+import image_decode
+
+# Bytes fetched for the fast path, an APP1 segment is at most 64 KB
+# and usually follows a small APP0 segment
+exif_range_bytes = 65536 + 4096
+
+# Largest aspect ratio difference between preview and image, camera
+# previews padded to 4:3 fail it
+aspect_tolerance = 0.02
+
+# TIFF tags
+orientation_tag = 0x0112
+compression_tag = 0x0103
+exif_ifd_tag = 0x8769
+pixel_width_tag = 0xA002
+pixel_height_tag = 0xA003
+thumbnail_offset_tag = 0x0201
+thumbnail_length_tag = 0x0202
+
+# Byte size of every TIFF field type
+type_sizes = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+def find_app1(data):
+    """
+    Find the Exif APP1 segment of a JPEG
+
+    Parameters
+    ----------
+    :param data: leading bytes of a JPEG
+
+    Returns
+    -------
+    :return TIFF payload of the segment, or None if there is none or it
+            is cut off
+    """
+
+    view = memoryview(data)
+    if len(view) < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+
+    i = 2
+    while i + 4 <= len(view):
+        if view[i] != 0xFF:
+            return None
+
+        marker = view[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+
+        # Reached the frame header or the image data before any Exif
+        if marker in image_decode.sof_markers or marker in (0xD9, 0xDA):
+            return None
+
+        length = (view[i + 2] << 8) | view[i + 3]
+        if marker == 0xE1 and bytes(view[i + 4:i + 10]) == b"Exif\x00\x00":
+            if i + 2 + length > len(view):
+                return None
+            return bytes(view[i + 10:i + 2 + length])
+
+        i += 2 + length
+
+    return None
+
+def read_ifd(tiff, offset, endian):
+    """
+    Read the entries of a TIFF image file directory
+
+    Parameters
+    ----------
+    :param tiff: TIFF payload
+    :param offset: offset of the directory in the payload
+    :param endian: struct byte order, "<" or ">"
+
+    Returns
+    -------
+    :return dictionary of tag to first value, offset of the next directory
+    """
+
+    (count,) = struct.unpack_from(f"{endian}H", tiff, offset)
+    entries = dict()
+    for index in range(count):
+        tag, field_type, values, value = struct.unpack_from(f"{endian}HHI4s", tiff, offset + 2 + index * 12)
+        if field_type == 3:
+            entries[tag] = struct.unpack_from(f"{endian}H", value)[0]
+        elif field_type in (4, 9):
+            entries[tag] = struct.unpack_from(f"{endian}I", value)[0]
+        elif type_sizes.get(field_type, 8) * values <= 4:
+            entries[tag] = value[0]
+
+    (next_offset,) = struct.unpack_from(f"{endian}I", tiff, offset + 2 + count * 12)
+
+    return entries, next_offset
+
+def parse_exif(data):
+    """
+    Read the orientation, image size and embedded JPEG thumbnail from the
+    Exif segment of a JPEG
+
+    Parameters
+    ----------
+    :param data: leading bytes of a JPEG
+
+    Returns
+    -------
+    :return dictionary with "orientation", "width", "height" and
+            "thumbnail", or None if there is no readable Exif segment.
+            Missing values are None.
+    """
+
+    tiff = find_app1(data)
+    if tiff is None or len(tiff) < 8:
+        return None
+
+    if tiff[:4] == b"II*\x00":
+        endian = "<"
+    elif tiff[:4] == b"MM\x00*":
+        endian = ">"
+    else:
+        return None
+
+    try:
+        (ifd0_offset,) = struct.unpack_from(f"{endian}I", tiff, 4)
+        ifd0, ifd1_offset = read_ifd(tiff, ifd0_offset, endian)
+
+        exif = {
+            "orientation": ifd0.get(orientation_tag, 1),
+            "width": None,
+            "height": None,
+            "thumbnail": None
+        }
+
+        if exif_ifd_tag in ifd0:
+            sub_ifd, _ = read_ifd(tiff, ifd0[exif_ifd_tag], endian)
+            exif["width"] = sub_ifd.get(pixel_width_tag)
+            exif["height"] = sub_ifd.get(pixel_height_tag)
+
+        if ifd1_offset != 0:
+            ifd1, _ = read_ifd(tiff, ifd1_offset, endian)
+            offset = ifd1.get(thumbnail_offset_tag)
+            length = ifd1.get(thumbnail_length_tag)
+
+            # Compression 6 is a JPEG thumbnail, 1 would be raw pixels
+            if ifd1.get(compression_tag, 6) == 6 and offset and length and offset + length <= len(tiff):
+                thumbnail = tiff[offset:offset + length]
+                if thumbnail[:2] == b"\xff\xd8":
+                    exif["thumbnail"] = thumbnail
+
+    except struct.error:
+        return None
+
+    return exif
+
+def apply_orientation(image, orientation):
+    """
+    Rotate and flip an image to display it upright, following an Exif
+    orientation value from 1 to 8
+
+    Returns
+    -------
+    :return opencv image
+    """
+
+    if orientation in (2, 4, 5, 7):
+        image = cv2.flip(image, 1)
+    if orientation in (3, 4):
+        image = cv2.rotate(image, cv2.ROTATE_180)
+    elif orientation in (5, 8):
+        image = cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    elif orientation in (6, 7):
+        image = cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+
+    return image
+
+def get_preview(data, min_size):
+    """
+    Decode the embedded Exif preview of a JPEG if it can stand in for the
+    image, its longest side covering min_size and its aspect ratio
+    matching the image
+
+    Parameters
+    ----------
+    :param data: leading bytes of a JPEG
+    :param min_size: longest side the preview must reach
+
+    Returns
+    -------
+    :return upright opencv image, or None if the full image is needed
+    """
+
+    exif = parse_exif(data)
+    if exif is None or exif["thumbnail"] is None:
+        print("No embedded Exif preview")
+        return None
+
+    preview_size = image_decode.get_jpeg_size(exif["thumbnail"])
+    if preview_size is None or max(preview_size) < min_size:
+        print(f"Exif preview of {preview_size} is smaller than {min_size}px")
+        return None
+
+    # Both sizes are before rotation, prefer the frame header over the tags
+    image_size = image_decode.get_jpeg_size(data)
+    if image_size is None and exif["width"] and exif["height"]:
+        image_size = (exif["width"], exif["height"])
+    if image_size is None:
+        print("Image size unknown, can not validate the Exif preview")
+        return None
+
+    preview_aspect = preview_size[0] / preview_size[1]
+    image_aspect = image_size[0] / image_size[1]
+    if abs(preview_aspect - image_aspect) > aspect_tolerance * image_aspect:
+        print(f"Exif preview of {preview_size} does not match the image aspect ratio of {image_size}")
+        return None
+
+    preview = cv2.imdecode(np.frombuffer(exif["thumbnail"], dtype = np.uint8), cv2.IMREAD_COLOR)
+    if preview is None:
+        return None
+
+    print(f"Using the {preview_size[0]}x{preview_size[1]} Exif preview of a {image_size[0]}x{image_size[1]} image")
+
+    return apply_orientation(preview, exif["orientation"])
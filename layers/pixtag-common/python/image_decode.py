@@ -0,0 +1,130 @@
+import cv2
+import numpy as np
+
+# OpenCV decode flags for each JPEG reduced-decode factor
+reduced_decode_flags = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+# JPEG start-of-frame markers, which carry the image dimensions
+sof_markers = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def read_body(body):
+    """
+    Read an S3 object body straight into a NumPy buffer without copying it
+
+    Parameters
+    ----------
+    :param body: S3 object streaming body
+
+    Returns
+    -------
+    :return uint8 NumPy array backed by the downloaded bytes
+    """
+
+    return np.frombuffer(body.read(), dtype = np.uint8)
+
+def get_jpeg_size(buffer):
+    """
+    Read the dimensions of a JPEG from its start-of-frame header
+    without decoding it
+
+    Parameters
+    ----------
+    :param buffer: encoded image bytes or uint8 array
+
+    Returns
+    -------
+    :return (width, height), or None if the buffer is not a readable JPEG
+    """
+
+    view = memoryview(buffer)
+    if len(view) < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+
+    i = 2
+    while i + 4 <= len(view):
+        if view[i] != 0xFF:
+            return None
+
+        marker = view[i + 1]
+
+        # Skip fill bytes and markers without a payload
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+
+        # Reached the image data or its end without a frame header
+        if marker in (0xD9, 0xDA):
+            return None
+
+        if marker in sof_markers:
+            if i + 9 > len(view):
+                return None
+            height = (view[i + 5] << 8) | view[i + 6]
+            width = (view[i + 7] << 8) | view[i + 8]
+            return width, height
+
+        i += 2 + ((view[i + 2] << 8) | view[i + 3])
+
+    return None
+
+def get_reduce_factor(width, height, min_width, min_height):
+    """
+    Pick the largest JPEG reduced-decode factor that keeps the decoded
+    image at least min_width x min_height
+
+    Parameters
+    ----------
+    :param width: width of the encoded image
+    :param height: height of the encoded image
+    :param min_width: smallest acceptable decoded width
+    :param min_height: smallest acceptable decoded height
+
+    Returns
+    -------
+    :return reduce factor, one of 1, 2, 4 or 8
+    """
+
+    for factor in (8, 4, 2):
+        # libjpeg rounds scaled dimensions up
+        if -(-width // factor) >= min_width and -(-height // factor) >= min_height:
+            return factor
+
+    return 1
+
+def decode_image(buffer, min_width = 0, min_height = 0):
+    """
+    Decode an image, scaling JPEGs down during decode when they are
+    larger than needed
+
+    Parameters
+    ----------
+    :param buffer: encoded image as a uint8 array
+    :param min_width: smallest width the caller needs
+    :param min_height: smallest height the caller needs
+
+    Returns
+    -------
+    :return opencv image
+    """
+
+    factor = 1
+    size = get_jpeg_size(buffer)
+    if size is not None and (min_width > 0 or min_height > 0):
+        factor = get_reduce_factor(size[0], size[1], min_width, min_height)
+
+    image = cv2.imdecode(buffer, reduced_decode_flags[factor])
+    if image is None:
+        raise ValueError("Unable to decode image")
+
+    if factor != 1:
+        print(f"Decoded {size[0]}x{size[1]} JPEG at 1/{factor} scale")
+
+    return image
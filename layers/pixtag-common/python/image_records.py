@@ -0,0 +1,183 @@
+import time
+import tag_codec
+
+# DynamoDB images table
+ddb_table_name = "images"
+
+# Images S3 prefix
+images_prefix = "images"
+thumbnails_prefix = "thumbnails"
+
+# Maximum number of put requests in one BatchWriteItem call
+batch_write_limit = 25
+
+def count_tags(tags):
+    """
+    Get repititions for each tag
+
+    Parameters
+    ----------
+    :param tags: list of detected tags, one entry per detection
+
+    Returns
+    -------
+    :return dictionary of tag to count
+    """
+
+    counts = dict()
+    for tag in tags:
+        counts[tag] = counts.get(tag, 0) + 1
+
+    return counts
+
+def build_item(bucket, user_id, file_name, tag_counts, detections = None):
+    """
+    Build an images table item in DynamoDB client format
+
+    Parameters
+    ----------
+    :param bucket: S3 bucket holding the image
+    :param user_id: owner of the image
+    :param file_name: image file name
+    :param tag_counts: dictionary of tag to count
+    :param detections: raw detections packed by detection_codec, optional
+
+    Returns
+    -------
+    :return DynamoDB item
+    """
+
+    item = {
+        "user_id": { "S": user_id },
+        "thumbnail_url": { "S": f"https://{bucket}.s3.amazonaws.com/{thumbnails_prefix}/{user_id}/{file_name}" },
+        "image_url": { "S": f"https://{bucket}.s3.amazonaws.com/{images_prefix}/{user_id}/{file_name}" }
+    }
+    item.update(tag_codec.encode_tags(tag_counts))
+
+    if detections is not None:
+        item["detections"] = { "B": detections }
+
+    return item
+
+def batch_write_requests(client, requests, table_name, key_names = ("user_id", "thumbnail_url"), max_retries = 5):
+    """
+    Send put and delete requests with BatchWriteItem, retrying unprocessed
+    requests with backoff
+
+    Parameters
+    ----------
+    :param client: DynamoDB boto3 client
+    :param requests: list of {"PutRequest": {"Item": ...}} or
+                     {"DeleteRequest": {"Key": ...}} in client format
+    :param table_name: DynamoDB table name
+    :param key_names: names of the table's key attributes
+    :param max_retries: retries for unprocessed requests of one batch
+
+    Returns
+    -------
+    :return number of requests sent
+    """
+
+    # A batch may not hold two requests for the same key, keep the last one
+    unique_requests = dict()
+    for request in requests:
+        attributes = request["PutRequest"]["Item"] if "PutRequest" in request else request["DeleteRequest"]["Key"]
+        unique_requests[tuple(attributes[name]["S"] for name in key_names)] = request
+    requests = list(unique_requests.values())
+
+    for start in range(0, len(requests), batch_write_limit):
+        request_items = {
+            table_name: requests[start:start + batch_write_limit]
+        }
+
+        for attempt in range(max_retries + 1):
+            response = client.batch_write_item(RequestItems = request_items)
+            request_items = response.get("UnprocessedItems", {})
+            if len(request_items) == 0:
+                break
+            if attempt == max_retries:
+                raise RuntimeError(f"{len(request_items[table_name])} items left unprocessed in table: {table_name}")
+
+            # Back off before retrying throttled writes
+            time.sleep(0.05 * (2 ** attempt))
+
+    return len(requests)
+
+def batch_write_items(client, items, table_name = ddb_table_name, max_retries = 5):
+    """
+    Write items with BatchWriteItem, retrying unprocessed items with backoff
+
+    Parameters
+    ----------
+    :param client: DynamoDB boto3 client
+    :param items: list of DynamoDB items in client format
+    :param table_name: DynamoDB table name
+    :param max_retries: retries for unprocessed items of one batch
+
+    Returns
+    -------
+    :return number of items written
+    """
+
+    return batch_write_requests(client, [{"PutRequest": {"Item": item}} for item in items], table_name,
+                                max_retries = max_retries)
+
+def update_tags(client, key, tag_counts, old_tags, attributes = None, table_name = ddb_table_name, tag_format = None):
+    """
+    Set the tag attributes of one item with UpdateItem, only if its tags
+    are still the ones the caller read, so a concurrent upload, edit or
+    re-detection is never reverted
+
+    Parameters
+    ----------
+    :param client: DynamoDB boto3 client
+    :param key: item key in client format
+    :param tag_counts: dictionary of tag to count
+    :param old_tags: "tags" attribute value as read in client format, None
+                     if the item had no tags
+    :param attributes: other attributes to set in client format, e.g.
+                       "detections"
+    :param table_name: DynamoDB table name
+    :param tag_format: "map" or "set", defaults to PIXTAG_TAG_FORMAT
+
+    Returns
+    -------
+    :return True if the item was written, False if its tags changed since
+            they were read
+    """
+
+    values = dict(tag_codec.encode_tags(tag_counts, tag_format))
+    values.update(attributes or {})
+
+    names = {f"#a{index}": name for index, name in enumerate(values)}
+    expression_values = {f":a{index}": value for index, value in enumerate(values.values())}
+    clauses = list()
+    if len(values) != 0:
+        clauses.append("SET " + ", ".join(f"#a{index} = :a{index}" for index in range(len(values))))
+
+    # A set format item left without tags drops its attributes
+    removed = [name for name in ("tags", "class_counts") if name not in values]
+    if len(removed) != 0:
+        names.update({f"#r{index}": name for index, name in enumerate(removed)})
+        clauses.append("REMOVE " + ", ".join(f"#r{index}" for index in range(len(removed))))
+
+    names["#tags"] = "tags"
+    if old_tags is None:
+        condition = "attribute_not_exists(#tags)"
+    else:
+        condition = "#tags = :old_tags"
+        expression_values[":old_tags"] = old_tags
+
+    try:
+        client.update_item(
+            TableName = table_name,
+            Key = key,
+            UpdateExpression = " ".join(clauses),
+            ConditionExpression = condition,
+            ExpressionAttributeNames = names,
+            ExpressionAttributeValues = expression_values
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        return False
+
+    return True
@@ -0,0 +1,186 @@
+import os
+import abc
+import cv2
+import numpy as np
+
+# Engine used when the deployment does not name one
+default_engine = "opencv"
+
+# Graph optimization levels understood by every engine
+optimization_levels = ("disabled", "basic", "extended", "all")
+
+def get_engine_options():
+    """
+    Read the engine selection of the deployment: PIXTAG_INFERENCE_ENGINE,
+    PIXTAG_ENGINE_THREADS, PIXTAG_ENGINE_OPTIMIZATION and PIXTAG_ONNX_MODEL
+
+    Returns
+    -------
+    :return engine name, options dictionary
+    """
+
+    options = {
+        "threads": int(os.environ.get("PIXTAG_ENGINE_THREADS", "0")),
+        "optimization": os.environ.get("PIXTAG_ENGINE_OPTIMIZATION", "all"),
+        "onnx_path": os.environ.get("PIXTAG_ONNX_MODEL")
+    }
+
+    return os.environ.get("PIXTAG_INFERENCE_ENGINE", default_engine), options
+
+class InferenceEngine(abc.ABC):
+    """
+    A loaded YOLO network. forward takes an NCHW float32 blob and returns
+    one array per YOLO output layer, with rows of normalized center x,
+    center y, width, height, objectness and class scores. A single image
+    gives (rows, 85) arrays, a batch gives (N, rows, 85) arrays.
+    """
+
+    name = None
+
+    @abc.abstractmethod
+    def forward(self, blob):
+        """
+        Run the network on a blob
+
+        Returns
+        -------
+        :return list of arrays, one per YOLO output layer
+        """
+
+    def describe(self):
+        """
+        Get the engine name and settings for logs and benchmark reports
+        """
+
+        return {"engine": self.name}
+
+class OpenCVEngine(InferenceEngine):
+    """
+    OpenCV DNN running the Darknet config and weights directly
+    """
+
+    name = "opencv"
+
+    def __init__(self, config_path, weights_path, threads = 0, optimization = "all", **kwargs):
+        """
+        Parameters
+        ----------
+        :param config_path: path to YOLO configs
+        :param weights_path: path to YOLO weights
+        :param threads: OpenCV worker threads, 0 keeps OpenCV's default.
+                        The setting is global to the process.
+        :param optimization: "disabled" turns off layer fusion, any other
+                             level keeps it
+        """
+
+        if optimization not in optimization_levels:
+            raise ValueError(f"Unknown optimization level: {optimization}. Available levels: {', '.join(optimization_levels)}")
+
+        if threads > 0:
+            cv2.setNumThreads(threads)
+
+        self.threads = cv2.getNumThreads()
+        self.optimization = optimization
+        self.net = cv2.dnn.readNetFromDarknet(config_path, weights_path)
+        self.net.enableFusion(optimization != "disabled")
+
+        layer_names = self.net.getLayerNames()
+        self.output_layers = [layer_names[i - 1] for i in np.array(self.net.getUnconnectedOutLayers()).flatten()]
+
+    def forward(self, blob):
+        self.net.setInput(blob)
+        return self.net.forward(self.output_layers)
+
+    def describe(self):
+        return {"engine": self.name, "threads": self.threads, "optimization": self.optimization}
+
+class OnnxRuntimeEngine(InferenceEngine):
+    """
+    ONNX Runtime on the CPU execution provider. The ONNX model must be an
+    export of the same network whose outputs are the decoded YOLO layers,
+    in the layout OpenCV returns, as written by tools/export_onnx.py. The
+    onnxruntime package is optional and only imported when this engine is
+    used.
+    """
+
+    name = "onnxruntime"
+
+    def __init__(self, config_path, weights_path, threads = 0, optimization = "all", onnx_path = None, **kwargs):
+        """
+        Parameters
+        ----------
+        :param config_path: path to YOLO configs, unused
+        :param weights_path: path to YOLO weights, the ONNX model defaults
+                             to the same path with an .onnx extension
+        :param threads: intra-op threads, 0 lets ONNX Runtime pick
+        :param optimization: graph optimization level
+        :param onnx_path: path to the ONNX model
+        """
+
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnxruntime engine needs the onnxruntime package")
+
+        levels = {
+            "disabled": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+            "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        }
+        if optimization not in levels:
+            raise ValueError(f"Unknown optimization level: {optimization}. Available levels: {', '.join(optimization_levels)}")
+
+        self.onnx_path = onnx_path or f"{os.path.splitext(weights_path)[0]}.onnx"
+        self.threads = threads
+        self.optimization = optimization
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = levels[optimization]
+        session_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        session_options.intra_op_num_threads = threads
+        session_options.inter_op_num_threads = 1
+
+        self.session = onnxruntime.InferenceSession(self.onnx_path, sess_options = session_options,
+                                                    providers = ["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def forward(self, blob):
+        layer_outputs = self.session.run(None, {self.input_name: blob})
+
+        # Match OpenCV, which drops the batch axis for a single image
+        if blob.shape[0] == 1:
+            layer_outputs = [output[0] if output.ndim == 3 else output for output in layer_outputs]
+
+        return layer_outputs
+
+    def describe(self):
+        return {"engine": self.name, "threads": self.threads, "optimization": self.optimization,
+                "onnx_path": self.onnx_path}
+
+# Available engines by name
+engines = {
+    OpenCVEngine.name: OpenCVEngine,
+    OnnxRuntimeEngine.name: OnnxRuntimeEngine
+}
+
+def create_engine(name, config_path, weights_path, **options):
+    """
+    Create an inference engine by name
+
+    Parameters
+    ----------
+    :param name: engine name
+    :param config_path: path to YOLO configs
+    :param weights_path: path to YOLO weights
+    :param options: engine settings such as threads and optimization
+
+    Returns
+    -------
+    :return inference engine
+    """
+
+    if name not in engines:
+        raise ValueError(f"Unknown inference engine: {name}. Available engines: {', '.join(engines)}")
+
+    return engines[name](config_path, weights_path, **options)
@@ -0,0 +1,51 @@
+import os
+
+# Named detector settings trading latency for accuracy. The input size
+# must be a multiple of 32 for YOLO.
+profiles = {
+    "fast-320": {
+        "input_size": 320,
+        "conf_threshold": 0.3,
+        "nms_threshold": 0.1,
+        "tag_threshold": 0.6
+    },
+    "default-416": {
+        "input_size": 416,
+        "conf_threshold": 0.3,
+        "nms_threshold": 0.1,
+        "tag_threshold": 0.6
+    },
+    "accurate-608": {
+        "input_size": 608,
+        "conf_threshold": 0.3,
+        "nms_threshold": 0.1,
+        "tag_threshold": 0.6
+    }
+}
+
+default_profile = "default-416"
+
+def get_profile(name = None, fallback = default_profile):
+    """
+    Resolve an inference profile, from the request first, then the
+    deployment's PIXTAG_INFERENCE_PROFILE and finally the caller's fallback
+
+    Parameters
+    ----------
+    :param name: profile name requested by the caller, may be None
+    :param fallback: profile used when neither the request nor the
+                     deployment names one
+
+    Returns
+    -------
+    :return profile dictionary including its name
+    """
+
+    name = name or os.environ.get("PIXTAG_INFERENCE_PROFILE") or fallback
+    if name not in profiles:
+        raise ValueError(f"Unknown inference profile: {name}. Available profiles: {', '.join(profiles)}")
+
+    profile = dict(profiles[name])
+    profile["name"] = name
+
+    return profile
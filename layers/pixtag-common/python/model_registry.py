@@ -0,0 +1,137 @@
+import os
+import time
+import numpy as np
+import inference_engines
+
+# Run a warm-up forward pass when a model is first loaded
+warmup_enabled = os.environ.get("PIXTAG_MODEL_WARMUP", "1") != "0"
+
+# Blob size used for the warm-up forward pass
+warmup_size = 416
+
+# Models loaded in this container, keyed by paths, engine and engine options
+models = dict()
+
+# Load and inference timing for this container
+stats = {
+    "loads": 0,
+    "cache_hits": 0,
+    "load_seconds": 0.0,
+    "warmup_seconds": 0.0,
+    "inferences": 0,
+    "inference_seconds": 0.0,
+    "last_inference_seconds": 0.0
+}
+
+def warmup(model, size = warmup_size):
+    """
+    Run a forward pass on an empty blob so the first real request
+    does not pay for lazy layer allocation
+
+    Parameters
+    ----------
+    :param model: model dictionary returned by load_model
+    :param size: width and height of the warm-up blob
+
+    Returns
+    -------
+    :return warm-up time in seconds
+    """
+
+    blob = np.zeros((1, 3, size, size), dtype = np.float32)
+    start = time.time()
+    model["engine"].forward(blob)
+    end = time.time()
+
+    stats["warmup_seconds"] += end - start
+    print("YOLO warm-up took {:.6f} seconds".format(end - start))
+
+    return end - start
+
+def load_model(config_path, weights_path, warm = None, size = warmup_size, engine = None, **options):
+    """
+    Load our YOLO object detector once per container and reuse it
+    on every later invocation
+
+    Parameters
+    ----------
+    :param config_path: path to YOLO configs
+    :param weights_path: path to YOLO weights
+    :param warm: run a warm-up forward pass on first load,
+                 defaults to PIXTAG_MODEL_WARMUP
+    :param size: input size of the warm-up forward pass
+    :param engine: inference engine name, defaults to PIXTAG_INFERENCE_ENGINE
+    :param options: engine settings, override the PIXTAG_ENGINE_* defaults
+
+    Returns
+    -------
+    :return model dictionary with the inference engine
+    """
+
+    default_engine, engine_options = inference_engines.get_engine_options()
+    engine = engine or default_engine
+    engine_options.update(options)
+
+    key = (config_path, weights_path, engine, tuple(sorted(engine_options.items())))
+    if key in models:
+        stats["cache_hits"] += 1
+        return models[key]
+
+    print(f"Loading YOLO object detector on {engine} ...")
+    start = time.time()
+    model = {
+        "engine": inference_engines.create_engine(engine, config_path, weights_path, **engine_options)
+    }
+    end = time.time()
+
+    stats["loads"] += 1
+    stats["load_seconds"] += end - start
+    print("YOLO load took {:.6f} seconds with {}".format(end - start, model["engine"].describe()))
+
+    if warmup_enabled if warm is None else warm:
+        warmup(model, size)
+
+    models[key] = model
+    return model
+
+def forward(model, blob):
+    """
+    Perform a forward pass of a loaded model and record its timing
+
+    Parameters
+    ----------
+    :param model: model dictionary returned by load_model
+    :param blob: input blob
+
+    Returns
+    -------
+    :return list of output layer arrays
+    """
+
+    start = time.time()
+    layer_outputs = model["engine"].forward(blob)
+    end = time.time()
+
+    stats["inferences"] += 1
+    stats["inference_seconds"] += end - start
+    stats["last_inference_seconds"] = end - start
+
+    # Log timing information on YOLO
+    print("YOLO took {:.6f} seconds".format(end - start))
+
+    return layer_outputs
+
+def get_stats():
+    """
+    Get load and inference timing for this container
+
+    Returns
+    -------
+    :return dictionary of timing statistics
+    """
+
+    timing = dict(stats)
+    if timing["inferences"] != 0:
+        timing["mean_inference_seconds"] = timing["inference_seconds"] / timing["inferences"]
+
+    return timing
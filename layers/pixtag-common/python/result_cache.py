@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import boto3
+import hashlib
+from collections import OrderedDict
+
+# Bump to invalidate every cached result after a model change
+cache_version = "1"
+
+def content_key(image_bytes, profile_name):
+    """
+    Build a cache key from the image bytes and the inference profile
+
+    Parameters
+    ----------
+    :param image_bytes: encoded image bytes
+    :param profile_name: name of the inference profile used for detection
+
+    Returns
+    -------
+    :return cache key
+    """
+
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    return f"v{cache_version}:{profile_name}:{digest}"
+
+class MemoryTier:
+    """
+    In-memory LRU tier, lives as long as the container
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        if entry["expires_at"] < time.time():
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return entry["value"]
+
+    def put(self, key, value):
+        self.entries[key] = {"value": value, "expires_at": time.time() + self.ttl}
+        self.entries.move_to_end(key)
+
+        # Evict the least recently used entries
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last = False)
+
+class FileTier:
+    """
+    JSON file tier, survives container restarts when the path is on
+    persistent storage
+    """
+
+    name = "file"
+
+    def __init__(self, path, max_entries, ttl):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = dict()
+
+        if os.path.exists(path):
+            try:
+                with open(path) as cache_file:
+                    self.entries = json.load(cache_file)
+            except ValueError as e:
+                print(f"Ignoring unreadable cache file: {path}: {e}")
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry["expires_at"] < time.time():
+            return None
+
+        entry["used_at"] = time.time()
+        return entry["value"]
+
+    def put(self, key, value):
+        now = time.time()
+        self.entries[key] = {"value": value, "expires_at": now + self.ttl, "used_at": now}
+
+        # Drop expired entries, then the least recently used ones
+        self.entries = {k: v for k, v in self.entries.items() if v["expires_at"] >= now}
+        if len(self.entries) > self.max_entries:
+            keep = sorted(self.entries, key = lambda k: self.entries[k]["used_at"])[-self.max_entries:]
+            self.entries = {k: self.entries[k] for k in keep}
+
+        # Write atomically so a concurrent reader never sees a partial file
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as cache_file:
+            json.dump(self.entries, cache_file)
+        os.replace(temp_path, self.path)
+
+class DynamoDBTier:
+    """
+    DynamoDB table tier shared by every container. Any object with the
+    get_item/put_item methods of a boto3 Table resource can stand in for
+    the table, so it can be emulated locally. Size is bounded by enabling
+    DynamoDB TTL on the expires_at attribute.
+    """
+
+    name = "dynamodb"
+
+    def __init__(self, table, ttl):
+        self.table = table
+        self.ttl = ttl
+
+    def get(self, key):
+        item = self.table.get_item(Key = {"image_hash": key}).get("Item")
+
+        # DynamoDB removes expired items lazily
+        if item is None or int(item["expires_at"]) < time.time():
+            return None
+
+        return item["value"]
+
+    def put(self, key, value):
+        self.table.put_item(
+            Item = {
+                "image_hash": key,
+                "value": value,
+                "expires_at": int(time.time() + self.ttl)
+            }
+        )
+
+class ResultCache:
+    """
+    Tiered cache, checked from the fastest tier down. Hits in a slower
+    tier are copied into the faster ones.
+    """
+
+    def __init__(self, tiers):
+        self.tiers = tiers
+        self.stats = {"misses": 0}
+        for tier in tiers:
+            self.stats[f"{tier.name}_hits"] = 0
+
+    def get(self, key):
+        for i, tier in enumerate(self.tiers):
+            try:
+                value = tier.get(key)
+            except Exception as e:
+                print(f"Cache tier {tier.name} read failed: {e}")
+                continue
+
+            if value is not None:
+                self.stats[f"{tier.name}_hits"] += 1
+                for faster_tier in self.tiers[:i]:
+                    faster_tier.put(key, value)
+                return value
+
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, key, value):
+        for tier in self.tiers:
+            try:
+                tier.put(key, value)
+            except Exception as e:
+                print(f"Cache tier {tier.name} write failed: {e}")
+
+def from_environment(table = None):
+    """
+    Build a result cache from the PIXTAG_RESULT_CACHE_* settings
+
+    Parameters
+    ----------
+    :param table: DynamoDB table, or a local stand-in, for the
+                  persistent tier, overrides PIXTAG_RESULT_CACHE_TABLE
+
+    Returns
+    -------
+    :return result cache
+    """
+
+    max_entries = int(os.environ.get("PIXTAG_RESULT_CACHE_SIZE", "256"))
+    ttl = int(os.environ.get("PIXTAG_RESULT_CACHE_TTL", "86400"))
+    path = os.environ.get("PIXTAG_RESULT_CACHE_FILE")
+    file_max_entries = int(os.environ.get("PIXTAG_RESULT_CACHE_FILE_SIZE", "4096"))
+    table_name = os.environ.get("PIXTAG_RESULT_CACHE_TABLE")
+
+    tiers = [MemoryTier(max_entries, ttl)]
+    if table is None and table_name:
+        table = boto3.resource('dynamodb').Table(table_name)
+    if table is not None:
+        tiers.append(DynamoDBTier(table, ttl))
+    elif path:
+        tiers.append(FileTier(path, file_max_entries, ttl))
+
+    return ResultCache(tiers)
@@ -0,0 +1,321 @@
+import io
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+import tag_codec
+import tag_query
+
+# Snapshots of the per-user indexes, one .npz object per user
+snapshot_bucket = os.environ.get("PIXTAG_BITMASK_BUCKET", "g74-a3")
+snapshot_prefix = os.environ.get("PIXTAG_BITMASK_PREFIX", "tag-bitmasks")
+
+# Loaded indexes kept per container
+cache_users = int(os.environ.get("PIXTAG_BITMASK_CACHE_USERS", "32"))
+
+# Two 64 bit words cover the 80 COCO classes
+mask_words = (len(tag_codec.coco_labels) + 63) // 64
+
+def snapshot_key(user_id):
+    """
+    S3 key of the index snapshot of a user
+    """
+
+    return f"{snapshot_prefix}/{user_id}.npz"
+
+class BitmaskIndex:
+    """
+    Tags of every image of a user as NumPy arrays, one row per image in
+    thumbnail URL order: "masks" holds the classes present as bits, and
+    "counts" the count of every class (uint8, column-major so a class is
+    one contiguous read). Queries over the COCO vocabulary are evaluated
+    for every image at once.
+    """
+
+    def __init__(self, thumbnail_urls, masks, counts):
+        self.thumbnail_urls = list(thumbnail_urls)
+        self.masks = masks
+        self.counts = np.asfortranarray(counts)
+
+    @classmethod
+    def empty(cls):
+        return cls([], np.zeros((0, mask_words), dtype = np.uint64),
+                   np.zeros((0, len(tag_codec.coco_labels)), dtype = np.uint8))
+
+    @classmethod
+    def from_class_counts(cls, class_counts):
+        """
+        Build an index from a dictionary of thumbnail URL to class counts
+        vector, as packed by tag_codec.encode_class_counts
+        """
+
+        thumbnail_urls = sorted(class_counts)
+        counts = np.frombuffer(b"".join(class_counts[thumbnail_url] for thumbnail_url in thumbnail_urls),
+                               dtype = np.uint8).reshape(len(thumbnail_urls), len(tag_codec.coco_labels))
+
+        return cls(thumbnail_urls, cls.build_masks(counts), counts)
+
+    @staticmethod
+    def build_masks(counts):
+        """
+        Pack the classes present in every row of a counts array into bits
+        """
+
+        present = np.zeros((counts.shape[0], mask_words * 64), dtype = bool)
+        present[:, :counts.shape[1]] = counts != 0
+        weights = np.left_shift(np.uint64(1), np.arange(64, dtype = np.uint64))
+
+        return np.stack([(present[:, word * 64:(word + 1) * 64] * weights).sum(axis = 1, dtype = np.uint64)
+                         for word in range(mask_words)], axis = 1)
+
+    def apply(self, changes):
+        """
+        Apply a batch of changes and keep the rows in thumbnail URL order
+
+        Parameters
+        ----------
+        :param changes: dictionary of thumbnail URL to class counts vector,
+                        or None for a removed image
+
+        Returns
+        -------
+        :return new BitmaskIndex
+        """
+
+        # Drop the rows of every changed image, then append the new ones
+        keep = np.array([thumbnail_url not in changes for thumbnail_url in self.thumbnail_urls], dtype = bool)
+
+        added = [thumbnail_url for thumbnail_url, vector in changes.items() if vector is not None]
+        added_counts = np.frombuffer(b"".join(changes[thumbnail_url] for thumbnail_url in added),
+                                     dtype = np.uint8).reshape(len(added), len(tag_codec.coco_labels))
+
+        thumbnail_urls = [thumbnail_url for thumbnail_url, kept in zip(self.thumbnail_urls, keep) if kept] + added
+        masks = np.concatenate([self.masks[keep], self.build_masks(added_counts)])
+        counts = np.concatenate([self.counts[keep], added_counts])
+
+        # The kept rows are already sorted, so this is close to linear
+        order = sorted(range(len(thumbnail_urls)), key = thumbnail_urls.__getitem__)
+
+        return BitmaskIndex([thumbnail_urls[row] for row in order], masks[order], counts[order])
+
+    def to_bytes(self):
+        """
+        Serialize the index to a compressed .npz snapshot
+        """
+
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            thumbnail_urls = np.frombuffer("\n".join(self.thumbnail_urls).encode(), dtype = np.uint8),
+            masks = self.masks,
+            # Stored class by class, so loading needs no transpose
+            counts = self.counts.T
+        )
+
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Read an index from a .npz snapshot
+        """
+
+        with np.load(io.BytesIO(data), allow_pickle = False) as snapshot:
+            names = snapshot["thumbnail_urls"].tobytes().decode()
+            thumbnail_urls = names.split("\n") if names != "" else []
+            return cls(thumbnail_urls, snapshot["masks"], snapshot["counts"].T)
+
+    def evaluate(self, node):
+        """
+        Check every image against a query
+
+        Returns
+        -------
+        :return boolean array, one entry per row
+        """
+
+        kind = node[0]
+        if kind == "tag":
+            class_id = tag_codec.class_ids[node[1]]
+            if node[2] == ">=" and node[3] == 1:
+                word, bit = divmod(class_id, 64)
+                return (self.masks[:, word] & np.uint64(1 << bit)) != 0
+            return tag_query.operators[node[2]](self.counts[:, class_id].astype(np.int32), node[3])
+        if kind == "and":
+            return np.logical_and.reduce([self.evaluate(child) for child in node[1]])
+        if kind == "or":
+            return np.logical_or.reduce([self.evaluate(child) for child in node[1]])
+
+        return ~self.evaluate(node[1])
+
+    def score(self, node, negated = False):
+        """
+        Number of predicates every image satisfies, leaving out those under NOT
+        """
+
+        kind = node[0]
+        if kind == "tag":
+            if negated:
+                return np.zeros(len(self.thumbnail_urls), dtype = np.int32)
+            return self.evaluate(node).astype(np.int32)
+        if kind == "not":
+            return self.score(node[1], not negated)
+
+        return np.sum([self.score(child, negated) for child in node[1]], axis = 0, dtype = np.int32)
+
+    def search(self, node):
+        """
+        Find the images matching a query, ranked like tag_query.search
+
+        Returns
+        -------
+        :return list of (thumbnail_url, score)
+        """
+
+        matched = np.flatnonzero(self.evaluate(node))
+        if len(matched) == 0:
+            return []
+
+        class_columns = [tag_codec.class_ids[tag] for tag in tag_query.get_tags(node)]
+        total = self.counts[:, class_columns][matched].sum(axis = 1, dtype = np.int64)
+        scores = self.score(node)[matched]
+
+        # Rows are in thumbnail URL order, so the row breaks ties
+        order = np.lexsort((matched, -total, -scores))
+
+        return list(zip(map(self.thumbnail_urls.__getitem__, matched[order].tolist()), scores[order].tolist()))
+
+def read_snapshot(s3, user_id, etag = None, bucket = snapshot_bucket):
+    """
+    Read the snapshot of a user, revalidating a loaded copy by its ETag
+
+    Returns
+    -------
+    :return (BitmaskIndex, ETag), None if the snapshot is unchanged, or
+            (None, None) if the user has no snapshot
+    """
+
+    try:
+        if etag is None:
+            snapshot = s3.get_object(Bucket = bucket, Key = snapshot_key(user_id))
+        else:
+            snapshot = s3.get_object(Bucket = bucket, Key = snapshot_key(user_id), IfNoneMatch = etag)
+    except s3.exceptions.ClientError as e:
+        code = e.response["Error"]["Code"]
+        if etag is not None and code in ("304", "NotModified"):
+            return None
+        if code in ("404", "NoSuchKey"):
+            return None, None
+        raise
+
+    return BitmaskIndex.from_bytes(snapshot["Body"].read()), snapshot["ETag"]
+
+def get_snapshot_etag(s3, user_id, bucket = snapshot_bucket):
+    """
+    ETag of the snapshot of a user, without reading it
+
+    Returns
+    -------
+    :return ETag, or None if the user has no snapshot
+    """
+
+    try:
+        return s3.head_object(Bucket = bucket, Key = snapshot_key(user_id))["ETag"]
+    except s3.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+def write_snapshot(s3, user_id, index, etag = None, check = False, bucket = snapshot_bucket):
+    """
+    Write the snapshot of a user, or delete it once the user has no images
+
+    Parameters
+    ----------
+    :param s3: S3 boto3 client
+    :param user_id: owner of the images
+    :param index: BitmaskIndex to write
+    :param etag: ETag of the snapshot the index was built from, None if
+                 the user had no snapshot
+    :param check: compare the stored snapshot against etag first, so the
+                  write of another writer since the read is not overwritten
+    :param bucket: snapshots bucket
+
+    Returns
+    -------
+    :return True if written, False if the snapshot changed since the read
+    """
+
+    if check:
+        current = get_snapshot_etag(s3, user_id, bucket)
+        if current != etag:
+            print(f"Snapshot of user {user_id} changed from ETag {etag} to {current} since it was read")
+            return False
+
+    if len(index.thumbnail_urls) == 0:
+        s3.delete_object(Bucket = bucket, Key = snapshot_key(user_id))
+        return True
+
+    s3.put_object(Bucket = bucket, Key = snapshot_key(user_id), Body = index.to_bytes(),
+                  ContentType = "application/octet-stream")
+
+    return True
+
+# Indexes loaded in this container, keyed by user
+loaded = OrderedDict()
+loaded_lock = threading.Lock()
+
+def get_index(s3, user_id, bucket = snapshot_bucket):
+    """
+    Get the index of a user, reading its snapshot again only when it changed
+
+    Returns
+    -------
+    :return BitmaskIndex, or None if the user has no snapshot
+    """
+
+    with loaded_lock:
+        cached = loaded.get(user_id)
+
+    result = read_snapshot(s3, user_id, cached[1] if cached is not None else None, bucket)
+    if result is None:
+        with loaded_lock:
+            if user_id in loaded:
+                loaded.move_to_end(user_id)
+        return cached[0]
+
+    with loaded_lock:
+        if result[0] is None:
+            loaded.pop(user_id, None)
+            return None
+        loaded[user_id] = result
+        while len(loaded) > cache_users:
+            loaded.popitem(last = False)
+
+    return result[0]
+
+def search(s3, client, user_id, node, bucket = snapshot_bucket):
+    """
+    Find the images of a user matching a query with the bitmask index,
+    falling back to the inverted index for tags outside the COCO vocabulary
+    or users without a snapshot
+
+    Parameters
+    ----------
+    :param s3: S3 boto3 client
+    :param client: DynamoDB boto3 client
+    :param user_id: owner of the images
+    :param node: query node parsed by tag_query
+    :param bucket: snapshots bucket
+
+    Returns
+    -------
+    :return list of (thumbnail_url, score), best first
+    """
+
+    if tag_query.get_tags(node) <= tag_codec.class_ids.keys():
+        index = get_index(s3, user_id, bucket)
+        if index is not None:
+            return index.search(node)
+
+    return tag_query.search(client, user_id, node)
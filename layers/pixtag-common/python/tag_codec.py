@@ -0,0 +1,168 @@
+import os
+
+# Image tags are stored as a map of tag name to count under "tags", with
+# the counts of the COCO classes repeated in "class_counts": one byte per
+# class id, capped at 255. Older items hold "tags" as a string set of
+# "tag, count" strings, readers accept both until they are migrated.
+#
+# PIXTAG_TAG_FORMAT=set keeps writing string sets while readers roll out.
+write_format = os.environ.get("PIXTAG_TAG_FORMAT", "map")
+
+# Classes of the YOLO model, in class id order (coco.names)
+coco_labels = (
+    "person", "bicycle", "car", "motorbike", "aeroplane", "bus", "train", "truck", "boat", "traffic light",
+    "fire hydrant", "stop sign", "parking meter", "bench", "bird", "cat", "dog", "horse", "sheep", "cow",
+    "elephant", "bear", "zebra", "giraffe", "backpack", "umbrella", "handbag", "tie", "suitcase", "frisbee",
+    "skis", "snowboard", "sports ball", "kite", "baseball bat", "baseball glove", "skateboard", "surfboard",
+    "tennis racket", "bottle", "wine glass", "cup", "fork", "knife", "spoon", "bowl", "banana", "apple",
+    "sandwich", "orange", "broccoli", "carrot", "hot dog", "pizza", "donut", "cake", "chair", "sofa",
+    "pottedplant", "bed", "diningtable", "toilet", "tvmonitor", "laptop", "mouse", "remote", "keyboard",
+    "cell phone", "microwave", "oven", "toaster", "sink", "refrigerator", "book", "clock", "vase", "scissors",
+    "teddy bear", "hair drier", "toothbrush"
+)
+class_ids = {label: class_id for class_id, label in enumerate(coco_labels)}
+
+def parse_tag(tag):
+    """
+    Resolve a "tag, count" string to the tag and its count
+
+    Returns
+    -------
+    :return tag, count
+    """
+
+    parts = tag.split(",")
+    if len(parts) == 1:
+        return parts[0].strip(), 1
+    else:
+        return parts[0].strip(), int(parts[1].strip())
+
+def parse_tags(tags_list):
+    """
+    Resolve a list of "tag, count" strings
+
+    Returns
+    -------
+    :return dictionary of tag to count
+    """
+
+    counts = dict()
+    for tag in tags_list:
+        name, count = parse_tag(tag)
+        counts[name] = count
+
+    return counts
+
+def format_tags(counts):
+    """
+    Build the "tag, count" strings of a dictionary of tag to count
+    """
+
+    return [f"{name}, {count}" for name, count in counts.items()]
+
+def encode_class_counts(counts):
+    """
+    Pack the counts of the COCO classes into one byte per class id, tags
+    outside the vocabulary are left out
+
+    Returns
+    -------
+    :return bytes of length len(coco_labels)
+    """
+
+    vector = bytearray(len(coco_labels))
+    for name, count in counts.items():
+        if name in class_ids:
+            vector[class_ids[name]] = min(count, 255)
+
+    return bytes(vector)
+
+def decode_class_counts(data):
+    """
+    Unpack a class counts vector
+
+    Returns
+    -------
+    :return dictionary of tag to count
+    """
+
+    return {coco_labels[class_id]: count for class_id, count in enumerate(bytes(data)) if count != 0}
+
+def encode_tags(counts, tag_format = None):
+    """
+    Build the tag attributes of an item in DynamoDB client format
+
+    Parameters
+    ----------
+    :param counts: dictionary of tag to count
+    :param tag_format: "map" or "set", defaults to PIXTAG_TAG_FORMAT
+
+    Returns
+    -------
+    :return dictionary of attribute name to value, without "tags" for no
+            tags in the set format since DynamoDB rejects empty sets
+    """
+
+    if (tag_format or write_format) == "set":
+        return {"tags": {"SS": format_tags(counts)}} if len(counts) != 0 else dict()
+
+    return {
+        "tags": {"M": {name: {"N": str(count)} for name, count in counts.items()}},
+        "class_counts": {"B": encode_class_counts(counts)}
+    }
+
+def decode_tags(value):
+    """
+    Read a "tags" attribute value in DynamoDB client format, stored either
+    as a map or as a string set
+
+    Returns
+    -------
+    :return dictionary of tag to count, empty for a missing attribute
+    """
+
+    if value is None:
+        return dict()
+    if "M" in value:
+        return {name: int(count["N"]) for name, count in value["M"].items()}
+
+    return parse_tags(value.get("SS", []))
+
+def item_tags(item):
+    """
+    Read the tags of an item in DynamoDB client format, or of a stream image
+    """
+
+    return decode_tags(item.get("tags"))
+
+def record_attributes(counts, tag_format = None):
+    """
+    Build the tag attributes of a record written with a boto3 Table resource
+
+    Returns
+    -------
+    :return dictionary of attribute name to value
+    """
+
+    if (tag_format or write_format) == "set":
+        return {"tags": set(format_tags(counts))} if len(counts) != 0 else dict()
+
+    return {"tags": dict(counts), "class_counts": encode_class_counts(counts)}
+
+def record_tags(record):
+    """
+    Read the tags of a record read with a boto3 Table resource, where a map
+    comes back as a dictionary of Decimal and a string set as a set
+
+    Returns
+    -------
+    :return dictionary of tag to count
+    """
+
+    value = record.get("tags")
+    if value is None:
+        return dict()
+    if isinstance(value, dict):
+        return {name: int(count) for name, count in value.items()}
+
+    return parse_tags(value)
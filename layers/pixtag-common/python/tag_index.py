@@ -0,0 +1,131 @@
+import os
+import ddb_query
+import image_records
+import tag_codec
+
+# Inverted index table: partition key "user_tag" holding "<user_id>#<tag>",
+# sort key "thumbnail_url", with the tag "count" and the "image_url"
+index_table_name = os.environ.get("PIXTAG_TAG_INDEX_TABLE", "imagetags")
+index_key_names = ("user_tag", "thumbnail_url")
+
+def partition_key(user_id, tag):
+    """
+    Index partition holding the images of a user with a tag
+    """
+
+    return f"{user_id}#{tag}"
+
+def get_sync_requests(user_id, thumbnail_url, image_url, old_tags, new_tags):
+    """
+    Build the index writes that move an image from its old tags to its
+    new tags. Unchanged postings are not rewritten.
+
+    Parameters
+    ----------
+    :param user_id: owner of the image
+    :param thumbnail_url: thumbnail URL, the image's key in the images table
+    :param image_url: full image URL
+    :param old_tags: dictionary of tag to count currently indexed, empty
+                     for a new image
+    :param new_tags: dictionary of tag to count, empty for a deleted image
+
+    Returns
+    -------
+    :return list of BatchWriteItem requests in client format
+    """
+
+    requests = list()
+    for tag in old_tags.keys() - new_tags.keys():
+        requests.append({"DeleteRequest": {"Key": {
+            "user_tag": { "S": partition_key(user_id, tag) },
+            "thumbnail_url": { "S": thumbnail_url }
+        }}})
+
+    for tag, count in new_tags.items():
+        if old_tags.get(tag) == count:
+            continue
+        requests.append({"PutRequest": {"Item": {
+            "user_tag": { "S": partition_key(user_id, tag) },
+            "thumbnail_url": { "S": thumbnail_url },
+            "image_url": { "S": image_url },
+            "count": { "N": str(count) }
+        }}})
+
+    return requests
+
+def sync_items(client, items, old_tags, table_name = index_table_name):
+    """
+    Bring the index in line with images table items, used to build the
+    index. Later changes reach it through the update-tag-index stream trigger.
+
+    Parameters
+    ----------
+    :param client: DynamoDB boto3 client
+    :param items: written images table items in client format
+    :param old_tags: dictionary of (user_id, thumbnail_url) to the tags
+                     already indexed, empty when building the index
+    :param table_name: index table name
+
+    Returns
+    -------
+    :return number of index writes
+    """
+
+    requests = list()
+    for item in items:
+        user_id = item["user_id"]["S"]
+        thumbnail_url = item["thumbnail_url"]["S"]
+        requests.extend(get_sync_requests(user_id, thumbnail_url, item["image_url"]["S"],
+                                          old_tags.get((user_id, thumbnail_url), {}), tag_codec.item_tags(item)))
+
+    return image_records.batch_write_requests(client, requests, table_name, index_key_names)
+
+def iter_tag(client, user_id, tag, min_count = 1, start_after = None, page_size = None,
+             table_name = index_table_name):
+    """
+    Stream the images of a user with at least min_count of a tag, one index
+    page at a time
+
+    Parameters
+    ----------
+    :param client: DynamoDB boto3 client
+    :param user_id: owner of the images
+    :param tag: tag name
+    :param min_count: smallest tag count to match
+    :param start_after: thumbnail URL to resume after, None from the start
+    :param page_size: postings read per request, None for up to 1 MB
+    :param table_name: index table name
+
+    Returns
+    -------
+    :return generator of (thumbnail_url, count) ordered by thumbnail_url
+    """
+
+    query_args = {
+        "TableName": table_name,
+        "KeyConditionExpression": "user_tag = :user_tag",
+        "ProjectionExpression": "thumbnail_url, #count",
+        "ExpressionAttributeNames": {"#count": "count"},
+        "ExpressionAttributeValues": {":user_tag": {"S": partition_key(user_id, tag)}}
+    }
+    if min_count > 1:
+        query_args["FilterExpression"] = "#count >= :min_count"
+        query_args["ExpressionAttributeValues"][":min_count"] = {"N": str(min_count)}
+
+    start_key = None
+    if start_after is not None:
+        start_key = {"user_tag": {"S": partition_key(user_id, tag)}, "thumbnail_url": {"S": start_after}}
+
+    for item in ddb_query.query_items(client, page_size, start_key, **query_args):
+        yield item["thumbnail_url"]["S"], int(item["count"]["N"])
+
+def query_tag(client, user_id, tag, min_count = 1, table_name = index_table_name):
+    """
+    Find the images of a user with at least min_count of a tag
+
+    Returns
+    -------
+    :return list of (thumbnail_url, count) ordered by thumbnail_url
+    """
+
+    return list(iter_tag(client, user_id, tag, min_count, table_name = table_name))
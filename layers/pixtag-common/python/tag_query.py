@@ -0,0 +1,314 @@
+import re
+import operator
+import ddb_query
+import image_records
+import tag_codec
+import tag_index
+
+# Count comparisons of a tag predicate, "dog, 2" is read as dog >= 2
+operators = {
+    ">=": operator.ge,
+    ">": operator.gt,
+    "<=": operator.le,
+    "<": operator.lt,
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne
+}
+
+keywords = {"AND", "OR", "NOT"}
+
+token_pattern = re.compile(r"\s*(>=|<=|!=|==|>|<|=|\(|\)|,|[^\s()<>=!,]+)")
+
+def tokenize(text):
+    """
+    Split a query string into words, parentheses, commas and operators
+    """
+
+    tokens = list()
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = token_pattern.match(text, position)
+        if match is None:
+            raise ValueError(f"Invalid tag query: {text}")
+        tokens.append(match.group(1))
+        position = match.end()
+
+    return tokens
+
+class Parser:
+    """
+    Recursive descent parser of a tag query. NOT binds tighter than AND,
+    which binds tighter than OR. A predicate is a tag name, possibly of
+    several words, with an optional count comparison:
+
+        person>=2 AND (dog OR cat) AND NOT car
+        traffic light, 2
+
+    The query is parsed into nested tuples: ("or", [nodes]), ("and", [nodes]),
+    ("not", node) and ("tag", name, comparison, count).
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def is_keyword(self, token, keyword):
+        return token is not None and token.upper() == keyword
+
+    def take(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError(f"Unexpected end of tag query: {self.text}")
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected '{self.peek()}' in tag query: {self.text}")
+        return node
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.is_keyword(self.peek(), "OR"):
+            self.take()
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        while self.is_keyword(self.peek(), "AND"):
+            self.take()
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def parse_not(self):
+        if self.is_keyword(self.peek(), "NOT"):
+            self.take()
+            return ("not", self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        if self.peek() == "(":
+            self.take()
+            node = self.parse_or()
+            if self.take() != ")":
+                raise ValueError(f"Missing ')' in tag query: {self.text}")
+            return node
+
+        # Tag names run until a keyword, a comparison or a parenthesis
+        words = list()
+        while self.peek() is not None and self.peek() not in operators and self.peek() not in ("(", ")", ",") \
+                and self.peek().upper() not in keywords:
+            words.append(self.take())
+        if len(words) == 0:
+            raise ValueError(f"Expected a tag at '{self.take()}' in tag query: {self.text}")
+        name = " ".join(words).lower()
+
+        comparison, count = ">=", 1
+        if self.peek() == ",":
+            self.take()
+            count = self.take_count()
+        elif self.peek() in operators:
+            comparison = self.take()
+            count = self.take_count()
+
+        return ("tag", name, comparison, count)
+
+    def take_count(self):
+        token = self.take()
+        if not token.isdigit():
+            raise ValueError(f"Expected a count at '{token}' in tag query: {self.text}")
+        return int(token)
+
+def parse(text):
+    """
+    Parse one query string
+
+    Returns
+    -------
+    :return query node
+    """
+
+    return Parser(text).parse()
+
+def parse_request(tags):
+    """
+    Parse the list of query strings of a search request, any of them may
+    match. Empty strings are skipped.
+
+    Returns
+    -------
+    :return query node
+    """
+
+    nodes = [parse(tag) for tag in tags if tag.strip() != ""]
+    if len(nodes) == 0:
+        raise ValueError("Tag query is empty")
+
+    return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+def evaluate(node, counts):
+    """
+    Check an image against a query
+
+    Parameters
+    ----------
+    :param node: query node
+    :param counts: dictionary of the image's tag to count
+
+    Returns
+    -------
+    :return True if the image matches
+    """
+
+    kind = node[0]
+    if kind == "tag":
+        return operators[node[2]](counts.get(node[1], 0), node[3])
+    if kind == "and":
+        return all(evaluate(child, counts) for child in node[1])
+    if kind == "or":
+        return any(evaluate(child, counts) for child in node[1])
+
+    return not evaluate(node[1], counts)
+
+def get_tags(node):
+    """
+    Names of the tags a query refers to
+    """
+
+    if node[0] == "tag":
+        return {node[1]}
+    if node[0] == "not":
+        return get_tags(node[1])
+
+    return set().union(*(get_tags(child) for child in node[1]))
+
+def score(node, counts, negated = False):
+    """
+    Number of predicates an image satisfies, leaving out those under NOT
+    """
+
+    kind = node[0]
+    if kind == "tag":
+        return int(not negated and operators[node[2]](counts.get(node[1], 0), node[3]))
+    if kind == "not":
+        return score(node[1], counts, not negated)
+
+    return sum(score(child, counts, negated) for child in node[1])
+
+def get_image_counts(client, user_id, node, table_name = image_records.ddb_table_name,
+                     index_table_name = tag_index.index_table_name):
+    """
+    Read the tags of every image that can match a query. Only the index
+    postings of the tags in the query are read, unless an image without
+    any of them matches too (e.g. "NOT dog" or "dog < 2"), then the user's
+    images are read from the images table.
+
+    Returns
+    -------
+    :return dictionary of thumbnail URL to a dictionary of tag to count
+    """
+
+    images = dict()
+    if evaluate(node, {}):
+        for item in ddb_query.query_items(client,
+                                          TableName = table_name,
+                                          KeyConditionExpression = "user_id = :user_id",
+                                          ProjectionExpression = "thumbnail_url, tags",
+                                          ExpressionAttributeValues = {":user_id": {"S": user_id}}):
+            images[item["thumbnail_url"]["S"]] = tag_codec.item_tags(item)
+        return images
+
+    for tag in get_tags(node):
+        for thumbnail_url, count in tag_index.iter_tag(client, user_id, tag, table_name = index_table_name):
+            images.setdefault(thumbnail_url, dict())[tag] = count
+
+    return images
+
+def search(client, user_id, node, table_name = image_records.ddb_table_name,
+           index_table_name = tag_index.index_table_name):
+    """
+    Find the images of a user matching a query, each once, best first.
+    Images are ranked by the number of predicates they satisfy, then by
+    the total count of the query's tags, then by thumbnail URL.
+
+    Parameters
+    ----------
+    :param client: DynamoDB boto3 client
+    :param user_id: owner of the images
+    :param node: query node
+    :param table_name: images table name
+    :param index_table_name: tag index table name
+
+    Returns
+    -------
+    :return list of (thumbnail_url, score)
+    """
+
+    tags = get_tags(node)
+    ranked = list()
+    for thumbnail_url, counts in get_image_counts(client, user_id, node, table_name, index_table_name).items():
+        if evaluate(node, counts):
+            total = sum(counts.get(tag, 0) for tag in tags)
+            ranked.append((-score(node, counts), -total, thumbnail_url))
+    ranked.sort()
+
+    return [(thumbnail_url, -matched) for matched, _, thumbnail_url in ranked]
+
+def read_page(request_body, default_page_size, max_page_size):
+    """
+    Read the page size and the cursor of a search request
+
+    Parameters
+    ----------
+    :param request_body: search request with optional "page_size" and
+                         "cursor"
+    :param default_page_size: page size of requests without one
+    :param max_page_size: largest page size callers may ask for
+
+    Returns
+    -------
+    :return page size, offset of the first result of the page. Raises
+            ValueError naming the allowed values if either is invalid.
+    """
+
+    page_size = request_body.get("page_size", default_page_size)
+    try:
+        page_size = int(page_size)
+    except (TypeError, ValueError):
+        raise ValueError(f"Page size must be an integer between 1 and {max_page_size}: {page_size}")
+    if not 1 <= page_size <= max_page_size:
+        raise ValueError(f"Page size must be between 1 and {max_page_size}: {page_size}")
+
+    cursor = request_body.get("cursor")
+    try:
+        position = ddb_query.decode_cursor(cursor)
+        offset = int(position["offset"]) if position is not None else 0
+    except (AttributeError, KeyError, TypeError, ValueError):
+        offset = -1
+    if offset < 0:
+        raise ValueError(f"Invalid cursor, send the next_cursor of the previous page: {cursor}")
+
+    return page_size, offset
+
+def get_page(results, page_size, offset = 0):
+    """
+    Cut one page out of ranked results
+
+    Returns
+    -------
+    :return page of results, cursor of the next page or None on the last page
+    """
+
+    page = results[offset:offset + page_size]
+    if offset + page_size < len(results):
+        return page, ddb_query.encode_cursor({"offset": offset + page_size})
+
+    return page, None
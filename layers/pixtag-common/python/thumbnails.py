@@ -0,0 +1,277 @@
+import os
+import cv2
+import resource
+import image_decode
+import image_records
+
+# Longest side of the thumbnail the images table points to, in pixels
+thumbnail_px = 150
+
+# Longest sides of every rendition built for an upload, in pixels
+thumbnail_sizes = sorted(set(int(size) for size in os.environ.get("PIXTAG_THUMBNAIL_SIZES", "150,320,640").split(",")))
+
+# Codecs of every rendition, "jpeg" and optionally "webp"
+thumbnail_formats = os.environ.get("PIXTAG_THUMBNAIL_FORMATS", "jpeg").split(",")
+
+# Renditions S3 prefix, keys are renditions/<user_id>/<file name>/<size>.<extension>
+renditions_prefix = "renditions"
+
+# Renditions built on request by the resize endpoint, keys are
+# derived/<image key>/<width>q<quality>.<extension>
+derived_prefix = "derived"
+
+# Thumbnail metadata holding the ETag of the image it was built from
+source_etag_metadata = "source-etag"
+
+# Encoding settings of every codec
+codecs = {
+    "jpeg": {
+        "extension": "jpg",
+        "content_type": "image/jpeg",
+        "params": [cv2.IMWRITE_JPEG_QUALITY, 90]
+    },
+    "webp": {
+        "extension": "webp",
+        "content_type": "image/webp",
+        "params": [cv2.IMWRITE_WEBP_QUALITY, int(os.environ.get("PIXTAG_THUMBNAIL_WEBP_QUALITY", "80"))]
+    }
+}
+
+def get_thumbnail_size(width, height, size = thumbnail_px):
+    """
+    Scale image dimensions proportionally so the longest side is size
+
+    Parameters
+    ----------
+    :param width: image width
+    :param height: image height
+    :param size: longest side of the thumbnail
+
+    Returns
+    -------
+    :return thumbnail (width, height)
+    """
+
+    # If height is greater than width, resize image
+    # proportionally by height, else by width
+    if height >= width:
+        ratio = size / float(height)
+        return int(width * ratio), size
+    else:
+        ratio = size / float(width)
+        return size, int(height * ratio)
+
+def make_thumbnail(image, size = thumbnail_px):
+    """
+    Resize an image to a thumbnail
+
+    Parameters
+    ----------
+    :param image: opencv image
+    :param size: longest side of the thumbnail
+
+    Returns
+    -------
+    :return a resized image
+    """
+
+    (height, width) = image.shape[:2]
+
+    return cv2.resize(image, get_thumbnail_size(width, height, size), interpolation = cv2.INTER_AREA)
+
+def decode_for_thumbnails(buffer, sizes = thumbnail_sizes):
+    """
+    Decode an encoded image at the smallest JPEG scale whose longest side
+    still covers the largest thumbnail
+
+    Parameters
+    ----------
+    :param buffer: encoded image as a uint8 array
+    :param sizes: longest sides of the renditions
+
+    Returns
+    -------
+    :return opencv image
+    """
+
+    largest = max(list(sizes) + [thumbnail_px])
+    size = image_decode.get_jpeg_size(buffer)
+
+    # Formats without a readable header are decoded at full size
+    if size is None:
+        return image_decode.decode_image(buffer)
+
+    # The longest side keeps its place under EXIF rotation
+    if size[0] >= size[1]:
+        return image_decode.decode_image(buffer, largest, 0)
+    else:
+        return image_decode.decode_image(buffer, 0, largest)
+
+def get_peak_rss_mb():
+    """
+    Peak resident memory of this process in MB, ru_maxrss is in KB on Linux
+    """
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def build_pyramid(image, sizes = thumbnail_sizes):
+    """
+    Resize an image to every size in one pass, each size downscaled from
+    the next larger one. Sizes at or above the image's longest side get
+    the image unchanged, it is never upscaled.
+
+    Parameters
+    ----------
+    :param image: opencv image
+    :param sizes: longest sides of the renditions
+
+    Returns
+    -------
+    :return dictionary of size to resized image
+    """
+
+    pyramid = dict()
+    level = image
+    for size in sorted(sizes, reverse = True):
+        if max(level.shape[:2]) > size:
+            level = make_thumbnail(level, size)
+        pyramid[size] = level
+
+    return pyramid
+
+def encode(image, codec = "jpeg"):
+    """
+    Encode an image with one of the thumbnail codecs
+
+    Returns
+    -------
+    :return encoded bytes
+    """
+
+    if codec not in codecs:
+        raise ValueError(f"Unknown thumbnail format: {codec}. Available formats: {', '.join(codecs)}")
+
+    return cv2.imencode(f".{codecs[codec]['extension']}", image, codecs[codec]["params"])[1].tobytes()
+
+def thumbnail_key(user_id, file_name):
+    """
+    S3 key of the thumbnail the images table points to
+    """
+
+    return f"{image_records.thumbnails_prefix}/{user_id}/{file_name}"
+
+def rendition_key(user_id, file_name, size, codec):
+    """
+    S3 key of one rendition of an image
+    """
+
+    return f"{renditions_prefix}/{user_id}/{file_name}/{size}.{codecs[codec]['extension']}"
+
+def get_outputs(user_id, file_name, sizes = thumbnail_sizes, formats = thumbnail_formats):
+    """
+    List the renditions of an image. The thumbnail_px JPEG keeps the
+    thumbnail key the images table points to.
+
+    Returns
+    -------
+    :return list of (size, codec, key)
+    """
+
+    outputs = list()
+    for size in sizes:
+        for codec in formats:
+            if size == thumbnail_px and codec == "jpeg":
+                outputs.append((size, codec, thumbnail_key(user_id, file_name)))
+            else:
+                outputs.append((size, codec, rendition_key(user_id, file_name, size, codec)))
+
+    # The table always points to a thumbnail, write it even if not configured
+    if (thumbnail_px, "jpeg") not in [(size, codec) for size, codec, _ in outputs]:
+        outputs.append((thumbnail_px, "jpeg", thumbnail_key(user_id, file_name)))
+
+    return outputs
+
+def get_source_etag(s3, bucket, user_id, file_name):
+    """
+    Read the source ETag recorded on the thumbnail of an image
+
+    Returns
+    -------
+    :return ETag, or None if there is no thumbnail or it carries none
+    """
+
+    try:
+        response = s3.head_object(Bucket = bucket, Key = thumbnail_key(user_id, file_name))
+    except s3.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+    return response.get("Metadata", {}).get(source_etag_metadata)
+
+def delete_derived(s3, bucket, user_id, file_name):
+    """
+    Delete the renditions the resize endpoint built from an image, so an
+    overwritten image is resized again instead of served stale
+
+    Returns
+    -------
+    :return number of deleted keys
+    """
+
+    deleted = 0
+    paginator = s3.get_paginator("list_objects_v2")
+    prefix = f"{derived_prefix}/{image_records.images_prefix}/{user_id}/{file_name}/"
+    for page in paginator.paginate(Bucket = bucket, Prefix = prefix):
+        objects = [{"Key": entry["Key"]} for entry in page.get("Contents", [])]
+        if len(objects) != 0:
+            s3.delete_objects(Bucket = bucket, Delete = {"Objects": objects, "Quiet": True})
+            deleted += len(objects)
+
+    return deleted
+
+def put_thumbnails(s3, bucket, user_id, file_name, image, source_etag = None):
+    """
+    Build every rendition of an image and write them to S3, dropping the
+    resized renditions of an earlier version of the image
+
+    Parameters
+    ----------
+    :param s3: S3 boto3 client
+    :param bucket: S3 bucket name
+    :param user_id: owner of the image
+    :param file_name: image file name
+    :param image: opencv image at any scale covering the renditions
+    :param source_etag: ETag of the source image, recorded on every
+                        rendition so redelivered events can be skipped
+
+    Returns
+    -------
+    :return list of written keys
+    """
+
+    outputs = get_outputs(user_id, file_name)
+    pyramid = build_pyramid(image, set(size for size, _, _ in outputs))
+    metadata = {source_etag_metadata: source_etag} if source_etag else {}
+
+    # Write the thumbnail the table points to last, its ETag metadata
+    # then marks every rendition as written
+    table_key = thumbnail_key(user_id, file_name)
+    outputs.sort(key = lambda output: output[2] == table_key)
+
+    deleted = delete_derived(s3, bucket, user_id, file_name)
+    if deleted != 0:
+        print(f"Deleted {deleted} resized renditions of the previous image")
+
+    keys = list()
+    for size, codec, key in outputs:
+        s3.put_object(
+            Bucket = bucket,
+            Key = key,
+            Body = encode(pyramid[size], codec),
+            ContentType = codecs[codec]["content_type"],
+            Metadata = metadata
+        )
+        keys.append(key)
+
+    return keys
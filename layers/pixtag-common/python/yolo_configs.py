@@ -0,0 +1,57 @@
+import os
+
+# YOLO configs root path
+yolo_path = os.environ.get("PIXTAG_YOLO_PATH", "/opt/yolo_tiny_configs")
+
+# Yolov3-tiny configs
+labels_path = "coco.names"
+configs_path = "yolov3-tiny.cfg"
+weights_path = "yolov3-tiny.weights"
+
+def get_labels(labels_path = labels_path):
+    """
+    Load the COCO class labels our YOLO model was trained on
+
+    Parameters
+    ----------
+    :param labels_path: path to class labels, relative to the configs root
+
+    Returns
+    -------
+    :return list of COCO labels
+    """
+
+    label_path = os.path.sep.join([yolo_path, labels_path])
+    labels = open(label_path).read().strip().split("\n")
+
+    return labels
+
+def get_weights(weights_path = weights_path):
+    """
+    Derive the path to the YOLO weights
+
+    Parameters
+    ----------
+    :param weights_path: path to YOLO weights, relative to the configs root
+
+    Returns
+    -------
+    :return derived weights path
+    """
+
+    return os.path.sep.join([yolo_path, weights_path])
+
+def get_config(config_path = configs_path):
+    """
+    Derive the path to the YOLO model configuration
+
+    Parameters
+    ----------
+    :param config_path: path to YOLO configs, relative to the configs root
+
+    Returns
+    -------
+    :return derived config path
+    """
+
+    return os.path.sep.join([yolo_path, config_path])
@@ -0,0 +1,444 @@
+import os
+import cv2
+import math
+import numpy as np
+import image_decode
+import model_registry
+import inference_profiles
+
+# Settings used when the caller does not pass a profile
+default_profile = inference_profiles.get_profile(inference_profiles.default_profile)
+
+# Thresholds
+conf_threshold = default_profile["conf_threshold"]
+nms_threshold = default_profile["nms_threshold"]
+tag_threshold = default_profile["tag_threshold"]
+
+# Blob size fed to the network
+input_size = default_profile["input_size"]
+
+# Tiled inference for very large images, images above the pixel
+# threshold are split into overlapping tiles
+tiling_enabled = os.environ.get("PIXTAG_TILED_INFERENCE", "0") == "1"
+tile_pixel_threshold = int(os.environ.get("PIXTAG_TILE_PIXEL_THRESHOLD", "24000000"))
+tile_overlap = 0.2
+tiles_per_short_side = 2
+max_tiles = 16
+
+def decode_outputs(layer_outputs, width, height, conf_threshold = conf_threshold):
+    """
+    Decode the raw YOLO output layers of one image into candidate boxes
+
+    Parameters
+    ----------
+    :param layer_outputs: list of YOLO output arrays, one row per detection
+    :param width: width of the source image
+    :param height: height of the source image
+    :param conf_threshold: minimum class probability to keep a detection
+
+    Returns
+    -------
+    :return boxes (N x 4 [x, y, w, h]), confidences (N) and class IDs (N)
+    """
+
+    # Stack every output layer into one detections array
+    detections = np.concatenate([output.reshape(-1, output.shape[-1]) for output in layer_outputs])
+
+    # Extract the class ID and confidence (i.e., probability) of
+    # every detection at once
+    scores = detections[:, 5:]
+    class_ids = np.argmax(scores, axis = 1)
+    confidences = scores[np.arange(len(scores)), class_ids].astype(np.float64)
+
+    # Filter out weak predictions by ensuring the detected
+    # probability is greater than the minimum probability
+    mask = confidences > conf_threshold
+    detections = detections[mask]
+
+    # Scale the bounding boxes back relative to the size of the image,
+    # YOLO returns the center (x, y)-coordinates followed by width and height
+    box = (detections[:, 0:4] * np.array([width, height, width, height])).astype("int")
+
+    # Use the center (x, y)-coordinates to derive the top left corner
+    boxes = np.empty_like(box)
+    boxes[:, 0] = (box[:, 0] - box[:, 2] / 2).astype("int")
+    boxes[:, 1] = (box[:, 1] - box[:, 3] / 2).astype("int")
+    boxes[:, 2:] = box[:, 2:]
+
+    return boxes, confidences[mask], class_ids[mask]
+
+def non_max_suppression(boxes, confidences, class_ids, conf_threshold = conf_threshold,
+                        nms_threshold = nms_threshold, class_aware = False):
+    """
+    Apply non-maxima suppression to suppress weak, overlapping bounding boxes
+
+    Parameters
+    ----------
+    :param boxes: N x 4 array of [x, y, w, h] boxes
+    :param confidences: N array of confidences
+    :param class_ids: N array of class IDs
+    :param conf_threshold: minimum confidence to keep a box
+    :param nms_threshold: overlap threshold
+    :param class_aware: only suppress boxes of the same class
+
+    Returns
+    -------
+    :return array of kept indexes
+    """
+
+    if len(boxes) == 0:
+        return np.empty(0, dtype = int)
+
+    nms_boxes = boxes
+    if class_aware:
+        # Shift every class into its own coordinate range so boxes of
+        # different classes can never overlap, the range covers the spread
+        # of the corners plus the largest box, negative corners included
+        corners = boxes[:, :2]
+        offset = int(corners.max() - corners.min() + boxes[:, 2:].max()) + 1
+        nms_boxes = boxes + (class_ids * offset)[:, None] * np.array([1, 1, 0, 0])
+
+    idxs = cv2.dnn.NMSBoxes(nms_boxes.tolist(), confidences.tolist(), conf_threshold, nms_threshold)
+
+    return np.array(idxs, dtype = int).flatten()
+
+def select_tags(boxes, confidences, class_ids, labels, conf_threshold = conf_threshold,
+                nms_threshold = nms_threshold, tag_threshold = tag_threshold, class_aware = False):
+    """
+    Turn the candidate boxes of one image into a list of tags
+
+    Parameters
+    ----------
+    :param boxes: N x 4 array of [x, y, w, h] boxes
+    :param confidences: N array of confidences
+    :param class_ids: N array of class IDs
+    :param labels: list of COCO labels
+    :param conf_threshold: minimum class probability to keep a detection
+    :param nms_threshold: non-maxima suppression overlap threshold
+    :param tag_threshold: minimum confidence for a detection to become a tag
+    :param class_aware: run non-maxima suppression per class
+
+    Returns
+    -------
+    :return list of detected tags
+    """
+
+    idxs = non_max_suppression(boxes, confidences, class_ids, conf_threshold,
+                               nms_threshold, class_aware)
+
+    # Retain tags with greater than tag_threshold confidence
+    return [labels[class_ids[i]] for i in idxs if confidences[i] > tag_threshold]
+
+def forward_batch(images, model, size):
+    """
+    Run one forward pass over a batch of images
+
+    Parameters
+    ----------
+    :param images: list of opencv images
+    :param model: model dictionary returned by model_registry.load_model
+    :param size: width and height of the network input
+
+    Returns
+    -------
+    :return list of YOLO output layers for every image, in input order
+    """
+
+    # Construct one blob from all images of the batch and then perform
+    # a forward pass of the YOLO object detector
+    blob = cv2.dnn.blobFromImages(images, 1 / 255.0, (size, size),
+                                  swapRB = True, crop = False)
+    layer_outputs = model_registry.forward(model, blob)
+
+    # Batched output layers carry a leading image axis
+    return [[output[i] if output.ndim == 3 else output for output in layer_outputs]
+            for i in range(len(images))]
+
+def needs_tiling(width, height, threshold = tile_pixel_threshold):
+    """
+    Check whether an image is large enough for tiled inference
+
+    Parameters
+    ----------
+    :param width: width of the source image
+    :param height: height of the source image
+    :param threshold: pixel count above which images are tiled
+
+    Returns
+    -------
+    :return True if the image should be tiled
+    """
+
+    return tiling_enabled and width * height > threshold
+
+def get_decode_size(profile, tiled = False):
+    """
+    Smallest decoded image size the detector needs
+
+    Parameters
+    ----------
+    :param profile: inference profile
+    :param tiled: the image will go through tiled inference
+
+    Returns
+    -------
+    :return minimum (width, height)
+    """
+
+    # Every tile should still see at least one network input worth of pixels
+    size = profile["input_size"] * (tiles_per_short_side if tiled else 1)
+
+    return size, size
+
+def decode_for_detection(buffer, profile = default_profile, min_longest_side = 0):
+    """
+    Decode an encoded image at the smallest scale the detector needs and
+    decide on tiled inference from its full-resolution size
+
+    Parameters
+    ----------
+    :param buffer: encoded image as a uint8 array
+    :param profile: inference profile
+    :param min_longest_side: smallest longest side the caller also needs,
+                             e.g. to build thumbnails from the same image
+
+    Returns
+    -------
+    :return opencv image, True if it should go through tiled inference
+    """
+
+    size = image_decode.get_jpeg_size(buffer)
+    tiled = size is not None and needs_tiling(*size)
+    (min_width, min_height) = get_decode_size(profile, tiled)
+
+    if size is not None and size[0] >= size[1]:
+        min_width = max(min_width, min_longest_side)
+    elif size is not None:
+        min_height = max(min_height, min_longest_side)
+
+    image = image_decode.decode_image(buffer, min_width, min_height)
+
+    # Formats without a readable header are decoded at full size
+    if size is None:
+        tiled = needs_tiling(image.shape[1], image.shape[0])
+
+    return image, tiled
+
+def fit_for_detection(image, profile = default_profile, tiled = False):
+    """
+    Downscale an image decoded larger than the detector needs to the size
+    decode_for_detection would have decoded it at
+
+    Parameters
+    ----------
+    :param image: opencv image
+    :param profile: inference profile
+    :param tiled: the image will go through tiled inference
+
+    Returns
+    -------
+    :return opencv image
+    """
+
+    (height, width) = image.shape[:2]
+    factor = image_decode.get_reduce_factor(width, height, *get_decode_size(profile, tiled))
+    if factor == 1:
+        return image
+
+    return cv2.resize(image, (-(-width // factor), -(-height // factor)), interpolation = cv2.INTER_AREA)
+
+def make_tiles(width, height, tile_size, overlap = tile_overlap):
+    """
+    Split an image into overlapping square tiles covering all of it
+
+    Parameters
+    ----------
+    :param width: width of the image
+    :param height: height of the image
+    :param tile_size: side of a tile in pixels
+    :param overlap: share of a tile overlapping its neighbour
+
+    Returns
+    -------
+    :return list of (x, y, w, h) tile windows
+    """
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        stride = max(1, int(tile_size * (1 - overlap)))
+        count = math.ceil((length - tile_size) / stride) + 1
+
+        # Spread the tiles evenly so the last one ends on the image edge
+        return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+
+    return [(x, y, min(tile_size, width), min(tile_size, height))
+            for y in starts(height) for x in starts(width)]
+
+def detect_tiled(image, model, profile = default_profile):
+    """
+    Detect objects in a very large image by running overlapping tiles and
+    the whole image as one batch
+
+    Parameters
+    ----------
+    :param image: opencv image
+    :param model: model dictionary returned by model_registry.load_model
+    :param profile: inference profile with the input size and thresholds
+
+    Returns
+    -------
+    :return detections dictionary with the candidate boxes of every tile
+            in image coordinates
+    """
+
+    (H, W) = image.shape[:2]
+
+    # Grow the tiles until the grid fits the tile budget
+    tile_size = max(profile["input_size"], math.ceil(min(W, H) / tiles_per_short_side))
+    tiles = make_tiles(W, H, tile_size)
+    while len(tiles) > max_tiles:
+        tile_size = math.ceil(tile_size * 1.25)
+        tiles = make_tiles(W, H, tile_size)
+    print(f"Tiled inference over {len(tiles)} tiles of {tile_size}px for {W}x{H} image")
+
+    # The whole image keeps objects larger than a tile
+    windows = [(0, 0, W, H)] + tiles
+    crops = [image[y:y + h, x:x + w] for (x, y, w, h) in windows]
+    outputs = forward_batch(crops, model, profile["input_size"])
+
+    boxes = list()
+    confidences = list()
+    class_ids = list()
+    for (x, y, w, h), layer_outputs in zip(windows, outputs):
+        tile_boxes, tile_confidences, tile_class_ids = decode_outputs(layer_outputs, w, h, profile["conf_threshold"])
+
+        # Move tile boxes back into image coordinates
+        tile_boxes[:, 0] += x
+        tile_boxes[:, 1] += y
+        boxes.append(tile_boxes)
+        confidences.append(tile_confidences)
+        class_ids.append(tile_class_ids)
+
+    return {
+        "boxes": np.concatenate(boxes),
+        "confidences": np.concatenate(confidences),
+        "class_ids": np.concatenate(class_ids),
+        "width": W,
+        "height": H
+    }
+
+def detect_batch(images, model, profile = default_profile, batch_size = 8, tiled = None):
+    """
+    Get the candidate detections of several images, before non-maxima
+    suppression, with one forward pass per batch
+
+    Parameters
+    ----------
+    :param images: list of opencv images
+    :param model: model dictionary returned by model_registry.load_model
+    :param profile: inference profile with the input size and thresholds
+    :param batch_size: maximum number of images per forward pass
+    :param tiled: list of flags marking images for tiled inference,
+                  by default images above the pixel threshold are tiled
+
+    Returns
+    -------
+    :return list of detections dictionaries (boxes, confidences, class_ids,
+            width, height) for every image, in input order
+    """
+
+    if tiled is None:
+        tiled = [needs_tiling(image.shape[1], image.shape[0]) for image in images]
+
+    detections = [None] * len(images)
+
+    # Large images get a batch of their own tiles
+    for i, image in enumerate(images):
+        if tiled[i]:
+            detections[i] = detect_tiled(image, model, profile)
+
+    # Every other image keeps the single-pass cost
+    single = [i for i in range(len(images)) if not tiled[i]]
+    for start in range(0, len(single), batch_size):
+        batch = single[start:start + batch_size]
+        outputs = forward_batch([images[i] for i in batch], model, profile["input_size"])
+
+        for i, layer_outputs in zip(batch, outputs):
+            (H, W) = images[i].shape[:2]
+            boxes, confidences, class_ids = decode_outputs(layer_outputs, W, H, profile["conf_threshold"])
+            detections[i] = {
+                "boxes": boxes,
+                "confidences": confidences,
+                "class_ids": class_ids,
+                "width": W,
+                "height": H
+            }
+
+    return detections
+
+def tags_from_detections(detections, labels, profile = default_profile, class_aware = False):
+    """
+    Turn the candidate detections of one image into a list of tags
+
+    Parameters
+    ----------
+    :param detections: detections dictionary returned by detect_batch
+    :param labels: list of COCO labels
+    :param profile: inference profile with the thresholds
+    :param class_aware: run non-maxima suppression per class
+
+    Returns
+    -------
+    :return list of detected tags
+    """
+
+    return select_tags(detections["boxes"], detections["confidences"], detections["class_ids"],
+                       labels, profile["conf_threshold"], profile["nms_threshold"],
+                       profile["tag_threshold"], class_aware)
+
+def predict_batch(images, model, labels, profile = default_profile, class_aware = False, batch_size = 8,
+                  tiled = None):
+    """
+    Detect objects in several images with one forward pass per batch
+
+    Parameters
+    ----------
+    :param images: list of opencv images
+    :param model: model dictionary returned by model_registry.load_model
+    :param labels: list of COCO labels
+    :param profile: inference profile with the input size and thresholds
+    :param class_aware: run non-maxima suppression per class
+    :param batch_size: maximum number of images per forward pass
+    :param tiled: list of flags marking images for tiled inference,
+                  by default images above the pixel threshold are tiled
+
+    Returns
+    -------
+    :return list of detected tags for every image, in input order
+    """
+
+    return [tags_from_detections(detections, labels, profile, class_aware)
+            for detections in detect_batch(images, model, profile, batch_size, tiled)]
+
+def predict(image, model, labels, profile = default_profile, class_aware = False, tiled = None):
+    """
+    Detect objects in an image with our YOLO object detector
+
+    Parameters
+    ----------
+    :param image: opencv image
+    :param model: model dictionary returned by model_registry.load_model
+    :param labels: list of COCO labels
+    :param profile: inference profile with the input size and thresholds
+    :param class_aware: run non-maxima suppression per class
+    :param tiled: force tiled inference on or off, by default images
+                  above the pixel threshold are tiled
+
+    Returns
+    -------
+    :return list of detected tags
+    """
+
+    return predict_batch([image], model, labels, profile, class_aware,
+                         tiled = None if tiled is None else [tiled])[0]
@@ -0,0 +1,107 @@
+"""
+Build the per-user bitmask index snapshots from the images table.
+
+The images table is scanned in parallel segments, or one user's partition
+is queried with --user, and the class counts of every image are grouped by
+user. One .npz snapshot per user is then written to S3. Snapshots are
+replaced whole with the tags of the scan, so run it with the stream
+trigger of update-tag-bitmask disabled. Once enabled again, the trigger
+replays the changes made meanwhile onto the new snapshots.
+
+Usage: python tools/build_tag_bitmask.py [--user USER_ID] [--segments 4]
+       [--bucket g74-a3] [--workers 8] [--dry-run]
+"""
+
+import os
+import sys
+import argparse
+import threading
+import concurrent.futures
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "layers", "pixtag-common", "python"))
+
+import boto3
+import ddb_query
+import image_records
+import tag_codec
+import tag_bitmask_index
+
+def get_class_counts(item):
+    """
+    Class counts vector of an item, from its tags if it was not migrated
+    """
+
+    if "class_counts" in item:
+        return bytes(item["class_counts"]["B"])
+
+    return tag_codec.encode_class_counts(tag_codec.item_tags(item))
+
+def scan_segment(ddb, args, segment, users, lock):
+    """
+    Scan one segment of the images table into the per-user class counts
+
+    Returns
+    -------
+    :return number of items scanned
+    """
+
+    scanned = 0
+    scan_args = {
+        "TableName": args.table,
+        "Segment": segment,
+        "TotalSegments": args.segments,
+        "ProjectionExpression": "user_id, thumbnail_url, tags, class_counts"
+    }
+
+    while True:
+        page = ddb.scan(**scan_args)
+        with lock:
+            for item in page["Items"]:
+                users.setdefault(item["user_id"]["S"], dict())[item["thumbnail_url"]["S"]] = get_class_counts(item)
+        scanned += len(page["Items"])
+
+        if "LastEvaluatedKey" not in page:
+            return scanned
+        scan_args["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--table", default = image_records.ddb_table_name)
+    parser.add_argument("--user", help = "build the snapshot of one user")
+    parser.add_argument("--bucket", default = tag_bitmask_index.snapshot_bucket)
+    parser.add_argument("--segments", type = int, default = 4, help = "parallel scan segments")
+    parser.add_argument("--workers", type = int, default = 8, help = "concurrent snapshot writes")
+    parser.add_argument("--dry-run", action = "store_true", help = "build the snapshots without writing them")
+    args = parser.parse_args()
+
+    ddb = boto3.client('dynamodb')
+    s3 = boto3.client('s3')
+
+    users = dict()
+    if args.user is not None:
+        users[args.user] = dict()
+        for item in ddb_query.query_items(ddb,
+                                          TableName = args.table,
+                                          KeyConditionExpression = "user_id = :user_id",
+                                          ProjectionExpression = "thumbnail_url, tags, class_counts",
+                                          ExpressionAttributeValues = {":user_id": {"S": args.user}}):
+            users[args.user][item["thumbnail_url"]["S"]] = get_class_counts(item)
+    else:
+        lock = threading.Lock()
+        with concurrent.futures.ThreadPoolExecutor(max_workers = args.segments) as executor:
+            futures = [executor.submit(scan_segment, ddb, args, segment, users, lock)
+                       for segment in range(args.segments)]
+            print(f"Scanned {sum(future.result() for future in futures)} items")
+
+    def build(user_id):
+        index = tag_bitmask_index.BitmaskIndex.from_class_counts(users[user_id])
+        if not args.dry_run:
+            tag_bitmask_index.write_snapshot(s3, user_id, index, bucket = args.bucket)
+        return user_id, len(index.thumbnail_urls)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = args.workers) as executor:
+        for user_id, images in executor.map(build, users):
+            print(f"Snapshot of user {user_id}: {images} images")
+
+    print(f"Done: {len(users)} users")
@@ -0,0 +1,91 @@
+"""
+Build the tag index table from the images table.
+
+The images table is scanned in parallel segments and every tag of every
+image is written as a posting under "<user_id>#<tag>". Writes are puts, so
+running it again over an indexed table is harmless. The scan position of
+every segment is saved to a checkpoint file, so a stopped run resumes.
+Run it once the update-tag-index stream trigger is enabled, so changes
+landing during the build are indexed too.
+
+Usage: python tools/build_tag_index.py [--segments 4]
+       [--index-table imagetags] [--checkpoint tag_index.checkpoint] [--dry-run]
+"""
+
+import os
+import sys
+import argparse
+import concurrent.futures
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "layers", "pixtag-common", "python"))
+
+import boto3
+import image_records
+import tag_codec
+import tag_index
+from scan_checkpoint import Checkpoint
+
+def process_segment(ddb, args, segment, checkpoint):
+    """
+    Scan one segment of the images table and write its postings
+
+    Returns
+    -------
+    :return dictionary of counts for the segment
+    """
+
+    stats = {"scanned": 0, "postings": 0}
+    position = checkpoint.get(segment)
+    if position == "done":
+        return stats
+
+    while True:
+        scan_args = {
+            "TableName": args.table,
+            "Segment": segment,
+            "TotalSegments": args.segments,
+            "ProjectionExpression": "user_id, thumbnail_url, image_url, tags"
+        }
+        if position is not None:
+            scan_args["ExclusiveStartKey"] = position
+
+        page = ddb.scan(**scan_args)
+
+        items = [item for item in page["Items"] if "tags" in item]
+        stats["scanned"] += len(page["Items"])
+        stats["postings"] += sum(len(tag_codec.item_tags(item)) for item in items)
+
+        if len(items) != 0 and not args.dry_run:
+            tag_index.sync_items(ddb, items, {}, args.index_table)
+
+        # A dry run leaves the checkpoint alone, so the real backfill scans everything
+        position = page.get("LastEvaluatedKey")
+        if not args.dry_run:
+            checkpoint.set(segment, position if position is not None else "done")
+        print(f"Segment {segment}: {stats}")
+
+        if position is None:
+            return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--table", default = image_records.ddb_table_name)
+    parser.add_argument("--index-table", default = tag_index.index_table_name)
+    parser.add_argument("--segments", type = int, default = 4, help = "parallel scan segments")
+    parser.add_argument("--checkpoint", default = "tag_index.checkpoint")
+    parser.add_argument("--dry-run", action = "store_true", help = "count postings without writing them")
+    args = parser.parse_args()
+
+    checkpoint = Checkpoint(args.checkpoint)
+    ddb = boto3.client('dynamodb')
+
+    stats = dict()
+    with concurrent.futures.ThreadPoolExecutor(max_workers = args.segments) as executor:
+        futures = [executor.submit(process_segment, ddb, args, segment, checkpoint)
+                   for segment in range(args.segments)]
+        for future in futures:
+            for name, count in future.result().items():
+                stats[name] = stats.get(name, 0) + count
+
+    print(f"Done: {stats}")
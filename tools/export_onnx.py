@@ -0,0 +1,319 @@
+"""
+Export a Darknet YOLO config and weights to an ONNX model for the
+onnxruntime inference engine.
+
+The graph ends with the YOLO region decode OpenCV DNN runs, so every output
+is one YOLO layer in the layout OpenCV returns: (N, rows, 5 + classes) with
+normalized center x, center y, width, height, objectness and class scores
+already multiplied by the objectness. Rows are ordered by cell row, cell
+column, then anchor, like OpenCV. The batch and input sizes are left
+dynamic, so one export serves every inference profile.
+
+Needs the onnx package, and onnxruntime to check the export against
+OpenCV with --check.
+
+Usage: python tools/export_onnx.py --weights yolov3-tiny.weights
+       [--config yolov3-tiny.cfg] [--output yolov3-tiny.onnx]
+       [--opset 13] [--check]
+"""
+
+import os
+import sys
+import argparse
+import numpy as np
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "layers", "pixtag-common", "python"))
+
+import onnx
+import darknet_config
+from onnx import helper, numpy_helper, TensorProto
+
+# Bundled YOLO configs
+configs_root = os.path.join(root, "lambdas", "object-detect-lambda", "yolo_tiny_configs")
+
+# Darknet constants, as read by OpenCV's Darknet importer
+leaky_slope = 0.1
+batch_norm_eps = 1e-6
+default_yolo_thresh = 0.2
+
+def read_weights(weights_path):
+    """
+    Read the weight values of a Darknet weights file, after its header
+
+    Returns
+    -------
+    :return float32 array
+    """
+
+    with open(weights_path, "rb") as weights_file:
+        major, minor, _ = np.fromfile(weights_file, dtype = np.int32, count = 3)
+        # The seen images counter grew to 64 bits in version 0.2
+        np.fromfile(weights_file, dtype = np.int64 if major * 10 + minor >= 2 else np.int32, count = 1)
+        return np.fromfile(weights_file, dtype = np.float32)
+
+class GraphBuilder:
+    """
+    Collects the nodes and initializers of the exported graph
+    """
+
+    def __init__(self):
+        self.nodes = list()
+        self.initializers = list()
+        self.count = 0
+
+    def name(self, prefix):
+        self.count += 1
+        return f"{prefix}_{self.count}"
+
+    def constant(self, value, prefix = "const"):
+        name = self.name(prefix)
+        self.initializers.append(numpy_helper.from_array(np.asarray(value), name))
+        return name
+
+    def add(self, op_type, inputs, prefix = None, **attributes):
+        output = self.name(prefix or op_type.lower())
+        self.nodes.append(helper.make_node(op_type, inputs, [output], **attributes))
+        return output
+
+def add_convolutional(graph, section, source, channels, weights, offset):
+    """
+    Add a convolution with its batch normalization folded in
+
+    Returns
+    -------
+    :return output name, output channels, new weights offset
+    """
+
+    filters = int(section["filters"])
+    size = int(section["size"])
+    stride = int(section.get("stride", 1))
+    pad = size // 2 if int(section.get("pad", 0)) == 1 else int(section.get("padding", 0))
+
+    def take(count):
+        nonlocal offset
+        values = weights[offset:offset + count]
+        if len(values) != count:
+            raise ValueError("The weights file is shorter than the config needs")
+        offset += count
+        return values
+
+    biases = take(filters)
+    if int(section.get("batch_normalize", 0)) == 1:
+        scales = take(filters)
+        means = take(filters)
+        variances = take(filters)
+    kernel = take(filters * channels * size * size).reshape(filters, channels, size, size)
+
+    if int(section.get("batch_normalize", 0)) == 1:
+        factor = scales / np.sqrt(variances + batch_norm_eps)
+        kernel = kernel * factor[:, None, None, None]
+        biases = biases - means * factor
+
+    output = graph.add("Conv", [source, graph.constant(kernel.astype(np.float32), "weights"),
+                                graph.constant(biases.astype(np.float32), "biases")],
+                       kernel_shape = [size, size], strides = [stride, stride], pads = [pad] * 4)
+
+    activation = section.get("activation", "linear")
+    if activation == "leaky":
+        output = graph.add("LeakyRelu", [output], alpha = leaky_slope)
+    elif activation != "linear":
+        raise ValueError(f"Unsupported activation: {activation}")
+
+    return output, filters, offset
+
+def add_maxpool(graph, section, source):
+    """
+    Add a max pooling padded on the bottom and right like Darknet, so a
+    stride of 1 keeps the size and odd sizes round up
+    """
+
+    size = int(section["size"])
+    stride = int(section.get("stride", 1))
+
+    return graph.add("MaxPool", [source], kernel_shape = [size, size], strides = [stride, stride],
+                     pads = [0, 0, size - 1, size - 1])
+
+def add_yolo(graph, section, source, image_size):
+    """
+    Add the region decode of one YOLO layer, returning (N, rows, 5 + classes)
+    """
+
+    mask = [int(value) for value in section["mask"].split(",")]
+    anchors = np.array([float(value) for value in section["anchors"].split(",")], dtype = np.float32).reshape(-1, 2)[mask]
+    classes = int(section["classes"])
+    thresh = float(section.get("thresh", default_yolo_thresh))
+    scale_xy = float(section.get("scale_x_y", 1))
+    cell_size = 5 + classes
+
+    # Grid size from the layer input, (N, anchors * cell, H, W)
+    shape = graph.add("Shape", [source])
+    height = graph.add("Gather", [shape, graph.constant(np.array([2], dtype = np.int64))])
+    width = graph.add("Gather", [shape, graph.constant(np.array([3], dtype = np.int64))])
+
+    # (N, H, W, anchors, cell)
+    cells = graph.add("Transpose", [source], perm = [0, 2, 3, 1])
+    cells = graph.add("Reshape", [cells, graph.add("Concat", [
+        graph.constant(np.array([0], dtype = np.int64)), height, width,
+        graph.constant(np.array([len(mask), cell_size], dtype = np.int64))], axis = 0)])
+
+    def channels(start, end):
+        return graph.add("Slice", [cells, graph.constant(np.array([start], dtype = np.int64)),
+                                   graph.constant(np.array([end], dtype = np.int64)),
+                                   graph.constant(np.array([4], dtype = np.int64))])
+
+    # Cell offsets as (1, H, W, 1, 2)
+    grid_shape = graph.add("Concat", [graph.constant(np.array([1], dtype = np.int64)), height, width,
+                                      graph.constant(np.array([1, 1], dtype = np.int64))], axis = 0)
+    height_float = graph.add("Cast", [height], to = TensorProto.FLOAT)
+    width_float = graph.add("Cast", [width], to = TensorProto.FLOAT)
+    zero = graph.constant(np.array(0, dtype = np.float32))
+    one = graph.constant(np.array(1, dtype = np.float32))
+    columns = graph.add("Range", [zero, graph.add("Squeeze", [width_float]), one])
+    rows = graph.add("Range", [zero, graph.add("Squeeze", [height_float]), one])
+    columns = graph.add("Expand", [graph.add("Reshape", [columns, graph.constant(np.array([1, 1, -1, 1, 1], dtype = np.int64))]), grid_shape])
+    rows = graph.add("Expand", [graph.add("Reshape", [rows, graph.constant(np.array([1, -1, 1, 1, 1], dtype = np.int64))]), grid_shape])
+    grid = graph.add("Concat", [columns, rows], axis = 4)
+
+    # Centers relative to the grid, sizes relative to the network input
+    centers = graph.add("Sigmoid", [channels(0, 2)])
+    if scale_xy != 1:
+        centers = graph.add("Sub", [graph.add("Mul", [centers, graph.constant(np.array(scale_xy, dtype = np.float32))]),
+                                    graph.constant(np.array((scale_xy - 1) / 2, dtype = np.float32))])
+    centers = graph.add("Div", [graph.add("Add", [centers, grid]), graph.add("Concat", [width_float, height_float], axis = 0)])
+
+    sizes = graph.add("Mul", [graph.add("Exp", [channels(2, 4)]), graph.constant(anchors.reshape(1, 1, 1, -1, 2))])
+    sizes = graph.add("Div", [sizes, image_size])
+
+    # Class scores are multiplied by the objectness, those under the
+    # layer threshold are zeroed like OpenCV does
+    objectness = graph.add("Sigmoid", [channels(4, 5)])
+    scores = graph.add("Mul", [graph.add("Sigmoid", [channels(5, cell_size)]), objectness])
+    scores = graph.add("Where", [graph.add("Greater", [scores, graph.constant(np.array(thresh, dtype = np.float32))]),
+                                 scores, zero])
+
+    output = graph.add("Concat", [centers, sizes, objectness, scores], axis = 4)
+
+    return graph.add("Reshape", [output, graph.constant(np.array([0, -1, cell_size], dtype = np.int64))], prefix = "yolo")
+
+def export(config_path, weights_path, opset = 13):
+    """
+    Build the ONNX model of a Darknet YOLO network
+
+    Parameters
+    ----------
+    :param config_path: path to YOLO configs
+    :param weights_path: path to YOLO weights
+    :param opset: ONNX opset version
+
+    Returns
+    -------
+    :return onnx ModelProto
+    """
+
+    sections = darknet_config.parse_cfg(config_path)
+    weights = read_weights(weights_path)
+
+    graph = GraphBuilder()
+    source = "data"
+    channels = int(sections[0].get("channels", 3))
+
+    # Network input size as (width, height), anchors are relative to it
+    input_shape = graph.add("Shape", [source])
+    image_size = graph.add("Cast", [graph.add("Gather", [input_shape, graph.constant(np.array([3, 2], dtype = np.int64))])],
+                           to = TensorProto.FLOAT)
+
+    offset = 0
+    layer_outputs = list()
+    layer_channels = list()
+    outputs = list()
+
+    for section in sections[1:]:
+        kind = section["type"]
+        if kind == "convolutional":
+            source, channels, offset = add_convolutional(graph, section, source, channels, weights, offset)
+        elif kind == "maxpool":
+            source = add_maxpool(graph, section, source)
+        elif kind == "upsample":
+            stride = float(section.get("stride", 2))
+            source = graph.add("Resize", [source, "", graph.constant(np.array([1, 1, stride, stride], dtype = np.float32))],
+                               mode = "nearest")
+        elif kind == "route":
+            layers = [int(layer) for layer in section["layers"].split(",")]
+            layers = [layer if layer >= 0 else len(layer_outputs) + layer for layer in layers]
+            source = layer_outputs[layers[0]] if len(layers) == 1 else graph.add("Concat", [layer_outputs[layer] for layer in layers], axis = 1)
+            channels = sum(layer_channels[layer] for layer in layers)
+        elif kind == "shortcut":
+            source = graph.add("Add", [source, layer_outputs[int(section["from"]) + len(layer_outputs)]])
+        elif kind == "yolo":
+            outputs.append(add_yolo(graph, section, source, image_size))
+        else:
+            raise ValueError(f"Unsupported layer type: {kind}")
+
+        layer_outputs.append(source)
+        layer_channels.append(channels)
+
+    if offset != len(weights):
+        print(f"Warning: {len(weights) - offset} weight values left unused")
+
+    cell_size = [int(section["classes"]) + 5 for section in sections if section["type"] == "yolo"]
+    model = helper.make_model(
+        helper.make_graph(
+            graph.nodes, "yolo",
+            [helper.make_tensor_value_info("data", TensorProto.FLOAT, ["batch", int(sections[0].get("channels", 3)), "height", "width"])],
+            [helper.make_tensor_value_info(name, TensorProto.FLOAT, ["batch", f"rows_{index}", cell_size[index]])
+             for index, name in enumerate(outputs)],
+            graph.initializers
+        ),
+        opset_imports = [helper.make_opsetid("", opset)],
+        producer_name = "pixtag"
+    )
+    onnx.checker.check_model(model)
+
+    return model
+
+def check(config_path, weights_path, onnx_path, size = 416, batch = 2):
+    """
+    Compare the outputs of both inference engines on a random batch
+
+    Returns
+    -------
+    :return largest difference relative to the OpenCV value, number of
+            scores only one engine zeroed at the layer threshold
+    """
+
+    import inference_engines
+
+    blob = np.random.default_rng(0).random((batch, 3, size, size), dtype = np.float32)
+    reference = inference_engines.create_engine("opencv", config_path, weights_path).forward(blob)
+    outputs = inference_engines.create_engine("onnxruntime", config_path, weights_path, onnx_path = onnx_path).forward(blob)
+
+    difference = 0.0
+    flipped = 0
+    for output, expected in zip(outputs, reference):
+        # Rounding can put a score on either side of the threshold
+        same = (output == 0) == (expected == 0)
+        flipped += int(np.count_nonzero(~same))
+        relative = np.abs(output - expected) / np.maximum(np.abs(expected), 1)
+        difference = max(difference, float(np.max(relative[same])))
+
+    return difference, flipped
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default = os.path.join(configs_root, "yolov3-tiny.cfg"))
+    parser.add_argument("--weights", required = True, help = "path to yolov3-tiny.weights")
+    parser.add_argument("--output", help = "path of the ONNX model, the weights path with an .onnx extension by default")
+    parser.add_argument("--opset", type = int, default = 13)
+    parser.add_argument("--check", action = "store_true", help = "compare the export with OpenCV on a random batch")
+    args = parser.parse_args()
+
+    output_path = args.output or f"{os.path.splitext(args.weights)[0]}.onnx"
+    onnx.save(export(args.config, args.weights, args.opset), output_path)
+    print(f"ONNX model written to: {output_path}")
+
+    if args.check:
+        for size in (320, 416, 608):
+            difference, flipped = check(args.config, args.weights, output_path, size)
+            print(f"Against OpenCV at {size}x{size}: largest relative difference {difference:.2e}, "
+                  f"{flipped} scores on the other side of the threshold")
@@ -0,0 +1,117 @@
+"""
+Migrate image tags from string sets of "tag, count" to the map of tag to
+count and class counts vector written by tag_codec.
+
+The images table is scanned in parallel segments and items still holding
+a string set, or a map without its class counts, are rewritten one by one
+with UpdateItem. Counts do not change, so the tag index is left as it is.
+The scan position of every segment is saved to a checkpoint file, so a
+stopped run resumes.
+
+Each update is conditional on the tags read by the scan, so an upload, tag
+edit or re-detection landing in between wins and its item is skipped.
+Readers accept both formats until the migration finishes.
+
+Usage: python tools/migrate_tags.py [--segments 4]
+       [--checkpoint migrate_tags.checkpoint] [--dry-run]
+"""
+
+import os
+import sys
+import argparse
+import concurrent.futures
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "layers", "pixtag-common", "python"))
+
+import boto3
+import image_records
+import tag_codec
+from scan_checkpoint import Checkpoint
+
+def migrate_item(ddb, table_name, item, dry_run = False):
+    """
+    Rewrite the tag attributes of one item in the map format, unless its
+    tags changed since they were read
+
+    Returns
+    -------
+    :return "migrated", "current" if the item needs no change, or
+            "concurrent" if another write got there first
+    """
+
+    if "tags" not in item:
+        return "current"
+    if "M" in item["tags"] and "class_counts" in item:
+        return "current"
+    if dry_run:
+        return "migrated"
+
+    key = {"user_id": item["user_id"], "thumbnail_url": item["thumbnail_url"]}
+    if not image_records.update_tags(ddb, key, tag_codec.item_tags(item), item["tags"], table_name = table_name,
+                                     tag_format = "map"):
+        return "concurrent"
+
+    return "migrated"
+
+def process_segment(ddb, args, segment, checkpoint):
+    """
+    Scan one segment of the table and rewrite the items in the old format
+
+    Returns
+    -------
+    :return dictionary of counts for the segment
+    """
+
+    stats = {"scanned": 0, "migrated": 0, "concurrent": 0}
+    position = checkpoint.get(segment)
+    if position == "done":
+        return stats
+
+    while True:
+        scan_args = {
+            "TableName": args.table,
+            "Segment": segment,
+            "TotalSegments": args.segments,
+            "ProjectionExpression": "user_id, thumbnail_url, tags, class_counts"
+        }
+        if position is not None:
+            scan_args["ExclusiveStartKey"] = position
+
+        page = ddb.scan(**scan_args)
+
+        for item in page["Items"]:
+            result = migrate_item(ddb, args.table, item, args.dry_run)
+            if result != "current":
+                stats[result] += 1
+        stats["scanned"] += len(page["Items"])
+
+        # A dry run leaves the checkpoint alone, so the real run scans everything
+        position = page.get("LastEvaluatedKey")
+        if not args.dry_run:
+            checkpoint.set(segment, position if position is not None else "done")
+        print(f"Segment {segment}: {stats}")
+
+        if position is None:
+            return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--table", default = image_records.ddb_table_name)
+    parser.add_argument("--segments", type = int, default = 4, help = "parallel scan segments")
+    parser.add_argument("--checkpoint", default = "migrate_tags.checkpoint")
+    parser.add_argument("--dry-run", action = "store_true", help = "count items to migrate without writing them")
+    args = parser.parse_args()
+
+    checkpoint = Checkpoint(args.checkpoint)
+    ddb = boto3.client('dynamodb')
+
+    stats = dict()
+    with concurrent.futures.ThreadPoolExecutor(max_workers = args.segments) as executor:
+        futures = [executor.submit(process_segment, ddb, args, segment, checkpoint)
+                   for segment in range(args.segments)]
+        for future in futures:
+            for name, count in future.result().items():
+                stats[name] = stats.get(name, 0) + count
+
+    print(f"Done: {stats}")
@@ -0,0 +1,153 @@
+"""
+Recompute image tags from the raw detections stored on each item, at new
+thresholds and without running the model.
+
+The images table is scanned in parallel segments. Tags are rebuilt from the
+"detections" attribute written by the detector, and only items whose tags
+change are written back. Updates set the tags alone and are conditional on
+the tags read by the scan, so a concurrent edit or re-detection wins and
+the item is counted as concurrent. The tag index follows through the
+update-tag-index stream trigger. Items whose tags were edited by their
+owner are left alone unless --include-edited is given. The scan position of
+every segment is saved to a checkpoint file, so a stopped run resumes.
+
+Usage: python tools/recompute_tags.py [--profile accurate-608]
+       [--conf-threshold 0.3] [--nms-threshold 0.1] [--tag-threshold 0.6]
+       [--segments 4] [--checkpoint recompute.checkpoint] [--dry-run]
+"""
+
+import os
+import sys
+import argparse
+import concurrent.futures
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "layers", "pixtag-common", "python"))
+
+import boto3
+import image_records
+import tag_codec
+import yolo_detector
+import detection_codec
+import inference_profiles
+from scan_checkpoint import Checkpoint
+
+# Bundled YOLO configs
+configs_root = os.path.join(root, "lambdas", "object-detect-lambda", "yolo_tiny_configs")
+
+def recompute_item(item, labels, profile, class_aware):
+    """
+    Rebuild the tags of one item from its stored detections
+
+    Returns
+    -------
+    :return dictionary of tag to count, or None if the item has no detections
+    """
+
+    if "detections" not in item:
+        return None
+
+    detections, stored_threshold = detection_codec.unpack_detections(item["detections"]["B"])
+    if profile["conf_threshold"] < stored_threshold - 1e-6:
+        print(f"Detections of {item['thumbnail_url']['S']} were kept at {stored_threshold:.2f}, "
+              f"lower thresholds cannot recover dropped candidates")
+
+    tags = yolo_detector.tags_from_detections(detections, labels, profile, class_aware)
+
+    return image_records.count_tags(tags)
+
+def process_segment(ddb, args, segment, labels, profile, checkpoint):
+    """
+    Scan one segment of the table and rewrite the items whose tags change
+
+    Returns
+    -------
+    :return dictionary of counts for the segment
+    """
+
+    stats = {"scanned": 0, "changed": 0, "edited": 0, "no_detections": 0, "empty": 0, "concurrent": 0}
+    position = checkpoint.get(segment)
+    if position == "done":
+        return stats
+
+    while True:
+        scan_args = {
+            "TableName": args.table,
+            "Segment": segment,
+            "TotalSegments": args.segments
+        }
+        if position is not None:
+            scan_args["ExclusiveStartKey"] = position
+
+        page = ddb.scan(**scan_args)
+
+        for item in page["Items"]:
+            stats["scanned"] += 1
+            if "tags_edited" in item and not args.include_edited:
+                stats["edited"] += 1
+                continue
+
+            tag_counts = recompute_item(item, labels, profile, args.class_aware)
+            if tag_counts is None:
+                stats["no_detections"] += 1
+                continue
+
+            current_tags = tag_codec.item_tags(item)
+            if tag_counts != current_tags:
+                # Tags the new thresholds reject are removed, even the last one
+                if len(tag_counts) == 0:
+                    stats["empty"] += 1
+                    print(f"No tags left for {item['thumbnail_url']['S']}, removing {current_tags}")
+
+                # Only the tags are written, and only if nobody changed
+                # them since the scan
+                key = {"user_id": item["user_id"], "thumbnail_url": item["thumbnail_url"]}
+                if args.dry_run or image_records.update_tags(ddb, key, tag_counts, item.get("tags"),
+                                                             table_name = args.table):
+                    stats["changed"] += 1
+                else:
+                    stats["concurrent"] += 1
+
+        # A dry run leaves the checkpoint alone, so the real run scans everything
+        position = page.get("LastEvaluatedKey")
+        if not args.dry_run:
+            checkpoint.set(segment, position if position is not None else "done")
+        print(f"Segment {segment}: {stats}")
+
+        if position is None:
+            return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--table", default = image_records.ddb_table_name)
+    parser.add_argument("--labels", default = os.path.join(configs_root, "coco.names"))
+    parser.add_argument("--profile", default = "accurate-608", help = "profile the thresholds start from")
+    parser.add_argument("--conf-threshold", type = float)
+    parser.add_argument("--nms-threshold", type = float)
+    parser.add_argument("--tag-threshold", type = float)
+    parser.add_argument("--class-aware", action = "store_true", help = "run non-maxima suppression per class")
+    parser.add_argument("--include-edited", action = "store_true", help = "also rewrite tags edited by users")
+    parser.add_argument("--segments", type = int, default = 4, help = "parallel scan segments")
+    parser.add_argument("--checkpoint", default = "recompute.checkpoint")
+    parser.add_argument("--dry-run", action = "store_true", help = "count changes without writing them")
+    args = parser.parse_args()
+
+    profile = inference_profiles.get_profile(args.profile)
+    for name in ("conf_threshold", "nms_threshold", "tag_threshold"):
+        if getattr(args, name) is not None:
+            profile[name] = getattr(args, name)
+    print(f"Recomputing tags with: {profile}")
+
+    labels = open(args.labels).read().strip().split("\n")
+    checkpoint = Checkpoint(args.checkpoint)
+    ddb = boto3.client('dynamodb')
+
+    stats = dict()
+    with concurrent.futures.ThreadPoolExecutor(max_workers = args.segments) as executor:
+        futures = [executor.submit(process_segment, ddb, args, segment, labels, profile, checkpoint)
+                   for segment in range(args.segments)]
+        for future in futures:
+            for name, count in future.result().items():
+                stats[name] = stats.get(name, 0) + count
+
+    print(f"Done: {stats}")
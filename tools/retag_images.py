@@ -0,0 +1,295 @@
+"""
+Re-tag every image of the corpus with the current model and thresholds.
+
+Keys are listed from the images/ prefix of an S3 bucket, or from a local
+directory laid out as <dir>/<user_id>/<file name>. Decode and inference are
+spread over a process pool with one model per worker, and tags are written
+back to the images table. Each update sets the tags, class counts and
+detections alone, conditional on the tags read just before, so a
+concurrent upload or edit wins. Items whose tags were edited by their owner
+are left alone unless --include-edited is given. The tag index follows
+through the update-tag-index stream trigger. Finished keys are appended to
+a checkpoint file, so a stopped run resumes where it left off, dry runs
+leave it untouched.
+
+Usage: python tools/retag_images.py --bucket g74-a3 --weights yolov3-tiny.weights
+       [--local-dir DIR] [--workers 4] [--batch-size 8] [--profile accurate-608]
+       [--checkpoint retag.checkpoint] [--include-edited] [--dry-run]
+"""
+
+import os
+import sys
+import time
+import argparse
+import concurrent.futures
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "layers", "pixtag-common", "python"))
+
+import boto3
+import numpy as np
+import image_decode
+import image_records
+import tag_codec
+import detection_codec
+import model_registry
+import yolo_detector
+import inference_profiles
+
+# Bundled YOLO configs
+configs_root = os.path.join(root, "lambdas", "object-detect-lambda", "yolo_tiny_configs")
+
+# Image file extensions picked up from a local directory
+image_extensions = (".jpg", ".jpeg", ".png", ".webp")
+
+# Per-worker state, set up once by init_worker
+worker = dict()
+
+def list_s3_keys(s3, bucket, prefix):
+    """
+    List every image key under a prefix of an S3 bucket
+
+    Returns
+    -------
+    :return generator of keys
+    """
+
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket = bucket, Prefix = f"{prefix}/"):
+        for entry in page.get("Contents", []):
+            # Keys are images/<user_id>/<file name>
+            if len(entry["Key"].split("/")) == 3 and entry["Key"].lower().endswith(image_extensions):
+                yield entry["Key"]
+
+def list_local_keys(local_dir, prefix):
+    """
+    List every image of a local <dir>/<user_id>/<file name> tree as S3 keys
+
+    Returns
+    -------
+    :return generator of keys
+    """
+
+    for user_id in sorted(os.listdir(local_dir)):
+        user_dir = os.path.join(local_dir, user_id)
+        if not os.path.isdir(user_dir):
+            continue
+        for file_name in sorted(os.listdir(user_dir)):
+            if file_name.lower().endswith(image_extensions):
+                yield f"{prefix}/{user_id}/{file_name}"
+
+def load_checkpoint(path):
+    """
+    Read the keys finished by earlier runs
+
+    Returns
+    -------
+    :return set of keys
+    """
+
+    if path is None or not os.path.exists(path):
+        return set()
+
+    with open(path) as checkpoint_file:
+        return set(line.strip() for line in checkpoint_file if line.strip() != "")
+
+def init_worker(config_path, weights_path, labels_path, profile_name, bucket, local_dir):
+    """
+    Load the model and clients once per worker process
+    """
+
+    worker["profile"] = inference_profiles.get_profile(profile_name)
+    worker["labels"] = open(labels_path).read().strip().split("\n")
+    worker["model"] = model_registry.load_model(config_path, weights_path, size = worker["profile"]["input_size"])
+    worker["bucket"] = bucket
+    worker["local_dir"] = local_dir
+    worker["s3"] = None if local_dir else boto3.client('s3')
+
+def read_buffer(key):
+    """
+    Read the encoded bytes of an image key in a worker
+
+    Returns
+    -------
+    :return uint8 array
+    """
+
+    if worker["local_dir"]:
+        user_id, file_name = key.split("/")[-2:]
+        with open(os.path.join(worker["local_dir"], user_id, file_name), "rb") as image_file:
+            return np.frombuffer(image_file.read(), dtype = np.uint8)
+
+    image_object = worker["s3"].get_object(Bucket = worker["bucket"], Key = key)
+    return image_decode.read_body(image_object['Body'])
+
+def tag_keys(keys, batch_size):
+    """
+    Decode and tag a chunk of keys in a worker
+
+    Returns
+    -------
+    :return list of (key, (tags, packed detections) or None, error message or None)
+    """
+
+    results = list()
+    images = list()
+    tiled = list()
+    decoded_keys = list()
+
+    for key in keys:
+        try:
+            image, image_tiled = yolo_detector.decode_for_detection(read_buffer(key), worker["profile"])
+            images.append(image)
+            tiled.append(image_tiled)
+            decoded_keys.append(key)
+        except Exception as e:
+            results.append((key, None, str(e)))
+
+    if len(images) != 0:
+        # A failed forward pass fails the decoded keys of the chunk, not the run
+        try:
+            batch_detections = yolo_detector.detect_batch(images, worker["model"], worker["profile"],
+                                                          batch_size = batch_size, tiled = tiled)
+        except Exception as e:
+            return results + [(key, None, f"Detection failed: {e}") for key in decoded_keys]
+
+        for key, detections in zip(decoded_keys, batch_detections):
+            tags = yolo_detector.tags_from_detections(detections, worker["labels"], worker["profile"])
+            packed = detection_codec.pack_detections(detections, worker["profile"]["conf_threshold"])
+            results.append((key, (tags, packed), None))
+
+    return results
+
+def chunks(keys, size):
+    """
+    Group an iterable of keys into lists of at most size keys
+    """
+
+    chunk = list()
+    for key in keys:
+        chunk.append(key)
+        if len(chunk) == size:
+            yield chunk
+            chunk = list()
+    if len(chunk) != 0:
+        yield chunk
+
+class Writer:
+    """
+    Writes the new tags of every image with a conditional UpdateItem, then
+    records the keys in the checkpoint file. Items whose tags were edited by
+    their owner are left alone unless include_edited is set, and a dry run
+    writes neither the table nor the checkpoint.
+    """
+
+    def __init__(self, ddb, table_name, checkpoint_path, dry_run, include_edited = False):
+        self.ddb = ddb
+        self.table_name = table_name
+        self.checkpoint_path = checkpoint_path
+        self.dry_run = dry_run
+        self.include_edited = include_edited
+        self.keys = list()
+        self.stats = {"written": 0, "edited": 0, "concurrent": 0}
+
+    def add(self, key, item):
+        if self.dry_run:
+            self.stats["written"] += 1
+            return
+
+        item_key = {"user_id": item["user_id"], "thumbnail_url": item["thumbnail_url"]}
+        current = self.ddb.get_item(TableName = self.table_name, Key = item_key, ConsistentRead = True,
+                                    ProjectionExpression = "tags, tags_edited").get("Item", {})
+
+        if "tags_edited" in current and not self.include_edited:
+            self.stats["edited"] += 1
+        elif image_records.update_tags(self.ddb, item_key, tag_codec.item_tags(item), current.get("tags"),
+                                       {name: item[name] for name in ("image_url", "detections")},
+                                       self.table_name):
+            self.stats["written"] += 1
+        else:
+            # Tags changed since they were read, the newer write wins
+            self.stats["concurrent"] += 1
+
+        self.keys.append(key)
+        if len(self.keys) >= 4 * image_records.batch_write_limit:
+            self.flush()
+
+    def flush(self):
+        if self.checkpoint_path is not None and len(self.keys) != 0:
+            with open(self.checkpoint_path, "a") as checkpoint_file:
+                checkpoint_file.write("".join(f"{key}\n" for key in self.keys))
+
+        self.keys = list()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bucket", required = True, help = "images bucket, also used to build the item URLs")
+    parser.add_argument("--local-dir", help = "read images from <dir>/<user_id>/<file name> instead of S3")
+    parser.add_argument("--prefix", default = image_records.images_prefix)
+    parser.add_argument("--table", default = image_records.ddb_table_name)
+    parser.add_argument("--weights", required = True, help = "path to yolov3-tiny.weights")
+    parser.add_argument("--config", default = os.path.join(configs_root, "yolov3-tiny.cfg"))
+    parser.add_argument("--labels", default = os.path.join(configs_root, "coco.names"))
+    parser.add_argument("--profile", default = "accurate-608")
+    parser.add_argument("--workers", type = int, default = os.cpu_count())
+    parser.add_argument("--batch-size", type = int, default = 8, help = "images per forward pass and per task")
+    parser.add_argument("--include-edited", action = "store_true", help = "also rewrite tags edited by users")
+    parser.add_argument("--checkpoint", default = "retag.checkpoint", help = "file of finished keys")
+    parser.add_argument("--dry-run", action = "store_true", help = "tag images without writing to DynamoDB")
+    args = parser.parse_args()
+
+    done = load_checkpoint(args.checkpoint)
+    if args.local_dir:
+        keys = list_local_keys(args.local_dir, args.prefix)
+    else:
+        keys = list_s3_keys(boto3.client('s3'), args.bucket, args.prefix)
+    keys = [key for key in keys if key not in done]
+    print(f"{len(keys)} images to re-tag, {len(done)} already done")
+
+    writer = Writer(boto3.client('dynamodb'), args.table, args.checkpoint, args.dry_run, args.include_edited)
+    progress = {"processed": 0, "failed": 0, "start": time.time()}
+
+    def collect(future):
+        """
+        Write the tags of a finished chunk
+        """
+
+        for key, result, error in future.result():
+            progress["processed"] += 1
+            if error is not None:
+                progress["failed"] += 1
+                print(f"Failed to re-tag {key}: {error}")
+                continue
+
+            tags, packed = result
+            user_id, file_name = key.split("/")[-2:]
+            # Images left without tags are written too, dropping their stale tags
+            tag_counts = image_records.count_tags(tags)
+            writer.add(key, image_records.build_item(args.bucket, user_id, file_name, tag_counts, packed))
+
+        elapsed = time.time() - progress["start"]
+        rate = progress["processed"] / max(elapsed, 1e-9)
+        print(f"Progress: {progress['processed']}/{len(keys)} images, {progress['failed']} failed, "
+              f"{rate:.1f} images/s, ETA {(len(keys) - progress['processed']) / max(rate, 1e-9):.0f}s")
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers = args.workers, initializer = init_worker,
+            initargs = (args.config, args.weights, args.labels, args.profile, args.bucket, args.local_dir)) as executor:
+
+        # Keep a bounded number of chunks in flight
+        pending = set()
+        for chunk in chunks(keys, args.batch_size):
+            pending.add(executor.submit(tag_keys, chunk, args.batch_size))
+            if len(pending) >= args.workers * 2:
+                finished, pending = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    collect(future)
+
+        for future in concurrent.futures.as_completed(pending):
+            collect(future)
+
+    writer.flush()
+
+    elapsed = time.time() - progress["start"]
+    print(f"Re-tagged {progress['processed'] - progress['failed']} images, {progress['failed']} failed, "
+          f"in {elapsed:.1f}s ({progress['processed'] / max(elapsed, 1e-9):.1f} images/s), writes: {writer.stats}")
@@ -0,0 +1,32 @@
+"""
+Scan checkpoints shared by the table maintenance tools: the position of
+every parallel scan segment, saved as JSON so a stopped run resumes.
+"""
+
+import os
+import json
+import threading
+
+class Checkpoint:
+    """
+    Scan position of every segment, saved after each processed page
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.positions = dict()
+        if path is not None and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self.positions = json.load(checkpoint_file)
+
+    def get(self, segment):
+        return self.positions.get(str(segment))
+
+    def set(self, segment, position):
+        with self.lock:
+            self.positions[str(segment)] = position
+            if self.path is not None:
+                with open(f"{self.path}.tmp", "w") as checkpoint_file:
+                    json.dump(self.positions, checkpoint_file)
+                os.replace(f"{self.path}.tmp", self.path)
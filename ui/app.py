@@ -207,10 +207,8 @@ def search_by_tags():
 
             # Get image links for given tags
             request_body = {"tags": tags_list}
-            tags_response = requests.post(Endpoints.SEARCH_BY_TAGS.value, 
-                                    json = request_body,
-                                    headers = helper.format_header(app.config['jwt_token']))
-            tags_response = helper.get_response_dict(tags_response)
+            tags_response = helper.search(Endpoints.SEARCH_BY_TAGS.value, request_body,
+                                          helper.format_header(app.config['jwt_token']), "links")
             
             if "links" not in tags_response:
                 return render_template("home.html", error = True, error_message = "No images found for given tags.")
@@ -220,17 +218,18 @@ def search_by_tags():
                 all_found_tags.append(link)
             
             # Get image base64 encoded strings for all images
-            image_request_body = {
-                "bucket_name": Config.S3_BUCKET_NAME.value,
-                "keys": s3_image_keys
-            }            
-            images_response = requests.post(Endpoints.ENCODE_IMAGE.value, 
-                                    json = image_request_body,
-                                    headers = helper.format_header(app.config['jwt_token']))
-            images_response = helper.get_response_dict(images_response)
-            
-            for image in images_response["images"]:
-                decoded_images.append(image.decode('ascii'))
+            images, errors = helper.get_images(Endpoints.ENCODE_IMAGE.value, Config.S3_BUCKET_NAME.value, s3_image_keys,
+                                               helper.format_header(app.config['jwt_token']))
+            for error in errors:
+                log.warning(f"Image {error['key']} could not be fetched: {error['message']}")
+
+            # Keep the links of the images that were fetched only
+            found_links = list()
+            for link, image in zip(all_found_tags, images):
+                if image is not None:
+                    found_links.append(link)
+                    decoded_images.append(image.decode('ascii'))
+            all_found_tags = found_links
 
             return render_template(
                 "home.html", 
@@ -333,10 +332,8 @@ def search_by_image():
             request_body = {
                 "image": image_string.decode()
             }
-            image_search_response = requests.post(Endpoints.SEARCH_BY_IMAGE.value, 
-                                    json = request_body,
-                                    headers = helper.format_header(app.config['jwt_token']))
-            image_search_response = helper.get_response_dict(image_search_response)
+            image_search_response = helper.search(Endpoints.SEARCH_BY_IMAGE.value, request_body,
+                                                  helper.format_header(app.config['jwt_token']), "thumbnail_urls")
             
             
             if "thumbnail_urls" not in image_search_response or len(image_search_response["thumbnail_urls"]) == 0:
@@ -348,18 +345,18 @@ def search_by_image():
             for url in image_search_response["thumbnail_urls"]:
                 s3_image_keys.append(url.split(f"https://{Config.S3_BUCKET_NAME.value}.s3.amazonaws.com/")[1])
 
-            # Get image base64 encoded strings for all images
-            image_request_body = {
-                "bucket_name": Config.S3_BUCKET_NAME.value,
-                "keys": s3_image_keys
-            }            
-            images_response = requests.post(Endpoints.ENCODE_IMAGE.value, 
-                                    json = image_request_body,
-                                    headers = helper.format_header(app.config['jwt_token']))
-            images_response = helper.get_response_dict(images_response)
-            
-            for image in images_response["images"]:
-                decoded_images.append(image.decode('ascii'))
+            # Get thumbnail base64 encoded strings for all images
+            images, errors = helper.get_images(Endpoints.ENCODE_IMAGE.value, Config.S3_BUCKET_NAME.value, s3_image_keys,
+                                               helper.format_header(app.config['jwt_token']), previews = True)
+            for error in errors:
+                log.warning(f"Thumbnail {error['key']} could not be fetched: {error['message']}")
+
+            # Keep the URLs of the thumbnails that were fetched only
+            thumbnail_urls = list()
+            for url, image in zip(image_search_response["thumbnail_urls"], images):
+                if image is not None:
+                    thumbnail_urls.append(url)
+                    decoded_images.append(image.decode('ascii'))
 
             return render_template(
                 "home.html", 
@@ -369,7 +366,7 @@ def search_by_image():
                 tags = tags,
                 thumbnails = decoded_images,
                 search_by_image = True,
-                thumbnail_urls = image_search_response["thumbnail_urls"]
+                thumbnail_urls = thumbnail_urls
             )
         
         except Exception as e:
@@ -1,4 +1,5 @@
 import json
+import requests
 
 def format_header(token):
     """
@@ -30,4 +31,74 @@ def get_response_dict(response):
     :return json response body
     """
 
-    return eval(response.text)
\ No newline at end of file
+    return eval(response.text)
+
+def get_images(endpoint, bucket_name, keys, headers, previews = False):
+    """
+    Fetches base64 encoded images for S3 keys, following the pages
+    of the encode image API
+
+    Parameters
+    ----------
+    :param endpoint: encode image API URL
+    :param bucket_name: S3 bucket holding the images
+    :param keys: S3 keys to fetch
+    :param headers: request headers
+    :param previews: fetch thumbnails instead of full images
+
+    Returns
+    -------
+    :return list of base64 encoded images in key order, None for every key
+            that failed, and the list of errors with the "key" and
+            "message" of every failed key
+    """
+
+    fetched = dict()
+    errors = list()
+    cursor = None
+    while True:
+        # The API evaluates the body as a Python literal, so no JSON
+        # booleans or nulls
+        request_body = {
+            "bucket_name": bucket_name,
+            "keys": keys,
+            "previews": 1 if previews else 0
+        }
+        if cursor is not None:
+            request_body["cursor"] = cursor
+        response = get_response_dict(requests.post(endpoint, json = request_body, headers = headers))
+
+        # Failed keys are left out of "images", "keys" tells which key
+        # every image belongs to
+        fetched.update(zip(response["keys"], response["images"]))
+        errors.extend(response["errors"])
+
+        cursor = response.get("next_cursor")
+        if cursor is None:
+            return [fetched.get(key) for key in keys], errors
+
+def search(endpoint, request_body, headers, results_key):
+    """
+    Calls a search API, following its pages until every result is read
+
+    Parameters
+    ----------
+    :param endpoint: search API URL
+    :param request_body: search request body
+    :param headers: request headers
+    :param results_key: response key holding the results of a page
+
+    Returns
+    -------
+    :return response of the first page, with the results of every page
+    """
+
+    response = get_response_dict(requests.post(endpoint, json = request_body, headers = headers))
+    page = response
+    while "next_cursor" in page:
+        page = get_response_dict(requests.post(endpoint, json = dict(request_body, cursor = page["next_cursor"]),
+                                               headers = headers))
+        response[results_key] = response.get(results_key, []) + page.get(results_key, [])
+
+    response.pop("next_cursor", None)
+    return response